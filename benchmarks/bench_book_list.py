@@ -0,0 +1,141 @@
+"""
+Бенчмарк списка книг (GET /books): обычный путь (объекты ORM, схемы
+pydantic для каждой книги, JSONResponse) против быстрого (FAST_BOOK_LIST:
+столбцы кортежами и сразу в JSON через orjson).
+
+Создаёт временную SQLite базу с библиотекой одного пользователя (по
+умолчанию 10 000 книг, у половины есть прогресс, у части - рецензии) и
+запрашивает список через приложение (TestClient) в нескольких вариантах.
+Для каждого варианта проверяется, что оба пути отдают одинаковые байты.
+Кеш ответов отключён - измеряется построение ответа.
+
+    python benchmarks/bench_book_list.py
+    python benchmarks/bench_book_list.py --books 20000 --iterations 30 --json result.json
+"""
+import argparse
+import json
+import os
+import random
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+VARIANTS = [
+    ("все поля", "/books"),
+    ("прогресс и рецензии", "/books?include=progress,review_stats"),
+    ("только id, title, author", "/books?fields=id,title,author"),
+    ("страница 500 книг", "/books?include=progress,review_stats&limit=500&sort=title"),
+]
+TITLES = ["Война и мир", "Анна Каренина", "Fluent Python", "Design \"Patterns\"", "Tab\tand\nnewline", "Эмодзи 📚"]
+
+
+def seed(path, books):
+    conn = sqlite3.connect(path)
+    started = datetime(2024, 1, 1, 12, 0, 0)
+    rows = []
+    progress = []
+    for i in range(1, books + 1):
+        # Часть дат без микросекунд - у isoformat они пропускаются
+        created_at = started + timedelta(seconds=i, microseconds=0 if i % 3 else i)
+        reviews = random.randint(0, 5) if i % 4 == 0 else 0
+        rows.append((
+            i, f"{random.choice(TITLES)} {i}", f"Автор {i % 300}", None if i % 5 else "Описание " * 20,
+            random.randint(50, 900), 1, created_at, reviews, sum(random.randint(1, 5) for _ in range(reviews)),
+        ))
+        if i % 2:
+            progress.append((i, 1, i, random.randint(0, 50), i % 10 == 1, created_at + timedelta(days=1)))
+    conn.executemany(
+        "INSERT INTO books (id, title, author, description, total_pages, owner_id, created_at, review_count, rating_sum) "
+        "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+        rows,
+    )
+    conn.executemany(
+        "INSERT INTO reading_progress (id, user_id, book_id, current_page, is_finished, updated_at) VALUES (?, ?, ?, ?, ?, ?)",
+        progress,
+    )
+    conn.commit()
+    conn.close()
+
+
+def measure(client, headers, url, iterations):
+    timings = []
+    body = b""
+    for _ in range(iterations):
+        started = time.perf_counter()
+        response = client.get(url, headers=headers)
+        timings.append((time.perf_counter() - started) * 1000)
+        assert response.status_code == 200, response.text
+        body = response.content
+    timings.sort()
+    return body, {
+        "mean_ms": round(statistics.mean(timings), 2),
+        "p50_ms": round(timings[len(timings) // 2], 2),
+        "p95_ms": round(timings[min(len(timings) - 1, int(len(timings) * 0.95))], 2),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--books", type=int, default=10_000)
+    parser.add_argument("--iterations", type=int, default=20)
+    parser.add_argument("--json", help="куда сохранить результаты")
+    args = parser.parse_args()
+    json_path = os.path.abspath(args.json) if args.json else None
+    random.seed(42)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        # Настройки читаются при импорте приложения
+        os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(tmp, 'bench.db')}"
+        os.environ["RESPONSE_CACHE_MAX_BYTES"] = "0"
+        os.environ["PASSWORD_WORKERS"] = "0"
+        os.chdir(ROOT)
+        sys.path.insert(0, ROOT)
+        from fastapi.testclient import TestClient
+        import database
+        import fast_json
+        import main as app_main
+        import migrations
+
+        print(f"🔄 Заполнение базы: {args.books} книг...")
+        migrations.upgrade(database.engine)
+        results = {}
+        with TestClient(app_main.app) as client:
+            client.post("/register", json={"username": "reader", "password": "secret"})
+            token = client.post("/login", json={"username": "reader", "password": "secret"}).json()["access_token"]
+            headers = {"Authorization": f"Bearer {token}"}
+            seed(database.engine.url.database, args.books)
+
+            for name, url in VARIANTS:
+                app_main.FAST_BOOK_LIST = False
+                regular_body, regular = measure(client, headers, url, args.iterations)
+                app_main.FAST_BOOK_LIST = True
+                fast_body, fast = measure(client, headers, url, args.iterations)
+                results[name] = {
+                    "url": url,
+                    "bytes": len(regular_body),
+                    "identical": regular_body == fast_body,
+                    "regular": regular,
+                    "fast": fast,
+                }
+        database.engine.dispose()
+
+    print(f"🔧 Кодировщик быстрого пути: {'orjson' if fast_json.orjson is not None else 'json (orjson не установлен)'}")
+    for name, result in results.items():
+        speedup = result["regular"]["p50_ms"] / result["fast"]["p50_ms"]
+        mark = "✅" if result["identical"] else "❌ ответы различаются"
+        print(f"📊 {name} ({result['bytes'] // 1024} КБ): обычный p50 {result['regular']['p50_ms']:.1f} мс, "
+              f"быстрый p50 {result['fast']['p50_ms']:.1f} мс - в {speedup:.1f} раза {mark}")
+    if json_path:
+        with open(json_path, "w") as f:
+            json.dump({"books": args.books, "iterations": args.iterations, "variants": results}, f, ensure_ascii=False, indent=2)
+    if not all(result["identical"] for result in results.values()):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
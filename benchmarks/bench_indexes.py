@@ -0,0 +1,177 @@
+"""
+Бенчмарк индексов для горячих запросов API.
+
+Создаёт временную SQLite базу по схеме models.py, заполняет её синтетическими
+данными (по умолчанию 1 000 000 книг, записей прогресса и рецензий), затем
+измеряет запросы из main.py без составных индексов и с ними и печатает
+планы запросов (EXPLAIN QUERY PLAN) и задержки.
+
+    python benchmarks/bench_indexes.py
+    python benchmarks/bench_indexes.py --rows 200000 --iterations 50 --json result.json
+"""
+import argparse
+import json
+import os
+import random
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import create_engine  # noqa: E402
+from sqlalchemy.schema import CreateIndex  # noqa: E402
+
+import models  # noqa: E402
+
+# Индексы, добавленные для горячих запросов (остальные существовали и раньше)
+NEW_INDEXES = [
+    "ix_books_owner_created",
+    "ix_books_owner_title",
+    "ix_books_owner_author",
+    "uq_reading_progress_user_book",
+    "ix_reading_progress_book_id",
+    "ix_reviews_book_created",
+]
+
+# (название, SQL, функция параметров) - те же формы запросов, что в main.py
+QUERIES = [
+    (
+        "get_books: книги владельца, первая страница",
+        "SELECT id, title, author, total_pages, created_at FROM books "
+        "WHERE owner_id = ? ORDER BY created_at, id LIMIT 50",
+        lambda s: (random.randint(1, s["users"]),),
+    ),
+    (
+        "read_book: книга по (id, owner_id)",
+        "SELECT * FROM books WHERE id = ? AND owner_id = ?",
+        lambda s: (lambda book: (book, book % s["users"] + 1))(random.randint(1, s["books"])),
+    ),
+    (
+        "get_progress: прогресс по (book_id, user_id)",
+        "SELECT * FROM reading_progress WHERE book_id = ? AND user_id = ?",
+        lambda s: (lambda book: (book, book % s["users"] + 1))(random.randint(1, s["books"])),
+    ),
+    (
+        "include=progress: прогресс для страницы книг",
+        "SELECT * FROM reading_progress WHERE book_id IN (" + ",".join("?" * 50) + ")",
+        lambda s: tuple(random.randint(1, s["books"]) for _ in range(50)),
+    ),
+    (
+        "reviews: рецензии книги",
+        "SELECT * FROM reviews WHERE book_id = ? ORDER BY created_at, id LIMIT 20",
+        lambda s: (random.randint(1, s["books"]),),
+    ),
+    (
+        "review_stats: агрегаты рецензий по книгам владельца",
+        "SELECT reviews.book_id, COUNT(reviews.id), AVG(reviews.rating) FROM reviews "
+        "JOIN books ON books.id = reviews.book_id WHERE books.owner_id = ? GROUP BY reviews.book_id",
+        lambda s: (random.randint(1, s["users"]),),
+    ),
+]
+
+
+def seed(path, rows, users):
+    """Схема из models.py (без новых индексов) + синтетические данные"""
+    engine = create_engine(f"sqlite:///{path}")
+    models.Base.metadata.create_all(bind=engine)
+    engine.dispose()
+
+    conn = sqlite3.connect(path)
+    conn.execute("PRAGMA journal_mode=OFF")
+    conn.execute("PRAGMA synchronous=OFF")
+    for name in NEW_INDEXES:
+        conn.execute(f"DROP INDEX IF EXISTS {name}")
+    start = datetime(2020, 1, 1)
+    conn.executemany(
+        "INSERT INTO users (id, username, email, hashed_password, created_at) VALUES (?, ?, ?, 'x', ?)",
+        ((i, f"user{i}", f"user{i}@example.com", start) for i in range(1, users + 1)),
+    )
+    conn.executemany(
+        "INSERT INTO books (id, title, author, description, total_pages, owner_id, created_at) VALUES (?, ?, ?, ?, ?, ?, ?)",
+        (
+            (i, f"Book {i}", f"Author {i % 5000}", "x" * 200, 300, i % users + 1, start + timedelta(seconds=i))
+            for i in range(1, rows + 1)
+        ),
+    )
+    conn.executemany(
+        "INSERT INTO reading_progress (id, user_id, book_id, current_page, is_finished, updated_at) VALUES (?, ?, ?, ?, 0, ?)",
+        ((i, i % users + 1, i, i % 300, start) for i in range(1, rows + 1)),
+    )
+    conn.executemany(
+        "INSERT INTO reviews (id, user_id, book_id, rating, text, created_at) VALUES (?, ?, ?, ?, NULL, ?)",
+        ((i, i % users + 1, random.randint(1, rows), i % 5 + 1, start + timedelta(seconds=i)) for i in range(1, rows + 1)),
+    )
+    conn.commit()
+    conn.execute("ANALYZE")
+    return conn
+
+
+def create_new_indexes(conn):
+    dialect = create_engine("sqlite://").dialect
+    for table in models.Base.metadata.sorted_tables:
+        for index in table.indexes:
+            if index.name in NEW_INDEXES:
+                conn.execute(str(CreateIndex(index).compile(dialect=dialect)))
+    conn.commit()
+    conn.execute("ANALYZE")
+
+
+def measure(conn, sizes, iterations):
+    results = {}
+    for name, sql, params in QUERIES:
+        plan = [row[3] for row in conn.execute("EXPLAIN QUERY PLAN " + sql, params(sizes))]
+        timings = []
+        for _ in range(iterations):
+            args = params(sizes)
+            started = time.perf_counter()
+            conn.execute(sql, args).fetchall()
+            timings.append((time.perf_counter() - started) * 1000)
+        timings.sort()
+        results[name] = {
+            "plan": plan,
+            "mean_ms": round(statistics.mean(timings), 3),
+            "p50_ms": round(timings[len(timings) // 2], 3),
+            "p95_ms": round(timings[min(len(timings) - 1, int(len(timings) * 0.95))], 3),
+        }
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=1_000_000, help="книг, записей прогресса и рецензий")
+    parser.add_argument("--users", type=int, default=10_000)
+    parser.add_argument("--iterations", type=int, default=20)
+    parser.add_argument("--json", help="куда сохранить результаты")
+    args = parser.parse_args()
+    random.seed(42)
+
+    sizes = {"users": args.users, "books": args.rows}
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "bench.db")
+        print(f"🔄 Заполнение базы: {args.rows} строк в books/reading_progress/reviews...")
+        started = time.perf_counter()
+        conn = seed(path, args.rows, args.users)
+        print(f"   готово за {time.perf_counter() - started:.1f} с")
+
+        before = measure(conn, sizes, args.iterations)
+        create_new_indexes(conn)
+        after = measure(conn, sizes, args.iterations)
+        conn.close()
+
+    report = {"rows": args.rows, "users": args.users, "iterations": args.iterations, "queries": {}}
+    for name, _, _ in QUERIES:
+        report["queries"][name] = {"before": before[name], "after": after[name]}
+        print(f"\n📊 {name}")
+        print(f"   без индексов: {before[name]['mean_ms']:>10.3f} мс  план: {'; '.join(before[name]['plan'])}")
+        print(f"   с индексами:  {after[name]['mean_ms']:>10.3f} мс  план: {'; '.join(after[name]['plan'])}")
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
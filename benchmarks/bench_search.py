@@ -0,0 +1,149 @@
+"""
+Бенчмарк поиска по книгам (/books/search).
+
+Создаёт временную SQLite базу по схеме models.py, заполняет её синтетической
+библиотекой одного пользователя (по умолчанию 300 000 книг) и книгами других
+пользователей, строит поисковый индекс и измеряет search_index.search_book_ids
+для типичных запросов: редкое слово, частый префикс, несколько слов.
+
+    python benchmarks/bench_search.py
+    python benchmarks/bench_search.py --rows 500000 --iterations 100 --json result.json
+"""
+import argparse
+import itertools
+import json
+import os
+import random
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import create_engine  # noqa: E402
+from sqlalchemy.orm import Session  # noqa: E402
+
+import models  # noqa: E402
+import search_index  # noqa: E402
+
+WORDS = [
+    "война", "мир", "любовь", "время", "город", "море", "ночь", "дорога", "история", "жизнь",
+    "python", "data", "system", "design", "history", "garden", "river", "winter", "empire", "shadow",
+]
+SYLLABLES = ["ка", "ро", "ми", "на", "ле", "то", "ва", "зе", "ду", "ши", "por", "tal", "ven", "mi", "sto"]
+
+AUTHORS = ["Лев Толстой", "Фёдор Достоевский", "Guido van Rossum"] + [f"Author {i}" for i in range(2000)]
+
+QUERIES = [
+    ("редкое слово", "уникальное"),
+    ("частое слово (~90% книг)", "война"),
+    ("частый префикс", "вой"),
+    ("два частых слова", "война мир"),
+    ("слово из описаний (~3% книг)", "history"),
+    ("автор, префикс", "толст"),
+    ("нет совпадений", "zzzz"),
+]
+
+
+def make_vocabulary(size):
+    """Словарь: частые слова из WORDS + синтетические редкие; частоты - по закону Ципфа"""
+    words = list(WORDS)
+    while len(words) < size:
+        words.append("".join(random.choice(SYLLABLES) for _ in range(random.randint(2, 4))))
+    # Накопленные веса считаем один раз - иначе random.choices пересчитывает их на каждый вызов
+    cum_weights = list(itertools.accumulate(1 / (rank + 1) for rank in range(len(words))))
+    return words, cum_weights
+
+
+def random_text(vocabulary, count):
+    words, cum_weights = vocabulary
+    return " ".join(random.choices(words, cum_weights=cum_weights, k=count))
+
+
+def seed(path, rows, other_users, vocabulary):
+    engine = create_engine(f"sqlite:///{path}")
+    models.Base.metadata.create_all(bind=engine)
+    engine.dispose()
+
+    conn = sqlite3.connect(path)
+    conn.execute("PRAGMA journal_mode=OFF")
+    conn.execute("PRAGMA synchronous=OFF")
+    now = datetime(2020, 1, 1)
+    conn.executemany(
+        "INSERT INTO users (id, username, email, hashed_password, created_at) VALUES (?, ?, ?, 'x', ?)",
+        ((i, f"user{i}", f"user{i}@example.com", now) for i in range(1, other_users + 2)),
+    )
+
+    def books():
+        for i in range(1, rows * 2 + 1):
+            # Половина книг - у пользователя 1, остальные - у других
+            owner = 1 if i % 2 else i % other_users + 2
+            title = random_text(vocabulary, 3) + (" уникальное" if i % 50000 == 1 else "")
+            author = AUTHORS[i % len(AUTHORS)]
+            yield i, title, author, random_text(vocabulary, 30), 300, owner, now
+
+    conn.executemany(
+        "INSERT INTO books (id, title, author, description, total_pages, owner_id, created_at) VALUES (?, ?, ?, ?, ?, ?, ?)",
+        books(),
+    )
+    conn.commit()
+    conn.close()
+
+
+def measure(engine, iterations, limit):
+    results = {}
+    with Session(engine) as db:
+        for name, query in QUERIES:
+            timings = []
+            found = 0
+            for _ in range(iterations):
+                started = time.perf_counter()
+                found = len(search_index.search_book_ids(db, 1, query, limit).ids)
+                timings.append((time.perf_counter() - started) * 1000)
+            timings.sort()
+            results[name] = {
+                "query": query,
+                "found": found,
+                "mean_ms": round(statistics.mean(timings), 3),
+                "p50_ms": round(timings[len(timings) // 2], 3),
+                "p95_ms": round(timings[min(len(timings) - 1, int(len(timings) * 0.95))], 3),
+            }
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=300_000, help="книг у пользователя (столько же - у остальных)")
+    parser.add_argument("--users", type=int, default=1000, help="других пользователей")
+    parser.add_argument("--vocabulary", type=int, default=50_000, help="слов в словаре")
+    parser.add_argument("--iterations", type=int, default=50)
+    parser.add_argument("--limit", type=int, default=21, help="размер страницы (+1 для признака следующей)")
+    parser.add_argument("--json", help="куда сохранить результаты")
+    args = parser.parse_args()
+    random.seed(42)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "bench.db")
+        print(f"🔄 Заполнение базы: {args.rows * 2} книг...")
+        started = time.perf_counter()
+        seed(path, args.rows, args.users, make_vocabulary(args.vocabulary))
+        engine = create_engine(f"sqlite:///{path}")
+        with engine.connect() as conn:
+            search_index.ensure_search_index(conn)
+        print(f"   готово за {time.perf_counter() - started:.1f} с")
+        results = measure(engine, args.iterations, args.limit)
+        engine.dispose()
+
+    for name, result in results.items():
+        print(f"📊 {name} ({result['query']!r}, найдено {result['found']}): "
+              f"p50 {result['p50_ms']:.3f} мс, p95 {result['p95_ms']:.3f} мс")
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"rows": args.rows, "iterations": args.iterations, "queries": results}, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
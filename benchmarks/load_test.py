@@ -0,0 +1,450 @@
+"""
+Нагрузочный тест API: горячие сценарии против настоящего сервера.
+
+Создаёт временную базу (SQLite или пустая база из --database-url), заполняет
+её синтетическими пользователями, книгами, прогрессом и рецензиями, запускает
+uvicorn main:app и гоняет сценарии с --concurrency параллельными клиентами
+(http.client, keep-alive):
+
+  login      - шторм входов (проверка паролей);
+  dashboard  - главная страница: GET /books?include=progress,review_stats&limit=50;
+  progress   - перелистывание: POST /books/{id}/progress со следующей страницей;
+  pdf_range  - чтение PDF кусками: GET /books/{id}/pdf с Range на 64 КБ;
+  mixed      - смесь всего перечисленного в пропорциях живого трафика.
+
+Для каждого сценария - запросов в секунду, p50/p95/p99 и ошибки; с --json
+результаты сохраняются для сравнения между коммитами (--compare old.json).
+
+    python benchmarks/load_test.py
+    python benchmarks/load_test.py --users 200 --books 500 --duration 20 --json after.json --compare before.json
+    python benchmarks/load_test.py --scenarios dashboard,progress --workers 4 -e DB_PROFILE=production
+"""
+import argparse
+import http.client
+import json
+import os
+import random
+import shutil
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+PASSWORD = "benchmark-password"
+RANGE_SIZE = 64 * 1024
+SCENARIOS = ["login", "dashboard", "progress", "pdf_range", "mixed"]
+# Доли запросов в mixed: в основном перелистывание, потом главная страница
+MIXED_WEIGHTS = {"progress": 70, "dashboard": 20, "pdf_range": 8, "login": 2}
+
+
+def make_pdf(pages: int) -> bytes:
+    try:
+        import pymupdf
+    except ImportError:
+        pymupdf = None
+    if pymupdf is None:
+        # Для Range важен только размер файла
+        return b"%PDF-1.4\n" + os.urandom(pages * 4096) + b"\n%%EOF\n"
+    with pymupdf.open() as document:
+        for number in range(pages):
+            page = document.new_page()
+            page.insert_text((72, 72), f"Benchmark page {number + 1}\n" + "lorem ipsum " * 200, fontsize=9)
+        return document.tobytes()
+
+
+def seed(database_url: str, upload_dir: str, args):
+    """Схема - миграциями, данные - пачками через SQLAlchemy Core"""
+    import hashlib
+
+    from sqlalchemy import create_engine
+
+    import migrations
+    import models
+    import passwords
+    from migrate_data import reset_sequences
+
+    engine = create_engine(database_url)
+    migrations.upgrade(engine)
+
+    pdf = make_pdf(args.pdf_pages)
+    sha256 = hashlib.sha256(pdf).hexdigest()
+    pdf_path = os.path.join(upload_dir, f"{sha256}.pdf")
+    with open(pdf_path, "wb") as f:
+        f.write(pdf)
+
+    # Хеш один на всех - хеширование с рабочим числом раундов долгое
+    hashed_password = passwords.pwd_context.hash(PASSWORD)
+    start = datetime(2024, 1, 1)
+    users = [
+        {"id": i, "username": f"user{i}", "email": f"user{i}@example.com", "hashed_password": hashed_password, "created_at": start}
+        for i in range(1, args.users + 1)
+    ]
+    books, progress, reviews = [], [], []
+    book_id = 0
+    for user_id in range(1, args.users + 1):
+        for number in range(args.books):
+            book_id += 1
+            ratings = [random.randint(1, 5) for _ in range(random.randint(0, args.reviews * 2))]
+            books.append({
+                "id": book_id,
+                "title": f"Book {number} of user {user_id}",
+                "author": f"Author {book_id % 1000}",
+                "description": "Synthetic benchmark book " * 5,
+                "total_pages": args.pdf_pages,
+                "page_count": args.pdf_pages,
+                "pdf_path": pdf_path if number % 2 == 0 else None,
+                "pdf_sha256": sha256 if number % 2 == 0 else None,
+                "owner_id": user_id,
+                "created_at": start + timedelta(minutes=book_id),
+                "review_count": len(ratings),
+                "rating_sum": sum(ratings),
+            })
+            if number % 2 == 0:
+                current_page = random.randint(1, args.pdf_pages - 1)
+                progress.append({
+                    "user_id": user_id,
+                    "book_id": book_id,
+                    "current_page": current_page,
+                    "is_finished": False,
+                    "updated_at": start,
+                })
+            for rating in ratings:
+                reviews.append({
+                    "user_id": user_id,
+                    "book_id": book_id,
+                    "rating": rating,
+                    "text": "ok",
+                    "created_at": start + timedelta(minutes=book_id),
+                })
+
+    with engine.begin() as conn:
+        for table, rows in (
+            (models.User.__table__, users),
+            (models.Book.__table__, books),
+            (models.ReadingProgress.__table__, progress),
+            (models.Review.__table__, reviews),
+        ):
+            for offset in range(0, len(rows), 5000):
+                conn.execute(table.insert(), rows[offset:offset + 5000])
+    # id пользователей и книг заданы явно - сдвигаем последовательности PostgreSQL
+    reset_sequences(engine)
+    engine.dispose()
+    return {"users": len(users), "books": len(books), "progress": len(progress), "reviews": len(reviews)}
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def start_server(env: dict, port: int, workers: int):
+    process = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1", "--port", str(port),
+         "--workers", str(workers), "--log-level", "warning", "--no-access-log"],
+        cwd=ROOT,
+        env=env,
+    )
+    deadline = time.time() + 60
+    while time.time() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError("Server exited during startup")
+        try:
+            connection = http.client.HTTPConnection("127.0.0.1", port, timeout=1)
+            connection.request("GET", "/health")
+            if connection.getresponse().status == 200:
+                return process
+        except OSError:
+            time.sleep(0.2)
+    process.terminate()
+    raise RuntimeError("Server did not start in 60 s")
+
+
+class Client:
+    """Одно keep-alive соединение; request -> (статус, тело)"""
+
+    def __init__(self, port: int):
+        self.port = port
+        self.connection = None
+
+    def request(self, method: str, path: str, body=None, headers=None):
+        headers = dict(headers or {})
+        if body is not None:
+            body = json.dumps(body).encode()
+            headers["Content-Type"] = "application/json"
+        for attempt in range(2):
+            if self.connection is None:
+                self.connection = http.client.HTTPConnection("127.0.0.1", self.port, timeout=60)
+            try:
+                self.connection.request(method, path, body=body, headers=headers)
+                response = self.connection.getresponse()
+                return response.status, response.read()
+            except (http.client.HTTPException, ConnectionError):
+                # Сервер закрыл keep-alive соединение - переподключаемся один раз
+                self.connection.close()
+                self.connection = None
+                if attempt:
+                    raise
+
+
+def login(client: Client, user_id: int) -> str:
+    for _ in range(30):
+        status, body = client.request("POST", "/login", {"username": f"user{user_id}", "password": PASSWORD})
+        if status != 503:
+            break
+        # Очередь проверки паролей переполнена (Retry-After: 1)
+        time.sleep(1)
+    if status != 200:
+        raise RuntimeError(f"Login failed for user{user_id}: {status} {body[:200]!r}")
+    return json.loads(body)["access_token"]
+
+
+class Workload:
+    """Общие данные сценариев: токены пользователей, книги, текущие страницы"""
+
+    def __init__(self, args, tokens: dict, pdf_size: int):
+        self.args = args
+        self.tokens = tokens
+        self.pdf_size = pdf_size
+        self.pages = {}
+        self.lock = threading.Lock()
+
+    def user(self):
+        user_id = random.randint(1, self.args.users)
+        return user_id, {"Authorization": f"Bearer {self.tokens[user_id]}"}
+
+    def book(self, user_id: int, with_pdf: bool = False) -> int:
+        number = random.randrange(0, self.args.books, 2) if with_pdf else random.randrange(self.args.books)
+        return (user_id - 1) * self.args.books + number + 1
+
+    def next_page(self, book_id: int) -> int:
+        with self.lock:
+            page = self.pages.get(book_id, random.randint(1, self.args.pdf_pages - 1)) + 1
+            self.pages[book_id] = page if page < self.args.pdf_pages else 1
+            return self.pages[book_id]
+
+    # Один запрос сценария: (клиент) -> статус
+    def login(self, client):
+        user_id = random.randint(1, self.args.users)
+        status, _ = client.request("POST", "/login", {"username": f"user{user_id}", "password": PASSWORD})
+        return status
+
+    def dashboard(self, client):
+        _, headers = self.user()
+        status, _ = client.request("GET", "/books?include=progress,review_stats&limit=50", headers=headers)
+        return status
+
+    def progress(self, client):
+        user_id, headers = self.user()
+        book_id = self.book(user_id)
+        status, _ = client.request("POST", f"/books/{book_id}/progress", {"current_page": self.next_page(book_id)}, headers)
+        return status
+
+    def pdf_range(self, client):
+        user_id, _ = self.user()
+        first = random.randrange(0, max(1, self.pdf_size - RANGE_SIZE))
+        status, _ = client.request(
+            "GET", f"/books/{self.book(user_id, with_pdf=True)}/pdf",
+            headers={"Range": f"bytes={first}-{first + RANGE_SIZE - 1}"},
+        )
+        return status
+
+    def mixed(self, client):
+        names = list(MIXED_WEIGHTS)
+        return getattr(self, random.choices(names, weights=list(MIXED_WEIGHTS.values()))[0])(client)
+
+
+def percentile(sorted_values, fraction: float) -> float:
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * fraction))]
+
+
+def run_scenario(workload: Workload, name: str, port: int, concurrency: int, duration: float, warmup: float):
+    action = getattr(workload, name)
+    latencies = []
+    errors = {}
+    lock = threading.Lock()
+    measure_from = time.perf_counter() + warmup
+    stop_at = measure_from + duration
+
+    def worker():
+        client = Client(port)
+        local_latencies = []
+        local_errors = {}
+        while True:
+            started = time.perf_counter()
+            if started >= stop_at:
+                break
+            try:
+                status = action(client)
+            except Exception as error:
+                status = type(error).__name__
+            finished = time.perf_counter()
+            if started < measure_from:
+                continue
+            local_latencies.append((finished - started) * 1000)
+            if status not in (200, 206):
+                local_errors[str(status)] = local_errors.get(str(status), 0) + 1
+        with lock:
+            latencies.extend(local_latencies)
+            for key, count in local_errors.items():
+                errors[key] = errors.get(key, 0) + count
+
+    threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    latencies.sort()
+    return {
+        "requests": len(latencies),
+        "throughput_rps": round(len(latencies) / duration, 1),
+        "mean_ms": round(statistics.mean(latencies), 2) if latencies else 0.0,
+        "p50_ms": round(percentile(latencies, 0.50), 2),
+        "p95_ms": round(percentile(latencies, 0.95), 2),
+        "p99_ms": round(percentile(latencies, 0.99), 2),
+        "errors": errors,
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True, text=True).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def print_comparison(report: dict, baseline: dict):
+    print(f"\n📈 Сравнение с {baseline.get('commit') or 'базовым прогоном'}:")
+    for name, result in report["scenarios"].items():
+        before = baseline.get("scenarios", {}).get(name)
+        if not before:
+            continue
+        changes = []
+        for key in ("throughput_rps", "p50_ms", "p95_ms", "p99_ms"):
+            if before[key]:
+                changes.append(f"{key} {(result[key] - before[key]) / before[key] * 100:+.1f}%")
+        print(f"   {name:<10} " + ", ".join(changes))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=100)
+    parser.add_argument("--books", type=int, default=200, help="книг у каждого пользователя")
+    parser.add_argument("--reviews", type=int, default=1, help="рецензий на книгу в среднем")
+    parser.add_argument("--pdf-pages", type=int, default=300, help="страниц в PDF (половина книг с PDF)")
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS), help="через запятую: " + ", ".join(SCENARIOS))
+    parser.add_argument("--concurrency", type=int, default=16, help="параллельных клиентов")
+    parser.add_argument("--duration", type=float, default=10, help="секунд на сценарий")
+    parser.add_argument("--warmup", type=float, default=2, help="секунд прогрева перед замером")
+    parser.add_argument("--workers", type=int, default=1, help="процессов uvicorn")
+    parser.add_argument("--database-url", help="пустая база вместо временной SQLite (например, PostgreSQL)")
+    parser.add_argument("-e", "--env", action="append", default=[], help="переменная окружения сервера NAME=VALUE")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--json", help="куда сохранить результаты")
+    parser.add_argument("--compare", help="JSON прошлого прогона для сравнения")
+    args = parser.parse_args()
+    scenarios = [name.strip() for name in args.scenarios.split(",") if name.strip()]
+    unknown = set(scenarios) - set(SCENARIOS)
+    if unknown:
+        parser.error(f"неизвестные сценарии: {', '.join(sorted(unknown))}")
+    random.seed(args.seed)
+
+    tmp = tempfile.mkdtemp(prefix="book-tracker-load-")
+    server = None
+    try:
+        database_url = args.database_url or f"sqlite:///{os.path.join(tmp, 'bench.db')}"
+        upload_dir = os.path.join(tmp, "pdf")
+        os.makedirs(upload_dir)
+        env = dict(os.environ)
+        env.update({
+            "DATABASE_URL": database_url,
+            "PDF_UPLOAD_DIR": upload_dir,
+            "THUMBNAIL_DIR": os.path.join(tmp, "thumbnails"),
+            "PAGE_CACHE_DIR": os.path.join(tmp, "pages"),
+            "PDF_WORKER": "off",
+        })
+        for item in args.env:
+            name, _, value = item.partition("=")
+            env[name] = value
+        # Модули приложения читают настройки при импорте - те же, что у сервера
+        os.environ.update(env)
+
+        print(f"🔄 Заполнение базы: {args.users} пользователей x {args.books} книг...")
+        started = time.perf_counter()
+        counts = seed(database_url, upload_dir, args)
+        print(f"   готово за {time.perf_counter() - started:.1f} с: {counts}")
+        pdf_size = os.path.getsize(os.path.join(upload_dir, os.listdir(upload_dir)[0]))
+
+        port = free_port()
+        server = start_server(env, port, args.workers)
+        print(f"🚀 Сервер на порту {port}, процессов: {args.workers}")
+
+        # Токены для сценариев - входим всеми пользователями заранее
+        tokens = {}
+        token_lock = threading.Lock()
+        user_ids = list(range(1, args.users + 1))
+
+        def login_users(chunk):
+            client = Client(port)
+            for user_id in chunk:
+                token = login(client, user_id)
+                with token_lock:
+                    tokens[user_id] = token
+
+        threads = [threading.Thread(target=login_users, args=(user_ids[i::args.concurrency],)) for i in range(args.concurrency)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        if len(tokens) != args.users:
+            raise RuntimeError("Not all users could log in")
+        workload = Workload(args, tokens, pdf_size)
+
+        report = {
+            "commit": git_commit(),
+            "started_at": datetime.now().isoformat(timespec="seconds"),
+            "config": {
+                "users": args.users,
+                "books_per_user": args.books,
+                "reviews_per_book": args.reviews,
+                "pdf_pages": args.pdf_pages,
+                "concurrency": args.concurrency,
+                "duration": args.duration,
+                "workers": args.workers,
+                "database": "postgresql" if database_url.startswith("postgres") else "sqlite",
+                "env": args.env,
+            },
+            "scenarios": {},
+        }
+        for name in scenarios:
+            result = run_scenario(workload, name, port, args.concurrency, args.duration, args.warmup)
+            report["scenarios"][name] = result
+            errors = f", ошибки: {result['errors']}" if result["errors"] else ""
+            print(f"📊 {name:<10} {result['throughput_rps']:>8.1f} req/s  p50 {result['p50_ms']:.1f} мс  "
+                  f"p95 {result['p95_ms']:.1f} мс  p99 {result['p99_ms']:.1f} мс{errors}")
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait(timeout=30)
+        shutil.rmtree(tmp, ignore_errors=True)
+
+    if args.compare:
+        with open(args.compare) as f:
+            print_comparison(report, json.load(f))
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
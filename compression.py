@@ -0,0 +1,127 @@
+"""
+Сжатие ответов по Accept-Encoding: brotli, если установлен пакет brotli
+(pip install brotli), иначе gzip.
+
+CompressionMiddleware сжимает JSON-ответы не меньше COMPRESS_MIN_SIZE байт.
+Файлы (PDF, страницы, статика) не трогает: у них свои ETag и Range, а
+статика сжимается заранее (static_assets). Большие тела сжимаются в пуле
+потоков, чтобы не останавливать цикл событий.
+"""
+import gzip
+import os
+from typing import Iterable, Optional
+
+from starlette.concurrency import run_in_threadpool
+from starlette.datastructures import Headers, MutableHeaders
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+COMPRESS_MIN_SIZE = int(os.getenv("COMPRESS_MIN_SIZE", "1024"))  # 0 - не сжимать ответы
+GZIP_LEVEL = int(os.getenv("COMPRESS_GZIP_LEVEL", "6"))
+BROTLI_QUALITY = int(os.getenv("COMPRESS_BROTLI_QUALITY", "4"))  # 11 - для статики, для ответов слишком медленно
+# Тела больше этого сжимаются в пуле потоков
+THREADPOOL_THRESHOLD = 64 * 1024
+
+# В порядке предпочтения
+ENCODINGS = ("br", "gzip") if brotli is not None else ("gzip",)
+COMPRESSIBLE_TYPES = ("application/json",)
+
+
+def negotiate(accept_encoding: Optional[str], available: Iterable[str] = ENCODINGS) -> Optional[str]:
+    """Лучшее из available, что принимает клиент; None - без сжатия"""
+    if not accept_encoding:
+        return None
+    accepted = {}
+    for item in accept_encoding.split(","):
+        name, _, params = item.strip().partition(";")
+        quality = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                quality = float(params[2:])
+            except ValueError:
+                quality = 0.0
+        accepted[name.strip().lower()] = quality
+    wildcard = accepted.get("*", 0.0)
+    for encoding in available:
+        if accepted.get(encoding, wildcard) > 0:
+            return encoding
+    return None
+
+
+def compress(body: bytes, encoding: str, best: bool = False) -> bytes:
+    """best - максимальное сжатие для заранее подготовленных файлов"""
+    if encoding == "br":
+        return brotli.compress(body, quality=11 if best else BROTLI_QUALITY)
+    # mtime=0 - одинаковый результат для одинакового содержимого
+    return gzip.compress(body, compresslevel=9 if best else GZIP_LEVEL, mtime=0)
+
+
+def add_vary(headers: MutableHeaders):
+    vary = headers.get("vary")
+    if vary is None:
+        headers["Vary"] = "Accept-Encoding"
+    elif "accept-encoding" not in vary.lower():
+        headers["Vary"] = f"{vary}, Accept-Encoding"
+
+
+class CompressionMiddleware:
+    """ASGI middleware: сжимает JSON-ответы, целиком отданные одним сообщением"""
+
+    def __init__(self, app, min_size: int = COMPRESS_MIN_SIZE):
+        self.app = app
+        self.min_size = min_size
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or self.min_size <= 0:
+            await self.app(scope, receive, send)
+            return
+        encoding = negotiate(Headers(scope=scope).get("accept-encoding"))
+        start_message = None
+
+        async def send_compressed(message):
+            nonlocal start_message
+            if message["type"] == "http.response.start":
+                headers = Headers(raw=message["headers"])
+                content_type = headers.get("content-type", "").split(";")[0].strip()
+                if (
+                    message["status"] == 200
+                    and content_type in COMPRESSIBLE_TYPES
+                    and "content-encoding" not in headers
+                ):
+                    # Решение - по первому сообщению тела
+                    start_message = message
+                    return
+                await send(message)
+                return
+            if message["type"] != "http.response.body" or start_message is None:
+                await send(message)
+                return
+
+            start, start_message = start_message, None
+            body = message.get("body", b"")
+            # Потоковые ответы и маленькие тела - как есть
+            if message.get("more_body", False) or len(body) < self.min_size:
+                await send(start)
+                await send(message)
+                return
+            headers = MutableHeaders(raw=start["headers"])
+            add_vary(headers)
+            if encoding is not None:
+                if len(body) > THREADPOOL_THRESHOLD:
+                    body = await run_in_threadpool(compress, body, encoding)
+                else:
+                    body = compress(body, encoding)
+                headers["Content-Encoding"] = encoding
+                headers["Content-Length"] = str(len(body))
+                etag = headers.get("etag")
+                # Сильный ETag относится к несжатому телу
+                if etag is not None and not etag.startswith("W/"):
+                    headers["ETag"] = "W/" + etag
+            await send(start)
+            await send({"type": "http.response.body", "body": body, "more_body": False})
+
+        await self.app(scope, receive, send_compressed)
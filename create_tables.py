@@ -1,23 +1,40 @@
 """
-Скрипт для создания/обновления таблиц базы данных.
+Скрипт для создания/обновления таблиц базы данных (миграции из migrations.py).
+Запускается один раз перед стартом приложения (и после каждого обновления кода):
+
+    python create_tables.py            # применить недостающие миграции
+    python create_tables.py --status   # версия схемы и неприменённые миграции
 """
-from database import engine
-import models
+import argparse
 import sys
 
+from database import engine
+import migrations
+
 def init_database():
-    """Создать все таблицы если их нет"""
+    """Довести схему базы до последней версии"""
     print("🔄 Создание/обновление таблиц базы данных...")
-    
+
     try:
-        # Создаем все таблицы
-        models.Base.metadata.create_all(bind=engine)
-        print("✅ Таблицы созданы/проверены")
+        applied = migrations.upgrade(engine)
+        print(f"✅ Схема версии {migrations.LATEST_VERSION} (применено миграций: {applied})")
         return True
     except Exception as e:
-        print(f"❌ Ошибка при создании таблиц: {e}")
+        print(f"❌ Ошибка при обновлении схемы: {e}")
         return False
 
+def show_status():
+    with engine.connect() as conn:
+        version = migrations.current_version(conn)
+        pending = migrations.pending_migrations(conn)
+    print(f"📋 Версия схемы: {version} (последняя: {migrations.LATEST_VERSION})")
+    for migration in pending:
+        print(f"   ⏳ {migration.version}: {migration.name}")
+    return not pending
+
 if __name__ == "__main__":
-    success = init_database()
+    parser = argparse.ArgumentParser(description="Миграции базы Book Tracker")
+    parser.add_argument("--status", action="store_true", help="только показать версию схемы")
+    args = parser.parse_args()
+    success = show_status() if args.status else init_database()
     sys.exit(0 if success else 1)
@@ -0,0 +1,43 @@
+"""
+Быстрая сериализация JSON для больших ответов: orjson, если установлен
+(pip install orjson), иначе json.dumps.
+
+Результат совпадает байт в байт с JSONResponse FastAPI: компактные
+разделители, не-ASCII символы без экранирования, даты в isoformat. Единственное
+расхождение orjson - экспоненциальная запись float (1e-05 у json, 1e-5 у
+orjson), поэтому ответы с такими числами кодируются через json (float_compatible).
+"""
+import json
+from datetime import date, datetime
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def _default(value):
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def float_compatible(value) -> bool:
+    """orjson запишет число так же, как json.dumps"""
+    return value is None or value == 0 or 1e-4 <= abs(value) < 1e16
+
+
+def dumps(content, use_orjson: bool = True) -> bytes:
+    if orjson is not None and use_orjson:
+        try:
+            return orjson.dumps(content)
+        except orjson.JSONEncodeError:
+            pass  # например, строка с одиночным суррогатом - json.dumps её пропускает
+    return json.dumps(
+        content,
+        ensure_ascii=False,
+        allow_nan=False,
+        indent=None,
+        separators=(",", ":"),
+        default=_default,
+    ).encode("utf-8")
@@ -0,0 +1,249 @@
+"""
+Импорт и экспорт библиотеки пользователя (NDJSON или CSV).
+
+Импорт (POST /books/import): тело читается потоком, строка за строкой -
+файл целиком в памяти не держится. Каждая строка проверяется схемой
+schemas.BookCreate (плюс необязательный current_page - прогресс чтения),
+книги вставляются пачками по IMPORT_BATCH_SIZE строк, пачка - одна
+транзакция. Ошибочные строки пропускаются и попадают в отчёт с номером
+строки (первые MAX_IMPORT_ERRORS). pdf_path из файла не берётся - PDF
+загружаются только через POST /books.
+
+Экспорт (GET /books/export): строки пишутся в ответ по мере чтения из базы
+(yield_per), в тех же полях - файл экспорта можно импортировать обратно.
+"""
+import csv
+import io
+import json
+import os
+from datetime import datetime
+from typing import Iterable, Iterator, List, Optional, Tuple
+
+import anyio
+from pydantic import ValidationError
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+
+import models
+import progress_writer
+import reading_stats
+import response_cache
+import schemas
+
+IMPORT_BATCH_SIZE = int(os.getenv("IMPORT_BATCH_SIZE", "500"))
+MAX_IMPORT_ERRORS = 100
+EXPORT_BATCH_SIZE = 1000
+
+FORMATS = {"ndjson": "application/x-ndjson", "csv": "text/csv"}
+EXPORT_FIELDS = ["id", "title", "author", "description", "total_pages", "current_page", "is_finished", "created_at"]
+
+
+def detect_format(format: Optional[str], content_type: Optional[str]) -> str:
+    """Формат из параметра format или из Content-Type (по умолчанию NDJSON)"""
+    if format:
+        return format
+    return "csv" if content_type and content_type.split(";")[0].strip() == "text/csv" else "ndjson"
+
+
+def request_chunks(request) -> Iterator[bytes]:
+    """Тело запроса как обычный итератор - для чтения из потока пула (run_in_threadpool)"""
+    stream = request.stream()
+
+    async def next_chunk():
+        try:
+            return await stream.__anext__()
+        except StopAsyncIteration:
+            return None
+
+    while True:
+        chunk = anyio.from_thread.run(next_chunk)
+        if chunk is None:
+            return
+        yield chunk
+
+
+class _ChunkReader(io.RawIOBase):
+    """Файловый объект поверх итератора байтовых кусков"""
+
+    def __init__(self, chunks: Iterable[bytes]):
+        self._chunks = iter(chunks)
+        self._buffer = b""
+
+    def readable(self):
+        return True
+
+    def readinto(self, target):
+        while not self._buffer:
+            chunk = next(self._chunks, None)
+            if chunk is None:
+                return 0
+            self._buffer = chunk
+        size = min(len(target), len(self._buffer))
+        target[:size] = self._buffer[:size]
+        self._buffer = self._buffer[size:]
+        return size
+
+
+def _records(text, format: str) -> Iterator[Tuple[int, Optional[dict], Optional[str]]]:
+    """(номер строки, поля, ошибка разбора); строки нумеруются с 1, заголовок CSV не считается,
+    пустые строки NDJSON считаются - номер совпадает с номером строки в файле"""
+    if format == "csv":
+        for number, row in enumerate(csv.DictReader(text), 1):
+            # Пустые ячейки CSV - отсутствующие значения
+            yield number, {key: value for key, value in row.items() if key and value not in ("", None)}, None
+        return
+    for number, line in enumerate(text, 1):
+        if not line.strip():
+            continue
+        try:
+            record = json.loads(line)
+        except ValueError:
+            yield number, None, "Invalid JSON"
+            continue
+        if not isinstance(record, dict):
+            yield number, None, "Row must be a JSON object"
+            continue
+        yield number, record, None
+
+
+def _validation_message(error: ValidationError) -> str:
+    return "; ".join(f"{'.'.join(str(part) for part in item['loc'])}: {item['msg']}" for item in error.errors())
+
+
+def parse_row(record: dict) -> Tuple[schemas.BookCreate, Optional[int]]:
+    """Книга и прогресс (current_page или None); ValidationError - строка с ошибкой"""
+    book = schemas.BookCreate.model_validate(record)
+    current_page = None
+    if record.get("current_page") is not None:
+        current_page = schemas.ReadingProgressCreate.model_validate(record).current_page
+    return book, current_page
+
+
+def insert_batch(db: Session, user_id: int, rows: List[Tuple[schemas.BookCreate, Optional[int]]]):
+    """Вставить пачку книг с прогрессом одной транзакцией"""
+    # Строка итогов создаётся (по уже существующему прогрессу) до вставки - импортированный прогресс добавляем к ней
+    stats = reading_stats.lock_user_stats(db, user_id)
+    now = datetime.now()
+    for book, current_page in rows:
+        db_book = models.Book(
+            title=book.title,
+            author=book.author,
+            description=book.description,
+            total_pages=book.total_pages,
+            owner_id=user_id,
+            created_at=now
+        )
+        if current_page is not None:
+            is_finished = book.total_pages > 0 and current_page >= book.total_pages
+            db_book.reading_progress = models.ReadingProgress(
+                user_id=user_id,
+                current_page=current_page,
+                is_finished=is_finished,
+                updated_at=now
+            )
+            stats.total_pages_read += max(0, current_page)
+            if is_finished:
+                stats.finished_books += 1
+        db.add(db_book)
+    db.execute(response_cache.library_version_bump(user_id))
+    db.commit()
+
+
+def import_books(session_factory, user_id: int, chunks: Iterable[bytes], format: str) -> schemas.ImportResult:
+    """Импорт в потоке пула: своя синхронная сессия, как и у экспорта"""
+    with session_factory() as db:
+        return _import_books(db, user_id, chunks, format)
+
+
+def _import_books(db: Session, user_id: int, chunks: Iterable[bytes], format: str) -> schemas.ImportResult:
+    text = io.TextIOWrapper(io.BufferedReader(_ChunkReader(chunks)), encoding="utf-8-sig", newline="")
+    result = schemas.ImportResult(imported=0, failed=0, errors=[])
+
+    def fail(number: int, message: str, count: int = 1):
+        result.failed += count
+        if len(result.errors) < MAX_IMPORT_ERRORS:
+            result.errors.append(schemas.ImportRowError(row=number, error=message))
+
+    batch = []
+    first_number = last_number = 0
+
+    def flush():
+        try:
+            insert_batch(db, user_id, batch)
+            result.imported += len(batch)
+        except Exception as batch_error:
+            db.rollback()
+            fail(first_number, f"Rows {first_number}-{last_number} were not imported: {batch_error}", len(batch))
+        batch.clear()
+
+    number = 0
+    try:
+        for number, record, error in _records(text, format):
+            if error is None:
+                try:
+                    row = parse_row(record)
+                except ValidationError as validation_error:
+                    error = _validation_message(validation_error)
+            if error is not None:
+                fail(number, error)
+                continue
+            if not batch:
+                first_number = number
+            last_number = number
+            batch.append(row)
+            if len(batch) >= IMPORT_BATCH_SIZE:
+                flush()
+    except (UnicodeDecodeError, csv.Error) as read_error:
+        # Дальше файл не разобрать - сохраняем то, что уже прочитано
+        fail(number + 1, f"Could not read the rest of the file: {read_error}")
+    if batch:
+        flush()
+    return result
+
+
+def _export_rows(db: Session, user_id: int) -> Iterator[dict]:
+    query = select(
+        models.Book.id,
+        models.Book.title,
+        models.Book.author,
+        models.Book.description,
+        models.Book.total_pages,
+        models.ReadingProgress.current_page,
+        models.ReadingProgress.is_finished,
+        models.Book.created_at,
+    ).outerjoin(
+        models.ReadingProgress,
+        (models.ReadingProgress.book_id == models.Book.id) & (models.ReadingProgress.user_id == user_id)
+    ).where(models.Book.owner_id == user_id).order_by(models.Book.id)
+    for partition in db.execute(query.execution_options(yield_per=EXPORT_BATCH_SIZE)).partitions():
+        for row in partition:
+            item = row._asdict()
+            # Прогресс из буфера отложенной записи новее, чем в базе
+            pending = progress_writer.buffer.get(user_id, row.id) if progress_writer.buffer is not None else None
+            if pending is not None:
+                item["current_page"] = pending[0]
+                item["is_finished"] = row.total_pages > 0 and pending[0] >= row.total_pages
+            item["created_at"] = row.created_at.isoformat() if row.created_at else None
+            yield item
+
+
+def export_books(session_factory, user_id: int, format: str) -> Iterator[str]:
+    """Экспорт пачками по EXPORT_BATCH_SIZE строк; своя сессия - ответ читается уже после выхода из эндпоинта"""
+    with session_factory() as db:
+        buffer = io.StringIO()
+        writer = None
+        if format == "csv":
+            writer = csv.DictWriter(buffer, fieldnames=EXPORT_FIELDS, lineterminator="\n")
+            writer.writeheader()
+        for number, item in enumerate(_export_rows(db, user_id), 1):
+            if writer is not None:
+                writer.writerow(item)
+            else:
+                buffer.write(json.dumps(item, ensure_ascii=False))
+                buffer.write("\n")
+            if number % EXPORT_BATCH_SIZE == 0:
+                yield buffer.getvalue()
+                buffer.seek(0)
+                buffer.truncate()
+        if buffer.tell():
+            yield buffer.getvalue()
@@ -1,37 +1,49 @@
-from fastapi import FastAPI, Depends, HTTPException, status, UploadFile, File, Form
+from fastapi import FastAPI, Depends, HTTPException, status, UploadFile, File, Form, Query, Request, Response
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.staticfiles import StaticFiles
-from fastapi.responses import FileResponse
-from sqlalchemy.orm import Session
+from fastapi.responses import JSONResponse, StreamingResponse, PlainTextResponse
+from sqlalchemy import select, tuple_, update
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import selectinload, load_only
 from datetime import datetime, timedelta
 from jose import JWTError, jwt
-from passlib.context import CryptContext
 from typing import Optional
 import models
 import schemas
-from database import engine, get_db
+import storage
+import passwords
+import progress_writer
+import reading_stats
+import reviews
+import pdf_delivery
+import pdf_jobs
+import page_cache
+import search_index
+import library_io
+import migrations
+import metrics
+import fast_json
+import response_cache
+import compression
+import static_assets
+from user_cache import AuthenticatedUser, user_cache, register_invalidation
+from database import env_flag, engine, get_db, get_read_db, SessionLocal, ReadSessionLocal, AsyncSessionLocal, dispose_async_engines
 from typing import List
+from starlette.concurrency import run_in_threadpool
+import base64
+import json
+import os
 
 # Секретный ключ для JWT
 SECRET_KEY = "your-secret-key-change-in-production"
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 30
 
-# Создание таблиц
-models.Base.metadata.create_all(bind=engine)
-        
-        # Дополнительная проверка и исправление структуры БД
-try:
-    from check_and_fix_db import check_and_fix_database
-    check_and_fix_database()
-except ImportError:
-    print("⚠️  Модуль check_and_fix_db не найден")
-except Exception as e:
-    print(f"⚠️  Ошибка при проверке структуры БД: {e}")
-
 app = FastAPI(title="Book Tracker API")
 
+# Кеш токенов сбрасывается при изменении пользователя
+register_invalidation(models.User)
+
 # CORS для PythonAnywhere
 app.add_middleware(
     CORSMiddleware,
@@ -41,27 +53,46 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# Статические файлы
-app.mount("/static", StaticFiles(directory="static"), name="static")
+# Сжатие JSON-ответов по Accept-Encoding - до middleware на BaseHTTPMiddleware,
+# который отдаёт тело дальше по частям
+app.add_middleware(compression.CompressionMiddleware)
 
-# ===== ИСПРАВЛЕННАЯ КОНФИГУРАЦИЯ ХЕШИРОВАНИЯ =====
-# Используем sha256_crypt для совместимости с существующими хешами
-pwd_context = CryptContext(
-    schemes=["sha256_crypt", "bcrypt"],  # Сначала пробуем sha256_crypt, потом bcrypt
-    deprecated="auto",
-    sha256_crypt__default_rounds=535000  # Совпадает с вашими хешами ($5$rounds=535000$...)
-)
+# Отсекаем заведомо слишком большие загрузки до разбора multipart-тела
+@app.middleware("http")
+async def limit_upload_size(request: Request, call_next):
+    if request.method == "POST" and request.url.path == "/books":
+        content_length = request.headers.get("content-length")
+        # Запас на поля формы и границы multipart
+        if content_length and content_length.isdigit() and int(content_length) > storage.MAX_PDF_SIZE + 1024 * 1024:
+            return JSONResponse(status_code=413, content={"detail": f"PDF is larger than {storage.MAX_PDF_SIZE} bytes"})
+    return await call_next(request)
+
+# Метрики запросов - последним, чтобы учитывать время всех остальных middleware
+app.add_middleware(metrics.MetricsMiddleware)
+
+# Статические файлы: копии с хешем в имени и заранее сжатые варианты
+@app.api_route("/static/{path:path}", methods=["GET", "HEAD"], include_in_schema=False)
+async def read_static(path: str, request: Request):
+    response = await static_assets.static_response(request, path)
+    if response is None:
+        raise HTTPException(status_code=404, detail="Not Found")
+    return response
+
+# Хеширование паролей - в отдельном пуле процессов (см. passwords.py),
+# sha256_crypt для совместимости с существующими хешами
 
 # Зависимости
 security = HTTPBearer()
 
 # Вспомогательные функции
-def verify_password(plain_password, hashed_password):
-    return pwd_context.verify(plain_password, hashed_password)
+async def find_user(db: AsyncSession, username: str):
+    return await db.scalar(select(models.User).where(models.User.username == username).limit(1))
 
-def get_password_hash(password):
-    # Теперь будет создавать sha256_crypt хеши
-    return pwd_context.hash(password)
+async def save_user(db: AsyncSession, db_user: models.User):
+    db.add(db_user)
+    await db.commit()
+    await db.refresh(db_user)
+    return db_user
 
 def create_access_token(data: dict, expires_delta: timedelta = None):
     to_encode = data.copy()
@@ -73,14 +104,23 @@ def create_access_token(data: dict, expires_delta: timedelta = None):
     encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
     return encoded_jwt
 
-def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(security), db: Session = Depends(get_db)):
+async def get_current_identity(credentials: HTTPAuthorizationCredentials = Depends(security), db: AsyncSession = Depends(get_read_db)) -> AuthenticatedUser:
+    """
+    Текущий пользователь по токену: только id и username.
+    Повторные запросы с тем же токеном обслуживаются из кеша без разбора JWT
+    и без обращения к таблице users.
+    """
+    token = credentials.credentials
+    cached = user_cache.get(token)
+    if cached is not None:
+        return cached
+
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
         headers={"WWW-Authenticate": "Bearer"},
     )
     try:
-        token = credentials.credentials
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
         username: str = payload.get("sub")
         if username is None:
@@ -88,43 +128,117 @@ def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(securit
     except JWTError:
         raise credentials_exception
     
-    user = db.query(models.User).filter(models.User.username == username).first()
-    if user is None:
+    row = (await db.execute(
+        select(models.User.id, models.User.username).where(models.User.username == username).limit(1)
+    )).first()
+    if row is None:
         raise credentials_exception
+    identity = AuthenticatedUser(id=row.id, username=row.username)
+    user_cache.set(token, identity, token_expires_at=payload.get("exp"))
+    return identity
+
+async def get_current_user(identity: AuthenticatedUser = Depends(get_current_identity), db: AsyncSession = Depends(get_read_db)):
+    """Полная запись пользователя - только для эндпоинтов, которым нужны все поля"""
+    user = await db.get(models.User, identity.id)
+    if user is None:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Could not validate credentials",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
     return user
 
+# Состояние сервиса
+@app.get("/health")
+def health():
+    return {
+        "status": "ok",
+        "auth_cache": user_cache.stats(),
+        "password_pool": passwords.pool.stats(),
+        "progress_buffer": progress_writer.buffer.stats() if progress_writer.buffer is not None else None,
+        "pdf_worker": pdf_jobs.worker.stats() if pdf_jobs.worker is not None else None,
+        "page_cache": page_cache.cache.stats(),
+        "response_cache": response_cache.backend.stats(),
+    }
+
+# Таблицы создают и обновляют миграции (python create_tables.py) - здесь только сверяем версию схемы
+# Метрики для Prometheus
+@app.get("/metrics")
+def read_metrics():
+    return PlainTextResponse(metrics.render(), media_type=metrics.CONTENT_TYPE)
+
+@app.on_event("startup")
+def check_schema():
+    migrations.check(engine)
+
+@app.on_event("startup")
+def build_static_assets():
+    static_assets.ensure_built()
+
+@app.on_event("startup")
+def start_background_workers():
+    if progress_writer.buffer is not None:
+        progress_writer.buffer.start()
+    if pdf_jobs.worker is not None:
+        pdf_jobs.worker.start()
+
+@app.on_event("shutdown")
+def shutdown_background_workers():
+    # Сначала дописываем отложенный прогресс, потом останавливаем пул паролей
+    if progress_writer.buffer is not None:
+        progress_writer.buffer.stop()
+    if pdf_jobs.worker is not None:
+        pdf_jobs.worker.stop()
+    passwords.pool.shutdown()
+
+@app.on_event("shutdown")
+async def close_async_engines():
+    await dispose_async_engines()
+
 # Главная страница - веб-интерфейс
 @app.get("/")
-async def read_root():
-    return FileResponse("templates/index.html")
+async def read_root(request: Request):
+    return await static_assets.index_response(request)
 
 # Регистрация
 @app.post("/register", response_model=schemas.UserResponse)
-def register(user: schemas.UserCreate, db: Session = Depends(get_db)):
+async def register(user: schemas.UserCreate, db: AsyncSession = Depends(get_db)):
     # Generate email if not provided
     if user.email is None or user.email == "":
         user.email = f"{user.username}@booktracker.local"
-    db_user = db.query(models.User).filter(models.User.username == user.username).first()
+    db_user = await find_user(db, user.username)
     if db_user:
         raise HTTPException(status_code=400, detail="Username already registered")
-    
-    hashed_password = get_password_hash(user.password)
+    # Завершаем транзакцию: соединение записи не ждёт хеширования пароля
+    await db.rollback()
+
+    hashed_password = await passwords.hash_password(user.password)
     db_user = models.User(
         username=user.username,
         email=user.email,
         hashed_password=hashed_password
     )
-    db.add(db_user)
-    db.commit()
-    db.refresh(db_user)
-    return db_user
+    return await save_user(db, db_user)
 
 # Авторизация
 @app.post("/login")
-def login(form_data: schemas.UserLogin, db: Session = Depends(get_db)):
-    user = db.query(models.User).filter(models.User.username == form_data.username).first()
-    if not user or not verify_password(form_data.password, user.hashed_password):
+async def login(form_data: schemas.UserLogin, read_db: AsyncSession = Depends(get_read_db)):
+    user = await find_user(read_db, form_data.username)
+    if not user:
+        raise HTTPException(status_code=400, detail="Incorrect username or password")
+    user_id, hashed_password = user.id, user.hashed_password
+    # Соединение не держим, пока пароль проверяется в пуле процессов
+    await read_db.close()
+    valid, new_hash = await passwords.verify_and_update(form_data.password, hashed_password)
+    if not valid:
         raise HTTPException(status_code=400, detail="Incorrect username or password")
+    if new_hash:
+        # Хеш устарел (другая схема или мало раундов) - пересохраняем
+        async with AsyncSessionLocal() as db:
+            db_user = await db.get(models.User, user_id)
+            if db_user is not None:
+                db_user.hashed_password = new_hash
+                await db.commit()
     
     access_token_expires = timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
     access_token = create_access_token(
@@ -141,82 +255,352 @@ def logout(token: HTTPAuthorizationCredentials = Depends(security)):
     """
     # В этой простой реализации просто подтверждаем выход
     # В production можно добавить токен в черный список
+    user_cache.invalidate_token(token.credentials)
     return {"message": "Successfully logged out", "success": True}
 
 # Получить информацию о текущем пользователе
 @app.get("/users/me", response_model=schemas.UserResponse)
-def read_users_me(current_user: models.User = Depends(get_current_user)):
+async def read_users_me(current_user: models.User = Depends(get_current_user)):
     return current_user
 
+# Статистика чтения - из готовых агрегатов
+@app.get("/users/me/stats", response_model=schemas.ReadingStatsResponse)
+async def read_users_me_stats(
+    days: int = Query(30, ge=1, le=366),
+    db: AsyncSession = Depends(get_read_db),
+    current_user: AuthenticatedUser = Depends(get_current_identity)
+):
+    return await db.run_sync(reading_stats.get_stats, current_user.id, days)
+
 # Книги
 @app.post("/books", response_model=schemas.BookResponse)
 async def create_book(
     title: str = Form(...),
     author: str = Form(...),
     description: Optional[str] = Form(None),
-    total_pages: int = Form(...),
+    total_pages: Optional[int] = Form(None),
     pdf_file: Optional[UploadFile] = File(None),
-    db: Session = Depends(get_db),
-    current_user: models.User = Depends(get_current_user)
+    db: AsyncSession = Depends(get_db),
+    current_user: AuthenticatedUser = Depends(get_current_identity)
 ):
-    # Сохраняем PDF если есть
+    """
+    PDF обрабатывается в фоне (pdf_jobs): число страниц, текст для поиска и
+    обложка появятся позже, статус - GET /books/{id}/processing. С PDF
+    total_pages можно не указывать - его заполнит обработка.
+    """
+    has_pdf = bool(pdf_file and pdf_file.filename)
+    if total_pages is None and not has_pdf:
+        raise HTTPException(status_code=400, detail="total_pages is required without a PDF")
+    # Сохраняем PDF если есть (потоково, одинаковые файлы хранятся один раз)
     pdf_path = None
-    if pdf_file and pdf_file.filename:
-        import os
-        import uuid
-        # Создаем папку если нет
-        os.makedirs("uploads/pdf", exist_ok=True)
-        
-        # Генерируем уникальное имя файла
-        file_ext = os.path.splitext(pdf_file.filename)[1]
-        unique_filename = f"{uuid.uuid4()}{file_ext}"
-        pdf_path = os.path.join("uploads/pdf", unique_filename)
-        
-        # Сохраняем файл
-        with open(pdf_path, "wb") as buffer:
-            content = await pdf_file.read()
-            buffer.write(content)
+    pdf_sha256 = None
+    if has_pdf:
+        stored = await storage.save_pdf_upload(pdf_file)
+        pdf_path = stored.path
+        pdf_sha256 = stored.sha256
     
     # Создаём книгу
     db_book = models.Book(
         title=title,
         author=author,
         description=description,
-        total_pages=total_pages,
+        total_pages=total_pages or 0,
         pdf_path=pdf_path,  # сохраняем путь к PDF
+        pdf_sha256=pdf_sha256,
         owner_id=current_user.id,
         created_at=datetime.now()
     )
     
+    if pdf_path:
+        await db.run_sync(pdf_jobs.enqueue, db_book)
     db.add(db_book)
-    db.commit()
-    db.refresh(db_book)
+    await db.execute(response_cache.library_version_bump(current_user.id))
+    await db.commit()
+    await db.refresh(db_book)
+    if pdf_path:
+        await storage.ensure_blob(pdf_file, stored)
+        pdf_jobs.notify()
     return db_book
 
-@app.get("/books", response_model=List[schemas.BookResponse])
-def get_books(db: Session = Depends(get_db), current_user: models.User = Depends(get_current_user)):
-    """Получить все книги текущего пользователя"""
-    books = db.query(models.Book).filter(models.Book.owner_id == current_user.id).all()
-    return books
+BOOK_INCLUDES = {"progress", "review_stats"}
+BOOK_FIELDS = list(schemas.BookResponse.model_fields)
+BOOK_SORT_COLUMNS = {
+    "created_at": models.Book.created_at,
+    "title": models.Book.title,
+    "author": models.Book.author,
+}
+MAX_PAGE_SIZE = 500
+# Список книг без валидации каждой книги схемой - столбцы кортежами и сразу в JSON (см. encode_book_rows)
+FAST_BOOK_LIST = env_flag("FAST_BOOK_LIST", False)
+
+def parse_include(include: Optional[str]) -> set:
+    """Разобрать параметр include=progress,review_stats"""
+    if not include:
+        return set()
+    requested = {part.strip() for part in include.split(",") if part.strip()}
+    unknown = requested - BOOK_INCLUDES
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown include: {', '.join(sorted(unknown))}")
+    return requested
+
+def parse_fields(fields: Optional[str]) -> Optional[List[str]]:
+    """Разобрать параметр fields=id,title,author (id возвращается всегда)"""
+    if not fields:
+        return None
+    requested = [part.strip() for part in fields.split(",") if part.strip()]
+    unknown = set(requested) - set(BOOK_FIELDS)
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown fields: {', '.join(sorted(unknown))}")
+    return [name for name in BOOK_FIELDS if name == "id" or name in requested]
+
+def encode_cursor(sort: str, order: str, value, book_id: int) -> str:
+    if isinstance(value, datetime):
+        value = value.isoformat()
+    raw = json.dumps([sort, order, value, book_id]).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+def decode_cursor(cursor: str, sort: str, order: str):
+    """Курсор - позиция последней отданной книги: (значение сортировки, id)"""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        cursor_sort, cursor_order, value, book_id = json.loads(raw)
+        if sort == "created_at" and value is not None:
+            value = datetime.fromisoformat(value)
+        book_id = int(book_id)
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    if (cursor_sort, cursor_order) != (sort, order):
+        raise HTTPException(status_code=400, detail="Cursor does not match sort order")
+    return value, book_id
+
+PROGRESS_FIELDS = list(schemas.ReadingProgressResponse.model_fields)
+
+def book_rows_query(includes: set, fields: List[str], sort_column):
+    """Быстрый путь: только нужные столбцы кортежами, без объектов ORM"""
+    columns = [getattr(models.Book, name) for name in fields]
+    if sort_column.key not in fields:
+        columns.append(sort_column)
+    if "progress" in includes and "total_pages" not in fields:
+        columns.append(models.Book.total_pages)  # для прогресса из буфера отложенной записи
+    if "review_stats" in includes:
+        columns += [models.Book.review_count, models.Book.rating_sum]
+    query = select(*columns)
+    if "progress" in includes:
+        columns = [getattr(models.ReadingProgress, name).label(f"progress_{name}") for name in PROGRESS_FIELDS]
+        query = query.add_columns(*columns).outerjoin(
+            models.ReadingProgress,
+            (models.ReadingProgress.book_id == models.Book.id) & (models.ReadingProgress.user_id == models.Book.owner_id)
+        )
+    return query
+
+def encode_book_rows(rows, includes: set, fields: List[str], user_id: int) -> bytes:
+    """
+    Строки book_rows_query -> JSON тех же байтов, что и через схемы
+    LibraryBookResponse (поля в порядке схемы), но без валидации каждой книги
+    """
+    with_progress = "progress" in includes
+    with_review_stats = "review_stats" in includes
+    use_orjson = True
+    result = []
+    for row in rows:
+        item = {name: getattr(row, name) for name in fields}
+        if with_progress:
+            progress = None
+            if row.progress_id is not None:
+                progress = {name: getattr(row, f"progress_{name}") for name in PROGRESS_FIELDS}
+            if progress_writer.buffer is not None and progress_writer.buffer.get(user_id, row.id):
+                pending = pending_progress(user_id, row.id, row.progress_id or 0, row.total_pages)
+                progress = pending.model_dump()
+            item["progress"] = progress
+        if with_review_stats:
+            average = row.rating_sum / row.review_count if row.review_count else None
+            use_orjson = use_orjson and fast_json.float_compatible(average)
+            item["review_stats"] = {"review_count": row.review_count, "average_rating": average}
+        result.append(item)
+    return fast_json.dumps(result, use_orjson=use_orjson)
+
+@app.get("/books", response_model=List[schemas.LibraryBookResponse], response_model_exclude_unset=True)
+async def get_books(
+    request: Request,
+    include: Optional[str] = None,
+    fields: Optional[str] = None,
+    sort: str = Query("created_at", pattern="^(created_at|title|author)$"),
+    order: str = Query("asc", pattern="^(asc|desc)$"),
+    limit: Optional[int] = Query(None, ge=1, le=MAX_PAGE_SIZE),
+    cursor: Optional[str] = None,
+    db: AsyncSession = Depends(get_read_db),
+    current_user: AuthenticatedUser = Depends(get_current_identity)
+):
+    """
+    Получить книги текущего пользователя.
+    С include=progress,review_stats к каждой книге добавляются прогресс чтения
+    и агрегаты рецензий - фиксированное число запросов вместо запроса на книгу
+    (агрегаты рецензий хранятся в самих книгах и запросов не добавляют).
+    fields=... выбирает только нужные колонки (например, без description).
+    С limit включается keyset-пагинация по (sort, id): курсор следующей
+    страницы приходит в заголовке X-Next-Cursor.
+    Ответ кешируется до изменения библиотеки (ETag, 304 - см. response_cache.py).
+    """
+    includes = parse_include(include)
+    selected_fields = parse_fields(fields)
+    cache = await response_cache.lookup(request, db, current_user.id, bypass=progress_writer.has_pending(current_user.id))
+    if cache.response is not None:
+        return cache.response
+
+    sort_column = BOOK_SORT_COLUMNS[sort]
+    conditions = [models.Book.owner_id == current_user.id]
+    if cursor:
+        value, last_id = decode_cursor(cursor, sort, order)
+        position = tuple_(sort_column, models.Book.id)
+        last = tuple_(value, last_id)
+        conditions.append(position > last if order == "asc" else position < last)
+    if order == "asc":
+        ordering = (sort_column.asc(), models.Book.id.asc())
+    else:
+        ordering = (sort_column.desc(), models.Book.id.desc())
+
+    if FAST_BOOK_LIST:
+        query = book_rows_query(includes, selected_fields or BOOK_FIELDS, sort_column)
+        fetch = db.execute
+    else:
+        query = select(models.Book)
+        if selected_fields is not None:
+            columns = [getattr(models.Book, name) for name in selected_fields] + [sort_column]
+            if "progress" in includes:
+                columns.append(models.Book.total_pages)
+            if "review_stats" in includes:
+                columns += [models.Book.review_count, models.Book.rating_sum]
+            query = query.options(load_only(*columns))
+        if "progress" in includes:
+            query = query.options(selectinload(models.Book.reading_progress))
+        fetch = db.scalars
+    query = query.where(*conditions).order_by(*ordering)
+
+    pagination_headers = {}
+    if limit is not None:
+        books = (await fetch(query.limit(limit + 1))).all()
+        if len(books) > limit:
+            books = books[:limit]
+            last_book = books[-1]
+            next_cursor = encode_cursor(sort, order, getattr(last_book, sort), last_book.id)
+            pagination_headers["X-Next-Cursor"] = next_cursor
+            next_url = request.url.include_query_params(cursor=next_cursor)
+            pagination_headers["Link"] = f'<{next_url}>; rel="next"'
+    else:
+        books = (await fetch(query)).all()
+
+    if FAST_BOOK_LIST:
+        body = encode_book_rows(books, includes, selected_fields or BOOK_FIELDS, current_user.id)
+        return await cache.respond_body(body, pagination_headers)
+
+    # Ответ сериализуется здесь, а не через response_model - готовое тело попадает в кеш
+    result = []
+    for book in books:
+        if selected_fields is None:
+            item = schemas.BookResponse.model_validate(book).model_dump()
+        else:
+            item = {name: getattr(book, name) for name in selected_fields}
+        if "progress" in includes:
+            progress = book.reading_progress
+            if progress_writer.buffer is not None and progress_writer.buffer.get(current_user.id, book.id):
+                progress = pending_progress(current_user.id, book.id, progress.id if progress else 0, book.total_pages)
+            item["progress"] = schemas.ReadingProgressResponse.model_validate(progress).model_dump() if progress else None
+        if "review_stats" in includes:
+            item["review_stats"] = reviews.review_stats(book).model_dump()
+        result.append(item)
+    return await cache.respond(result, pagination_headers)
+
+# Поиск по названию, автору и описанию
+@app.get("/books/search", response_model=List[schemas.BookResponse])
+async def search_books(
+    request: Request,
+    response: Response,
+    q: str = Query(..., min_length=1, max_length=200),
+    limit: int = Query(20, ge=1, le=100),
+    offset: int = Query(0, ge=0, le=10000),
+    db: AsyncSession = Depends(get_read_db),
+    current_user: AuthenticatedUser = Depends(get_current_identity)
+):
+    """
+    Слова запроса ищутся как префиксы ("толст" найдёт "Толстой"), должны
+    встретиться все. Результаты упорядочены по релевантности; следующая
+    страница - в заголовках X-Next-Offset и Link.
+
+    Ранжируются только SEARCH_RANK_WINDOW (по умолчанию 1000) самых новых
+    совпадений: все страницы берутся из этого окна, за ним результатов нет.
+    Если совпадений больше, в ответе X-Search-Truncated: true - более старые
+    книги не попали в выдачу, запрос стоит уточнить.
+    """
+    found = await db.run_sync(search_index.search_book_ids, current_user.id, q, limit + 1, offset)
+    book_ids = found.ids
+    if found.truncated:
+        response.headers["X-Search-Truncated"] = "true"
+    if len(book_ids) > limit:
+        book_ids = book_ids[:limit]
+        next_offset = offset + limit
+        response.headers["X-Next-Offset"] = str(next_offset)
+        next_url = request.url.include_query_params(offset=next_offset)
+        response.headers["Link"] = f'<{next_url}>; rel="next"'
+    if not book_ids:
+        return []
+    books = (await db.scalars(select(models.Book).where(
+        models.Book.id.in_(book_ids),
+        models.Book.owner_id == current_user.id
+    ))).all()
+    by_id = {book.id: book for book in books}
+    return [by_id[book_id] for book_id in book_ids if book_id in by_id]
+
+# Импорт и экспорт библиотеки
+@app.post("/books/import", response_model=schemas.ImportResult)
+async def import_books(
+    request: Request,
+    format: Optional[str] = Query(None, pattern="^(ndjson|csv)$"),
+    current_user: AuthenticatedUser = Depends(get_current_identity)
+):
+    """
+    Массовое добавление книг из NDJSON (по объекту на строку) или CSV с
+    заголовком: title, author, description, total_pages и необязательный
+    current_page. Формат - из параметра format или Content-Type (text/csv).
+    Книги вставляются пачками, ошибочные строки пропускаются и перечислены в ответе.
+    Разбор и вставка идут в потоке пула со своей синхронной сессией.
+    """
+    file_format = library_io.detect_format(format, request.headers.get("content-type"))
+    chunks = library_io.request_chunks(request)
+    return await run_in_threadpool(library_io.import_books, SessionLocal, current_user.id, chunks, file_format)
+
+@app.get("/books/export")
+def export_books(
+    format: str = Query("ndjson", pattern="^(ndjson|csv)$"),
+    current_user: AuthenticatedUser = Depends(get_current_identity)
+):
+    """Вся библиотека с прогрессом чтения; строки отдаются по мере чтения из базы"""
+    return StreamingResponse(
+        library_io.export_books(ReadSessionLocal, current_user.id, format),
+        media_type=library_io.FORMATS[format],
+        headers={"Content-Disposition": f'attachment; filename="library.{format}"'}
+    )
+
+async def find_book(db: AsyncSession, book_id: int, owner_id: int):
+    return await db.scalar(select(models.Book).where(
+        models.Book.id == book_id,
+        models.Book.owner_id == owner_id
+    ).limit(1))
 
 # Получить одну книгу
 @app.get("/books/{book_id}", response_model=schemas.BookResponse)
-def read_book(book_id: int, db: Session = Depends(get_db), current_user: models.User = Depends(get_current_user)):
-    book = db.query(models.Book).filter(
-        models.Book.id == book_id, 
-        models.Book.owner_id == current_user.id
-    ).first()
+async def read_book(book_id: int, request: Request, db: AsyncSession = Depends(get_read_db), current_user: AuthenticatedUser = Depends(get_current_identity)):
+    cache = await response_cache.lookup(request, db, current_user.id)
+    if cache.response is not None:
+        return cache.response
+    book = await find_book(db, book_id, current_user.id)
     if book is None:
         raise HTTPException(status_code=404, detail="Book not found")
-    return book
+    return await cache.respond(schemas.BookResponse.model_validate(book).model_dump())
 
 # Обновить книгу
 @app.put("/books/{book_id}", response_model=schemas.BookResponse)
-def update_book(book_id: int, book_update: schemas.BookCreate, db: Session = Depends(get_db), current_user: models.User = Depends(get_current_user)):
-    book = db.query(models.Book).filter(
-        models.Book.id == book_id, 
-        models.Book.owner_id == current_user.id
-    ).first()
+async def update_book(book_id: int, book_update: schemas.BookCreate, db: AsyncSession = Depends(get_db), current_user: AuthenticatedUser = Depends(get_current_identity)):
+    book = await find_book(db, book_id, current_user.id)
     if book is None:
         raise HTTPException(status_code=404, detail="Book not found")
     
@@ -225,67 +609,93 @@ def update_book(book_id: int, book_update: schemas.BookCreate, db: Session = Dep
     book.author = book_update.author
     book.description = book_update.description
     book.total_pages = book_update.total_pages
+    await db.execute(response_cache.library_version_bump(current_user.id))
     
-    db.commit()
-    db.refresh(book)
+    await db.commit()
+    await db.refresh(book)
     return book
 
 # Удалить книгу
 @app.delete("/books/{book_id}")
-def delete_book(book_id: int, db: Session = Depends(get_db), current_user: models.User = Depends(get_current_user)):
-    book = db.query(models.Book).filter(
-        models.Book.id == book_id, 
-        models.Book.owner_id == current_user.id
-    ).first()
+async def delete_book(book_id: int, db: AsyncSession = Depends(get_db), current_user: AuthenticatedUser = Depends(get_current_identity)):
+    book = await find_book(db, book_id, current_user.id)
     if book is None:
         raise HTTPException(status_code=404, detail="Book not found")
     
-    db.delete(book)
-    db.commit()
+    pdf_path = book.pdf_path
+    pdf_sha256 = book.pdf_sha256
+    await db.delete(book)
+    await db.execute(response_cache.library_version_bump(current_user.id))
+    await db.commit()
+    # Файл общий для всех книг с тем же содержимым - удаляем после последней ссылки.
+    # В потоке пула: блокировка файла может ждать ensure_blob другого запроса
+    if pdf_path:
+        await run_in_threadpool(storage.release_pdf_in_thread, SessionLocal, pdf_path, pdf_sha256)
     return {"message": "Book deleted successfully", "success": True}
 
 # Прогресс чтения
+def pending_progress(user_id: int, book_id: int, progress_id: int, total_pages: int):
+    """Прогресс из буфера отложенной записи (ещё не в базе) или None"""
+    if progress_writer.buffer is None:
+        return None
+    pending = progress_writer.buffer.get(user_id, book_id)
+    if pending is None:
+        return None
+    current_page, updated_at = pending
+    return schemas.ReadingProgressResponse(
+        id=progress_id or 0,
+        user_id=user_id,
+        book_id=book_id,
+        current_page=current_page,
+        is_finished=total_pages > 0 and current_page >= total_pages,
+        updated_at=updated_at
+    )
+
 @app.post("/books/{book_id}/progress", response_model=schemas.ReadingProgressResponse)
-def update_progress(book_id: int, progress: schemas.ReadingProgressCreate, db: Session = Depends(get_db), current_user: models.User = Depends(get_current_user)):
-    # Проверяем что книга принадлежит пользователю
-    book = db.query(models.Book).filter(models.Book.id == book_id, models.Book.owner_id == current_user.id).first()
-    if not book:
+async def update_progress(
+    book_id: int,
+    progress: schemas.ReadingProgressCreate,
+    db: AsyncSession = Depends(get_db),
+    read_db: AsyncSession = Depends(get_read_db),
+    current_user: AuthenticatedUser = Depends(get_current_identity)
+):
+    now = datetime.now()
+    if progress_writer.buffer is not None:
+        # Отложенная запись: только проверяем книгу (чтение), запись - пачкой в фоне
+        row = (await read_db.execute(select(models.Book.total_pages, models.ReadingProgress.id).outerjoin(
+            models.ReadingProgress,
+            (models.ReadingProgress.book_id == models.Book.id) & (models.ReadingProgress.user_id == current_user.id)
+        ).where(models.Book.id == book_id, models.Book.owner_id == current_user.id).limit(1))).first()
+        if row is None:
+            raise HTTPException(status_code=404, detail="Book not found")
+        progress_writer.buffer.add(current_user.id, book_id, progress.current_page, now)
+        return pending_progress(current_user.id, book_id, row.id, row.total_pages)
+
+    # Проверка владельца, вставка или обновление - одним запросом (+ журнал и статистика)
+    db_progress = await db.run_sync(progress_writer.write_progress, current_user.id, book_id, progress.current_page, now)
+    if db_progress is None:
         raise HTTPException(status_code=404, detail="Book not found")
-    
-    # Ищем существующий прогресс
-    db_progress = db.query(models.ReadingProgress).filter(
-        models.ReadingProgress.book_id == book_id,
-        models.ReadingProgress.user_id == current_user.id
-    ).first()
-    
-    if db_progress:
-        # Обновляем существующий
-        db_progress.current_page = progress.current_page
-        db_progress.is_finished = progress.current_page >= book.total_pages
-    else:
-        # Создаем новый
-        db_progress = models.ReadingProgress(
-            user_id=current_user.id,
-            book_id=book_id,
-            current_page=progress.current_page,
-            is_finished=progress.current_page >= book.total_pages
-        )
-        db.add(db_progress)
-    
-    db.commit()
-    db.refresh(db_progress)
+    await db.execute(response_cache.library_version_bump(current_user.id))
+    await db.commit()
     return db_progress
 
 @app.get("/books/{book_id}/progress", response_model=schemas.ReadingProgressResponse)
-def get_progress(book_id: int, db: Session = Depends(get_db), current_user: models.User = Depends(get_current_user)):
-    progress = db.query(models.ReadingProgress).filter(
+async def get_progress(book_id: int, request: Request, db: AsyncSession = Depends(get_read_db), current_user: AuthenticatedUser = Depends(get_current_identity)):
+    cache = await response_cache.lookup(request, db, current_user.id, bypass=progress_writer.has_pending(current_user.id))
+    if cache.response is not None:
+        return cache.response
+    progress = await db.scalar(select(models.ReadingProgress).where(
         models.ReadingProgress.book_id == book_id,
         models.ReadingProgress.user_id == current_user.id
-    ).first()
+    ).limit(1))
+    
+    if progress_writer.buffer is not None and progress_writer.buffer.get(current_user.id, book_id):
+        total_pages = await db.scalar(select(models.Book.total_pages).where(models.Book.id == book_id))
+        return pending_progress(current_user.id, book_id, progress.id if progress else 0, total_pages)
     
     if not progress:
         # Возвращаем прогресс по умолчанию
-        return schemas.ReadingProgressResponse(
+        progress = schemas.ReadingProgressResponse(
             id=0,
             user_id=current_user.id,
             book_id=book_id,
@@ -294,49 +704,175 @@ def get_progress(book_id: int, db: Session = Depends(get_db), current_user: mode
             updated_at=datetime.utcnow()
         )
     
-    return progress
+    return await cache.respond(schemas.ReadingProgressResponse.model_validate(progress).model_dump())
 
 # Рецензии
 @app.post("/books/{book_id}/reviews", response_model=schemas.ReviewResponse)
-def create_review(book_id: int, review: schemas.ReviewCreate, db: Session = Depends(get_db), current_user: models.User = Depends(get_current_user)):
-    # Проверяем что книга принадлежит пользователю
-    book = db.query(models.Book).filter(models.Book.id == book_id, models.Book.owner_id == current_user.id).first()
-    if not book:
+async def create_review(book_id: int, review: schemas.ReviewCreate, db: AsyncSession = Depends(get_db), current_user: AuthenticatedUser = Depends(get_current_identity)):
+    # Проверка владельца книги и обновление счётчиков рецензий - одним запросом
+    db_review = await db.run_sync(reviews.add_review, current_user.id, book_id, review)
+    if db_review is None:
         raise HTTPException(status_code=404, detail="Book not found")
-    
-    db_review = models.Review(
-        user_id=current_user.id,
-        book_id=book_id,
-        rating=review.rating,
-        text=review.text
-    )
-    db.add(db_review)
-    db.commit()
-    db.refresh(db_review)
+    await db.execute(response_cache.library_version_bump(current_user.id))
+    await db.commit()
+    await db.refresh(db_review)
     return db_review
 
+@app.get("/books/{book_id}/reviews", response_model=List[schemas.ReviewResponse])
+async def get_reviews(
+    book_id: int,
+    request: Request,
+    response: Response,
+    order: str = Query("desc", pattern="^(asc|desc)$"),
+    limit: int = Query(20, ge=1, le=100),
+    cursor: Optional[str] = None,
+    db: AsyncSession = Depends(get_read_db),
+    current_user: AuthenticatedUser = Depends(get_current_identity)
+):
+    """
+    Рецензии книги, по умолчанию новые первыми. Keyset-пагинация по
+    (created_at, id): курсор следующей страницы - в заголовке X-Next-Cursor.
+    """
+    owns_book = await db.scalar(select(models.Book.id).where(
+        models.Book.id == book_id,
+        models.Book.owner_id == current_user.id
+    ).limit(1))
+    if owns_book is None:
+        raise HTTPException(status_code=404, detail="Book not found")
+
+    position = tuple_(models.Review.created_at, models.Review.id)
+    query = select(models.Review).where(models.Review.book_id == book_id)
+    if cursor:
+        value, last_id = decode_cursor(cursor, "created_at", order)
+        last = tuple_(value, last_id)
+        query = query.where(position > last if order == "asc" else position < last)
+    if order == "asc":
+        query = query.order_by(models.Review.created_at.asc(), models.Review.id.asc())
+    else:
+        query = query.order_by(models.Review.created_at.desc(), models.Review.id.desc())
+
+    book_reviews = (await db.scalars(query.limit(limit + 1))).all()
+    if len(book_reviews) > limit:
+        book_reviews = book_reviews[:limit]
+        last_review = book_reviews[-1]
+        next_cursor = encode_cursor("created_at", order, last_review.created_at, last_review.id)
+        response.headers["X-Next-Cursor"] = next_cursor
+        next_url = request.url.include_query_params(cursor=next_cursor)
+        response.headers["Link"] = f'<{next_url}>; rel="next"'
+    return book_reviews
+
+@app.put("/books/{book_id}/reviews/{review_id}", response_model=schemas.ReviewResponse)
+async def update_review(book_id: int, review_id: int, review: schemas.ReviewCreate, db: AsyncSession = Depends(get_db), current_user: AuthenticatedUser = Depends(get_current_identity)):
+    db_review = await db.run_sync(reviews.update_review, current_user.id, book_id, review_id, review)
+    if db_review is None:
+        raise HTTPException(status_code=404, detail="Review not found")
+    await db.execute(response_cache.library_version_bump(current_user.id))
+    await db.commit()
+    await db.refresh(db_review)
+    return db_review
+
+@app.delete("/books/{book_id}/reviews/{review_id}")
+async def delete_review(book_id: int, review_id: int, db: AsyncSession = Depends(get_db), current_user: AuthenticatedUser = Depends(get_current_identity)):
+    if not await db.run_sync(reviews.delete_review, current_user.id, book_id, review_id):
+        raise HTTPException(status_code=404, detail="Review not found")
+    await db.execute(response_cache.library_version_bump(current_user.id))
+    await db.commit()
+    return {"message": "Review deleted successfully", "success": True}
+
+async def save_pdf_checksum(book_id: int, pdf_sha256: str):
+    # Эндпоинт читает через сессию только для чтения - пишем отдельной короткой сессией
+    async with AsyncSessionLocal() as write_db:
+        await write_db.execute(update(models.Book).where(models.Book.id == book_id).values(pdf_sha256=pdf_sha256))
+        await write_db.commit()
+
+async def ensure_pdf_checksum(book: models.Book):
+    """Для файлов, загруженных до появления контрольных сумм, считаем её один раз"""
+    if not book.pdf_sha256:
+        book.pdf_sha256 = await run_in_threadpool(storage.file_sha256, book.pdf_path)
+        await save_pdf_checksum(book.id, book.pdf_sha256)
+
 # Для PythonAnywhere
-@app.get("/books/{book_id}/pdf")
+@app.api_route("/books/{book_id}/pdf", methods=["GET", "HEAD"])
 async def get_book_pdf(
     book_id: int,
-    db: Session = Depends(get_db)
+    request: Request,
+    db: AsyncSession = Depends(get_read_db)
 ):
-    """Получить PDF файл книги (временно без проверки владельца)"""
-    book = db.query(models.Book).filter(
-        models.Book.id == book_id
-    ).first()
+    """
+    Получить PDF файл книги (временно без проверки владельца).
+    Поддерживает Range (206, несколько диапазонов), ETag и условные запросы (304).
+    """
+    book = await db.get(models.Book, book_id)
     
     if not book or not book.pdf_path:
         raise HTTPException(status_code=404, detail="PDF not found")
     
-    from fastapi.responses import FileResponse
-    import os
-    
     if not os.path.exists(book.pdf_path):
         raise HTTPException(status_code=404, detail="PDF file not found")
     
-    return FileResponse(book.pdf_path, filename=f"book_{book_id}.pdf")
+    await ensure_pdf_checksum(book)
+    return pdf_delivery.file_response(request, book.pdf_path, book.pdf_sha256, filename=f"book_{book_id}.pdf")
+
+# Отдельные страницы PDF: /pages/5 или /pages/5-8 (нумерация с 1)
+@app.api_route("/books/{book_id}/pages/{pages}", methods=["GET", "HEAD"])
+async def get_book_pages(
+    book_id: int,
+    pages: str,
+    request: Request,
+    db: AsyncSession = Depends(get_read_db)
+):
+    """
+    Небольшой PDF только с нужными страницами - чтобы открыть книгу на текущей
+    странице, не скачивая весь файл. Вырезанные страницы кешируются на диске.
+    Как и PDF целиком - временно без проверки владельца.
+    """
+    first, last = page_cache.parse_pages(pages)
+    book = await db.get(models.Book, book_id)
+    
+    if not book or not book.pdf_path or not os.path.exists(book.pdf_path):
+        raise HTTPException(status_code=404, detail="PDF not found")
+    if book.page_count is not None and last > book.page_count:
+        raise HTTPException(status_code=404, detail=f"The book has {book.page_count} pages")
+    
+    await ensure_pdf_checksum(book)
+    for attempt in range(2):
+        path = await run_in_threadpool(page_cache.page_window, book.pdf_path, book.pdf_sha256, first, last)
+        if path is None:
+            raise HTTPException(status_code=404, detail="Page out of range")
+        try:
+            return pdf_delivery.file_response(
+                request, path, f"{book.pdf_sha256}-{first}-{last}", filename=f"book_{book_id}_pages_{first}-{last}.pdf"
+            )
+        except FileNotFoundError:
+            # Другой процесс вытеснил файл из кеша - вырезаем страницы заново
+            if attempt:
+                raise
+
+# Статус фоновой обработки PDF
+@app.get("/books/{book_id}/processing", response_model=schemas.PdfJobResponse)
+async def get_book_processing(book_id: int, db: AsyncSession = Depends(get_read_db), current_user: AuthenticatedUser = Depends(get_current_identity)):
+    job = await db.scalar(select(models.PdfJob).join(models.Book, models.Book.id == models.PdfJob.book_id).where(
+        models.PdfJob.book_id == book_id,
+        models.Book.owner_id == current_user.id
+    ).limit(1))
+    if job is None:
+        raise HTTPException(status_code=404, detail="No PDF processing for this book")
+    return job
+
+# Обложка из первой страницы PDF - чтобы не скачивать PDF ради неё
+@app.api_route("/books/{book_id}/thumbnail", methods=["GET", "HEAD"])
+async def get_book_thumbnail(book_id: int, request: Request, db: AsyncSession = Depends(get_read_db)):
+    """Обложка книги (PNG), как и PDF - временно без проверки владельца"""
+    book = await db.scalar(select(models.Book).options(
+        load_only(models.Book.thumbnail_path, models.Book.pdf_sha256)
+    ).where(models.Book.id == book_id).limit(1))
+    if not book or not book.thumbnail_path or not os.path.exists(book.thumbnail_path):
+        raise HTTPException(status_code=404, detail="Thumbnail not found")
+    # Обложка зависит только от содержимого PDF - его контрольная сумма и есть ETag
+    return pdf_delivery.file_response(request, book.thumbnail_path, book.pdf_sha256, media_type="image/png")
 
 if __name__ == "__main__":
     import uvicorn
+    # Один процесс для разработки (в продакшене - python serve.py), можно сразу применить миграции
+    migrations.upgrade(engine)
     uvicorn.run(app, host="0.0.0.0", port=8005)
\ No newline at end of file
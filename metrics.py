@@ -0,0 +1,277 @@
+"""
+Метрики в текстовом формате Prometheus (GET /metrics), без внешних зависимостей.
+
+- запросы: число по (метод, маршрут, статус) и гистограмма времени по
+  (метод, маршрут); маршрут - шаблон пути (/books/{book_id}), а не сам путь;
+- SQL: число и время запросов по движку (write/read), а также число запросов
+  и суммарное время SQL на один HTTP-запрос по маршрутам - видно, какой
+  эндпоинт делает много запросов;
+- пул соединений: ожидание свободного соединения и занятые соединения;
+- время хеширования и проверки паролей (вместе с ожиданием в очереди пула);
+- байты отданных файлов (PDF, страницы, обложки) и загруженных PDF;
+- время холодного старта процесса по фазам (serve.py).
+
+Значения хранятся в памяти процесса: при нескольких процессах uvicorn
+каждый отдаёт свои метрики.
+"""
+import bisect
+import threading
+import time
+from contextvars import ContextVar
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+from sqlalchemy import event
+from sqlalchemy.pool import AsyncAdaptedQueuePool, QueuePool
+
+# Границы корзин гистограмм (секунды или штуки)
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_BUCKETS = (0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1)
+COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+
+CONTENT_TYPE = "text/plain; version=0.0.4"  # charset добавляет Starlette
+
+registry: List["Metric"] = []
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Sequence[str], values: Sequence) -> str:
+    if not names:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in zip(names, values)) + "}"
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metric:
+    type = ""
+
+    def __init__(self, name: str, help: str, labels: Sequence[str] = ()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self._lock = threading.Lock()
+        registry.append(self)
+
+    def render(self) -> List[str]:
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.type}"] + self._samples()
+
+    def _samples(self) -> List[str]:
+        raise NotImplementedError
+
+
+class Counter(Metric):
+    type = "counter"
+
+    def __init__(self, name: str, help: str, labels: Sequence[str] = ()):
+        super().__init__(name, help, labels)
+        self._values: Dict[Tuple, float] = {}
+
+    def inc(self, *label_values, amount: float = 1):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def value(self, *label_values) -> float:
+        return self._values.get(label_values, 0)
+
+    def _samples(self):
+        with self._lock:
+            items = sorted(self._values.items())
+        return [f"{self.name}{_format_labels(self.labels, key)} {_format_value(value)}" for key, value in items]
+
+
+class Gauge(Metric):
+    """Значение читается функцией в момент запроса /metrics: {значения меток: число}"""
+    type = "gauge"
+
+    def __init__(self, name: str, help: str, labels: Sequence[str] = (), collect: Optional[Callable[[], Dict]] = None):
+        super().__init__(name, help, labels)
+        self._collectors: List[Callable[[], Dict]] = [collect] if collect else []
+
+    def add_collector(self, collect: Callable[[], Dict]):
+        self._collectors.append(collect)
+
+    def _samples(self):
+        values = {}
+        for collect in self._collectors:
+            values.update(collect())
+        return [f"{self.name}{_format_labels(self.labels, key)} {_format_value(value)}" for key, value in sorted(values.items())]
+
+
+class Histogram(Metric):
+    type = "histogram"
+
+    def __init__(self, name: str, help: str, labels: Sequence[str] = (), buckets: Sequence[float] = LATENCY_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(buckets)
+        # значения меток -> [счётчики по корзинам (последняя - +Inf), сумма]
+        self._values: Dict[Tuple, list] = {}
+
+    def observe(self, value: float, *label_values):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            entry = self._values.get(label_values)
+            if entry is None:
+                entry = self._values[label_values] = [[0] * (len(self.buckets) + 1), 0.0]
+            entry[0][index] += 1
+            entry[1] += value
+
+    def count(self, *label_values) -> int:
+        entry = self._values.get(label_values)
+        return sum(entry[0]) if entry else 0
+
+    def _samples(self):
+        with self._lock:
+            items = sorted((key, (list(counts), total)) for key, (counts, total) in self._values.items())
+        lines = []
+        names = self.labels + ("le",)
+        for key, (counts, total) in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                lines.append(f"{self.name}_bucket{_format_labels(names, key + (_format_value(bound),))} {cumulative}")
+            labels = _format_labels(self.labels, key)
+            lines.append(f"{self.name}_sum{labels} {_format_value(total)}")
+            lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+
+def render() -> str:
+    return "\n".join(line for metric in registry for line in metric.render()) + "\n"
+
+
+http_requests = Counter("http_requests_total", "HTTP requests", ("method", "route", "status"))
+http_duration = Histogram("http_request_duration_seconds", "HTTP request time, including the response body", ("method", "route"))
+db_queries = Counter("db_queries_total", "SQL statements executed", ("engine",))
+db_query_duration = Histogram("db_query_duration_seconds", "SQL statement time", ("engine",), QUERY_BUCKETS)
+db_queries_per_request = Histogram("db_queries_per_request", "SQL statements per HTTP request", ("method", "route"), COUNT_BUCKETS)
+db_time_per_request = Histogram("db_time_per_request_seconds", "Total SQL time per HTTP request", ("method", "route"), QUERY_BUCKETS)
+db_pool_wait = Histogram("db_pool_wait_seconds", "Time waiting for a pooled connection", ("engine",), QUERY_BUCKETS)
+db_pool_checked_out = Gauge("db_pool_checked_out", "Connections currently checked out of the pool", ("engine",))
+password_duration = Histogram("password_hash_seconds", "Password hashing and verification time, including queueing", ("operation",))
+files_served_bytes = Counter("files_served_bytes_total", "Bytes of stored files sent to clients", ("media_type",))
+pdf_uploaded_bytes = Counter("pdf_uploaded_bytes_total", "Bytes of uploaded PDFs")
+
+# Холодный старт (serve.py): фаза -> секунды
+startup_seconds: Dict[str, float] = {}
+process_startup = Gauge(
+    "process_startup_seconds", "Cold start time by phase: import, init (parent), worker", ("phase",),
+    collect=lambda: {(phase,): seconds for phase, seconds in startup_seconds.items()},
+)
+
+
+class RequestStats:
+    __slots__ = ("queries", "query_seconds")
+
+    def __init__(self):
+        self.queries = 0
+        self.query_seconds = 0.0
+
+
+# Статистика SQL текущего HTTP-запроса; копия контекста в потоке threadpool
+# ссылается на тот же объект, поэтому запросы из потоков (импорт, экспорт) тоже учитываются
+current_request: ContextVar[Optional[RequestStats]] = ContextVar("current_request", default=None)
+
+
+class _TimedPool:
+    """Примесь к пулу: измерять ожидание свободного соединения"""
+    metrics_label = "write"
+
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            db_pool_wait.observe(time.perf_counter() - started, self.metrics_label)
+
+    def recreate(self):
+        pool = super().recreate()
+        pool.metrics_label = self.metrics_label
+        return pool
+
+
+class TimedQueuePool(_TimedPool, QueuePool):
+    pass
+
+
+class TimedAsyncQueuePool(_TimedPool, AsyncAdaptedQueuePool):
+    """То же для асинхронных движков (ожидание в очереди - без блокировки цикла событий)"""
+
+
+def instrument_engine(engine, label: str):
+    """Учитывать запросы движка в db_* метриках"""
+    if isinstance(engine.pool, _TimedPool):
+        engine.pool.metrics_label = label
+    db_pool_checked_out.add_collector(lambda: {(label,): engine.pool.checkedout()} if hasattr(engine.pool, "checkedout") else {})
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def start_query(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("query_started", []).append(time.perf_counter())
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def finish_query(conn, cursor, statement, parameters, context, executemany):
+        elapsed = time.perf_counter() - conn.info["query_started"].pop()
+        db_queries.inc(label)
+        db_query_duration.observe(elapsed, label)
+        stats = current_request.get()
+        if stats is not None:
+            stats.queries += 1
+            stats.query_seconds += elapsed
+
+    @event.listens_for(engine, "handle_error")
+    def failed_query(exception_context):
+        # after_cursor_execute не вызывается - убираем время начала
+        started = exception_context.connection.info.get("query_started") if exception_context.connection is not None else None
+        if started:
+            started.pop()
+
+
+class MetricsMiddleware:
+    """ASGI middleware: время запроса до последнего байта ответа, статус и SQL на запрос"""
+
+    def __init__(self, app):
+        self.app = app
+        self._routes = None  # эндпоинт -> шаблон пути
+
+    def _route_name(self, scope) -> str:
+        if self._routes is None:
+            routes = {}
+            for route in scope["app"].router.routes:
+                endpoint = getattr(route, "endpoint", None) or getattr(route, "app", None)
+                if endpoint is not None:
+                    routes[endpoint] = route.path
+            self._routes = routes
+        # Роутер записывает найденный эндпоинт в scope
+        return self._routes.get(scope.get("endpoint"), "unmatched")
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        started = time.perf_counter()
+        stats = RequestStats()
+        token = current_request.set(stats)
+        status = 500
+
+        async def send_with_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            current_request.reset(token)
+            route = self._route_name(scope)
+            method = scope["method"]
+            http_requests.inc(method, route, str(status))
+            http_duration.observe(time.perf_counter() - started, method, route)
+            db_queries_per_request.observe(stats.queries, method, route)
+            db_time_per_request.observe(stats.query_seconds, method, route)
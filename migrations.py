@@ -0,0 +1,311 @@
+"""
+Версионные миграции схемы базы.
+
+Применённые миграции записываются в таблицу schema_migrations. Применяет их
+один раз команда
+
+    python create_tables.py            # довести схему до последней версии
+    python create_tables.py --status   # текущая версия и что ещё не применено
+
+а процессы приложения при старте только сверяют версию (один запрос) и не
+запускаются на устаревшей схеме. С DB_AUTO_MIGRATE=1 процесс сам применяет
+недостающие миграции - удобно для разработки с одним процессом.
+
+Миграция 1 (baseline) доводит до текущей схемы базы любых прежних версий:
+создаёт недостающие таблицы, столбцы и индексы, заполняет счётчики рецензий и
+создаёт поисковый индекс - то, что раньше при каждом старте делал
+check_and_fix_db.py. Шаги миграций проверяют, что уже сделано, поэтому
+прерванную миграцию можно просто запустить ещё раз. Новые изменения схемы -
+новая функция в MIGRATIONS со следующим номером.
+
+Миграции не читают models.py: схема версии 1 записана здесь (baseline_metadata),
+поэтому новая база после всех миграций совпадает с обновлённой старой, как бы
+потом ни менялись модели.
+"""
+import logging
+from datetime import datetime
+from typing import Callable, List, NamedTuple
+
+from sqlalchemy import (
+    Boolean, Column, Date, DateTime, ForeignKey, Index, Integer, MetaData, String, Table, Text, func, inspect, select,
+    text,
+)
+from sqlalchemy.exc import SQLAlchemyError
+
+import reviews
+import search_index
+from database import env_flag
+
+logger = logging.getLogger(__name__)
+
+DB_AUTO_MIGRATE = env_flag("DB_AUTO_MIGRATE", False)
+
+# Ключ pg_advisory_lock: одновременно миграции применяет только один процесс
+PG_MIGRATION_LOCK = 4_815_162
+
+metadata = MetaData()
+schema_migrations = Table(
+    "schema_migrations",
+    metadata,
+    Column("version", Integer, primary_key=True),
+    Column("name", String(100), nullable=False),
+    Column("applied_at", DateTime, nullable=False),
+)
+
+
+# Схема версии 1 - как models.py на момент появления миграций. Не менять:
+# изменения моделей - новыми миграциями
+baseline_metadata = MetaData()
+Table(
+    "users",
+    baseline_metadata,
+    Column("id", Integer, primary_key=True, index=True),
+    Column("username", String(50), unique=True, index=True, nullable=False),
+    Column("email", String(100), unique=True, index=True, nullable=True),
+    Column("hashed_password", String, nullable=False),
+    Column("created_at", DateTime),
+)
+Table(
+    "books",
+    baseline_metadata,
+    Column("id", Integer, primary_key=True, index=True),
+    Column("title", String, nullable=False),
+    Column("author", String, nullable=False),
+    Column("description", String, nullable=True),
+    Column("total_pages", Integer, nullable=False),
+    Column("pdf_path", String, nullable=True),
+    Column("pdf_sha256", String(64), nullable=True),
+    Column("page_count", Integer, nullable=True),
+    Column("thumbnail_path", String, nullable=True),
+    Column("review_count", Integer, nullable=False, server_default="0"),
+    Column("rating_sum", Integer, nullable=False, server_default="0"),
+    Column("owner_id", Integer, ForeignKey("users.id"), nullable=False),
+    Column("created_at", DateTime),
+    Index("ix_books_owner_created", "owner_id", "created_at", "id"),
+    Index("ix_books_owner_title", "owner_id", "title", "id"),
+    Index("ix_books_owner_author", "owner_id", "author", "id"),
+)
+Table(
+    "reading_progress",
+    baseline_metadata,
+    Column("id", Integer, primary_key=True, index=True),
+    Column("user_id", Integer, ForeignKey("users.id"), nullable=False),
+    Column("book_id", Integer, ForeignKey("books.id"), nullable=False),
+    Column("current_page", Integer, nullable=False),
+    Column("is_finished", Boolean, nullable=False),
+    Column("updated_at", DateTime),
+    Index("uq_reading_progress_user_book", "user_id", "book_id", unique=True),
+    Index("ix_reading_progress_book_id", "book_id"),
+)
+Table(
+    "reviews",
+    baseline_metadata,
+    Column("id", Integer, primary_key=True, index=True),
+    Column("user_id", Integer, ForeignKey("users.id"), nullable=False),
+    Column("book_id", Integer, ForeignKey("books.id"), nullable=False),
+    Column("rating", Integer, nullable=False),
+    Column("text", String, nullable=True),
+    Column("created_at", DateTime),
+    Index("ix_reviews_book_created", "book_id", "created_at", "id"),
+)
+Table(
+    "reading_events",
+    baseline_metadata,
+    Column("id", Integer, primary_key=True),
+    Column("user_id", Integer, ForeignKey("users.id"), nullable=False),
+    Column("book_id", Integer, nullable=False),
+    Column("from_page", Integer, nullable=False),
+    Column("to_page", Integer, nullable=False),
+    Column("pages_read", Integer, nullable=False),
+    Column("created_at", DateTime, nullable=False),
+    Index("ix_reading_events_user_created", "user_id", "created_at"),
+)
+Table(
+    "daily_reading_stats",
+    baseline_metadata,
+    Column("user_id", Integer, ForeignKey("users.id"), primary_key=True),
+    Column("day", Date, primary_key=True),
+    Column("pages_read", Integer, nullable=False),
+    Column("reading_seconds", Integer, nullable=False),
+)
+Table(
+    "user_reading_stats",
+    baseline_metadata,
+    Column("user_id", Integer, ForeignKey("users.id"), primary_key=True),
+    Column("total_pages_read", Integer, nullable=False),
+    Column("timed_pages_read", Integer, nullable=False),
+    Column("reading_seconds", Integer, nullable=False),
+    Column("finished_books", Integer, nullable=False),
+    Column("current_streak", Integer, nullable=False),
+    Column("longest_streak", Integer, nullable=False),
+    Column("last_read_day", Date, nullable=True),
+    Column("last_event_at", DateTime, nullable=True),
+)
+Table(
+    "pdf_jobs",
+    baseline_metadata,
+    Column("id", Integer, primary_key=True),
+    Column("book_id", Integer, ForeignKey("books.id"), nullable=False, unique=True),
+    Column("status", String(16), nullable=False),
+    Column("attempts", Integer, nullable=False),
+    Column("error", Text, nullable=True),
+    Column("created_at", DateTime, nullable=False),
+    Column("started_at", DateTime, nullable=True),
+    Column("finished_at", DateTime, nullable=True),
+    Index("ix_pdf_jobs_status", "status", "id"),
+)
+Table(
+    "book_texts",
+    baseline_metadata,
+    Column("book_id", Integer, ForeignKey("books.id"), primary_key=True),
+    Column("content", Text, nullable=False),
+)
+
+
+class SchemaOutdated(RuntimeError):
+    pass
+
+
+# Столбцы, появившиеся в моделях после создания первых баз: (таблица, столбец, тип)
+BASELINE_COLUMNS = [
+    ("books", "pdf_path", "VARCHAR"),
+    ("books", "pdf_sha256", "VARCHAR(64)"),
+    ("books", "page_count", "INTEGER"),
+    ("books", "thumbnail_path", "VARCHAR"),
+    ("books", "review_count", "INTEGER NOT NULL DEFAULT 0"),
+    ("books", "rating_sum", "INTEGER NOT NULL DEFAULT 0"),
+]
+
+
+def add_missing_column(conn, table, column, column_type) -> bool:
+    """Добавить столбец, если его нет; True - столбец добавлен"""
+    existing = {c["name"] for c in inspect(conn).get_columns(table)}
+    if column in existing:
+        return False
+    print(f"➕ Добавляем столбец {table}.{column}")
+    conn.execute(text(f"ALTER TABLE {table} ADD COLUMN {column} {column_type}"))
+    conn.commit()
+    return True
+
+
+def remove_duplicate_progress(conn):
+    """Перед уникальным индексом: оставляем только последнюю запись прогресса для пары"""
+    result = conn.execute(text(
+        "DELETE FROM reading_progress WHERE id NOT IN "
+        "(SELECT MAX(id) FROM reading_progress GROUP BY user_id, book_id)"
+    ))
+    conn.commit()
+    if result.rowcount:
+        print(f"🧹 Удалено дублирующихся записей прогресса: {result.rowcount}")
+
+
+def create_missing_indexes(conn):
+    """Индексы схемы версии 1, которых нет в базах, созданных старыми версиями"""
+    for table in baseline_metadata.sorted_tables:
+        existing = {index["name"] for index in inspect(conn).get_indexes(table.name)}
+        for index in table.indexes:
+            if index.name in existing:
+                continue
+            print(f"➕ Создаём индекс {index.name}")
+            if index.name == "uq_reading_progress_user_book":
+                remove_duplicate_progress(conn)
+            index.create(conn)
+            conn.commit()
+
+
+def baseline(conn):
+    baseline_metadata.create_all(bind=conn)
+    conn.commit()
+    added = set()
+    for table, column, column_type in BASELINE_COLUMNS:
+        if add_missing_column(conn, table, column, column_type):
+            added.add(column)
+    # Счётчики рецензий появились позже самих рецензий - заполняем их по таблице reviews
+    if "review_count" in added:
+        print(f"🔢 Пересчитаны счётчики рецензий книг: {reviews.recount(conn)}")
+    create_missing_indexes(conn)
+    # Поисковый индекс и триггеры синхронизации с books
+    search_index.ensure_search_index(conn)
+
+
+def library_version(conn):
+    add_missing_column(conn, "users", "library_version", "INTEGER NOT NULL DEFAULT 0")
+
+
+class Migration(NamedTuple):
+    version: int
+    name: str
+    apply: Callable
+
+
+MIGRATIONS: List[Migration] = [
+    Migration(1, "baseline", baseline),
+    Migration(2, "library_version", library_version),
+]
+LATEST_VERSION = MIGRATIONS[-1].version
+
+
+def current_version(conn) -> int:
+    """Версия схемы; 0 - база без таблицы версий (новая или старше миграций)"""
+    try:
+        version = conn.execute(select(func.max(schema_migrations.c.version))).scalar()
+    except SQLAlchemyError:
+        conn.rollback()
+        return 0
+    conn.commit()
+    return version or 0
+
+
+def pending_migrations(conn) -> List[Migration]:
+    version = current_version(conn)
+    return [migration for migration in MIGRATIONS if migration.version > version]
+
+
+def upgrade(engine) -> int:
+    """Применить недостающие миграции; возвращает число применённых"""
+    with engine.connect() as conn:
+        is_postgresql = conn.dialect.name == "postgresql"
+        if is_postgresql:
+            conn.execute(text("SELECT pg_advisory_lock(:key)"), {"key": PG_MIGRATION_LOCK})
+            conn.commit()
+        try:
+            metadata.create_all(bind=conn)
+            conn.commit()
+            # Версию читаем уже под блокировкой - другой процесс мог успеть всё применить
+            pending = pending_migrations(conn)
+            for migration in pending:
+                print(f"🔄 Миграция {migration.version}: {migration.name}")
+                migration.apply(conn)
+                conn.execute(schema_migrations.insert().values(
+                    version=migration.version,
+                    name=migration.name,
+                    applied_at=datetime.now()
+                ))
+                conn.commit()
+        finally:
+            if is_postgresql:
+                conn.rollback()
+                conn.execute(text("SELECT pg_advisory_unlock(:key)"), {"key": PG_MIGRATION_LOCK})
+                conn.commit()
+    return len(pending)
+
+
+def check(engine):
+    """
+    Проверка при старте процесса: схема последней версии, иначе SchemaOutdated
+    (или применение миграций при DB_AUTO_MIGRATE=1). Заодно определяет,
+    есть ли поисковый индекс FTS5.
+    """
+    with engine.connect() as conn:
+        version = current_version(conn)
+        search_index.detect_search_index(conn)
+    if version < LATEST_VERSION:
+        if not DB_AUTO_MIGRATE:
+            raise SchemaOutdated(
+                f"Database schema version {version}, expected {LATEST_VERSION}: run python create_tables.py"
+            )
+        upgrade(engine)
+    elif version > LATEST_VERSION:
+        logger.warning("Database schema version %d is newer than this code (%d)", version, LATEST_VERSION)
+    if search_index.fts_available is False:
+        logger.warning("Search index books_fts not found, search falls back to LIKE")
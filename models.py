@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, DateTime, ForeignKey
+from sqlalchemy import Column, Integer, String, Date, DateTime, ForeignKey, Boolean, Index, Text
 from sqlalchemy.orm import relationship
 from datetime import datetime
 from database import Base
@@ -11,6 +11,8 @@ class User(Base):
     email = Column(String(100), unique=True, index=True, nullable=True)
     hashed_password = Column(String, nullable=False)
     created_at = Column(DateTime, default=datetime.now)
+    # Растёт при каждом изменении книг, прогресса и рецензий - ключ кеша ответов (response_cache.py)
+    library_version = Column(Integer, nullable=False, default=0, server_default="0")
     
     books = relationship("Book", back_populates="owner")
     reading_progresses = relationship("ReadingProgress", back_populates="user")
@@ -25,12 +27,28 @@ class Book(Base):
     description = Column(String, nullable=True)
     total_pages = Column(Integer, nullable=False)
     pdf_path = Column(String, nullable=True)  # путь к PDF файлу
+    pdf_sha256 = Column(String(64), nullable=True)  # контрольная сумма PDF
+    page_count = Column(Integer, nullable=True)  # число страниц из PDF (после обработки)
+    thumbnail_path = Column(String, nullable=True)  # обложка, отрисованная из PDF
+    # Агрегаты рецензий, меняются вместе с рецензиями (reviews.py)
+    review_count = Column(Integer, nullable=False, default=0, server_default="0")
+    rating_sum = Column(Integer, nullable=False, default=0, server_default="0")
     owner_id = Column(Integer, ForeignKey("users.id"), nullable=False)
     created_at = Column(DateTime, default=datetime.now)
     
     owner = relationship("User", back_populates="books")
-    reading_progress = relationship("ReadingProgress", back_populates="book", uselist=False)
-    reviews = relationship("Review", back_populates="book")
+    reading_progress = relationship("ReadingProgress", back_populates="book", uselist=False, cascade="all, delete-orphan")
+    reviews = relationship("Review", back_populates="book", cascade="all, delete-orphan")
+    pdf_job = relationship("PdfJob", uselist=False, cascade="all, delete-orphan")
+    pdf_text = relationship("BookText", uselist=False, cascade="all, delete-orphan")
+    
+    # Список книг владельца и keyset-пагинация по (sort, id).
+    # Поиск по (id, owner_id) обслуживается первичным ключом.
+    __table_args__ = (
+        Index("ix_books_owner_created", "owner_id", "created_at", "id"),
+        Index("ix_books_owner_title", "owner_id", "title", "id"),
+        Index("ix_books_owner_author", "owner_id", "author", "id"),
+    )
 
 class ReadingProgress(Base):
     __tablename__ = "reading_progress"
@@ -39,11 +57,18 @@ class ReadingProgress(Base):
     user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
     book_id = Column(Integer, ForeignKey("books.id"), nullable=False)
     current_page = Column(Integer, nullable=False, default=0)
-    is_finished = Column(Integer, nullable=False, default=0)
+    is_finished = Column(Boolean, nullable=False, default=False)
     updated_at = Column(DateTime, default=datetime.now, onupdate=datetime.now)
     
     user = relationship("User", back_populates="reading_progresses")
     book = relationship("Book", back_populates="reading_progress")
+    
+    # Один прогресс на пару (пользователь, книга) - на нём держится upsert;
+    # индекс по book_id - для загрузки прогресса к списку книг и каскадного удаления
+    __table_args__ = (
+        Index("uq_reading_progress_user_book", "user_id", "book_id", unique=True),
+        Index("ix_reading_progress_book_id", "book_id"),
+    )
 
 class Review(Base):
     __tablename__ = "reviews"
@@ -57,3 +82,74 @@ class Review(Base):
     
     user = relationship("User", back_populates="reviews")
     book = relationship("Book", back_populates="reviews")
+    
+    # Рецензии книги, новые/старые по порядку
+    __table_args__ = (
+        Index("ix_reviews_book_created", "book_id", "created_at", "id"),
+    )
+
+class ReadingEvent(Base):
+    """Журнал изменений прогресса (только добавление)"""
+    __tablename__ = "reading_events"
+    
+    id = Column(Integer, primary_key=True)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    # Без внешнего ключа: история остаётся после удаления книги
+    book_id = Column(Integer, nullable=False)
+    from_page = Column(Integer, nullable=False, default=0)
+    to_page = Column(Integer, nullable=False)
+    pages_read = Column(Integer, nullable=False, default=0)
+    created_at = Column(DateTime, default=datetime.now, nullable=False)
+    
+    __table_args__ = (
+        Index("ix_reading_events_user_created", "user_id", "created_at"),
+    )
+
+class DailyReadingStats(Base):
+    """Агрегаты по дням, обновляются при каждой записи прогресса"""
+    __tablename__ = "daily_reading_stats"
+    
+    user_id = Column(Integer, ForeignKey("users.id"), primary_key=True)
+    day = Column(Date, primary_key=True)
+    pages_read = Column(Integer, nullable=False, default=0)
+    reading_seconds = Column(Integer, nullable=False, default=0)
+
+class UserReadingStats(Base):
+    """Итоговые агрегаты пользователя, обновляются при каждой записи прогресса"""
+    __tablename__ = "user_reading_stats"
+    
+    user_id = Column(Integer, ForeignKey("users.id"), primary_key=True)
+    total_pages_read = Column(Integer, nullable=False, default=0)
+    # Страницы и время внутри сессий чтения - для скорости (страниц в час)
+    timed_pages_read = Column(Integer, nullable=False, default=0)
+    reading_seconds = Column(Integer, nullable=False, default=0)
+    finished_books = Column(Integer, nullable=False, default=0)
+    current_streak = Column(Integer, nullable=False, default=0)
+    longest_streak = Column(Integer, nullable=False, default=0)
+    last_read_day = Column(Date, nullable=True)
+    last_event_at = Column(DateTime, nullable=True)
+
+class PdfJob(Base):
+    """Очередь фоновой обработки загруженных PDF (одна задача на книгу)"""
+    __tablename__ = "pdf_jobs"
+    
+    id = Column(Integer, primary_key=True)
+    book_id = Column(Integer, ForeignKey("books.id"), nullable=False, unique=True)
+    status = Column(String(16), nullable=False, default="pending")  # pending, running, done, failed
+    attempts = Column(Integer, nullable=False, default=0)
+    error = Column(Text, nullable=True)
+    created_at = Column(DateTime, default=datetime.now, nullable=False)
+    started_at = Column(DateTime, nullable=True)
+    finished_at = Column(DateTime, nullable=True)
+    
+    # Выбор следующей задачи: WHERE status = 'pending' ORDER BY id
+    __table_args__ = (
+        Index("ix_pdf_jobs_status", "status", "id"),
+    )
+
+class BookText(Base):
+    """Текст, извлечённый из PDF книги (для поиска); отдельно от books, чтобы не читать его со списком книг"""
+    __tablename__ = "book_texts"
+    
+    book_id = Column(Integer, ForeignKey("books.id"), primary_key=True)
+    content = Column(Text, nullable=False)
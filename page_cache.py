@@ -0,0 +1,164 @@
+"""
+Отдельные страницы PDF: /books/{id}/pages/{n} и /books/{id}/pages/{first}-{last}.
+
+Страницы вырезаются из сохранённого PDF в маленький PDF-документ и кешируются
+на диске (uploads/pages/<sha256 PDF>-<first>-<last>.pdf) - книги с одинаковым
+PDF пользуются одними и теми же файлами. Кеш ограничен по суммарному размеру
+(PAGE_CACHE_MAX_BYTES): при переполнении удаляются давно не запрошенные файлы.
+Порядок использования хранится во времени доступа к файлу (atime; время
+изменения не трогаем - по нему отдаётся Last-Modified), поэтому после
+перезапуска кеш продолжает работать с того же места. Каждый процесс
+приложения считает размер кеша сам и может удалить файл, который отдаёт
+другой: уже открытый файл дочитывается, а не найденный вырезается заново.
+"""
+import io
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional, Tuple
+
+from fastapi import HTTPException
+
+import storage
+from pdf_jobs import pymupdf, pypdf  # необязательные библиотеки PDF (None, если не установлены)
+
+PAGE_CACHE_DIR = os.getenv("PAGE_CACHE_DIR", "uploads/pages")
+PAGE_CACHE_MAX_BYTES = int(os.getenv("PAGE_CACHE_MAX_BYTES", str(256 * 1024 * 1024)))  # 256 МБ
+MAX_PAGE_WINDOW = int(os.getenv("MAX_PAGE_WINDOW", "20"))
+
+
+def parse_pages(pages: str) -> Tuple[int, int]:
+    """'5' -> (5, 5), '5-8' -> (5, 8); страницы нумеруются с 1"""
+    first, _, last = pages.partition("-")
+    try:
+        first = int(first)
+        last = int(last) if last else first
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Pages must be N or FIRST-LAST")
+    if first < 1 or last < first:
+        raise HTTPException(status_code=400, detail="Invalid page range")
+    if last - first + 1 > MAX_PAGE_WINDOW:
+        raise HTTPException(status_code=400, detail=f"At most {MAX_PAGE_WINDOW} pages per request")
+    return first, last
+
+
+def _extract_pymupdf(pdf_path: str, first: int, last: int) -> Optional[bytes]:
+    with pymupdf.open(pdf_path) as source:
+        if last > source.page_count:
+            return None
+        with pymupdf.open() as window:
+            window.insert_pdf(source, from_page=first - 1, to_page=last - 1)
+            return window.tobytes(garbage=3, deflate=True)
+
+
+def _extract_pypdf(pdf_path: str, first: int, last: int) -> Optional[bytes]:
+    reader = pypdf.PdfReader(pdf_path)
+    if last > len(reader.pages):
+        return None
+    writer = pypdf.PdfWriter()
+    for number in range(first - 1, last):
+        writer.add_page(reader.pages[number])
+    buffer = io.BytesIO()
+    writer.write(buffer)
+    return buffer.getvalue()
+
+
+def extract_pages(pdf_path: str, first: int, last: int) -> Optional[bytes]:
+    """Страницы first..last отдельным PDF; None - таких страниц в документе нет"""
+    if pymupdf is not None:
+        return _extract_pymupdf(pdf_path, first, last)
+    if pypdf is not None:
+        return _extract_pypdf(pdf_path, first, last)
+    raise HTTPException(status_code=503, detail="Page extraction is not available on this server")
+
+
+class PageCache:
+    def __init__(self, directory: str, max_bytes: int):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._files = None  # путь -> размер, от давно использованных к недавним
+        self._total = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evicted = 0
+
+    def _load(self):
+        """Прочитать уже лежащие на диске файлы (в порядке последнего использования)"""
+        entries = []
+        if os.path.isdir(self.directory):
+            for name in os.listdir(self.directory):
+                path = os.path.join(self.directory, name)
+                if name.startswith(".") or not os.path.isfile(path):
+                    continue
+                stat = os.stat(path)
+                entries.append((stat.st_atime, path, stat.st_size))
+        entries.sort()
+        self._files = OrderedDict((path, size) for _, path, size in entries)
+        self._total = sum(self._files.values())
+
+    def path(self, pdf_sha256: str, first: int, last: int) -> str:
+        return os.path.join(self.directory, f"{pdf_sha256}-{first}-{last}.pdf")
+
+    def get(self, path: str) -> bool:
+        """Есть ли файл в кеше; попадание делает его самым свежим"""
+        with self._lock:
+            if self._files is None:
+                self._load()
+            if path not in self._files:
+                self.misses += 1
+                return False
+            self._files.move_to_end(path)
+            self.hits += 1
+        try:
+            os.utime(path, ns=(time.time_ns(), os.stat(path).st_mtime_ns))
+        except FileNotFoundError:
+            # Удалён другим процессом
+            with self._lock:
+                self._total -= self._files.pop(path, 0)
+            return False
+        return True
+
+    def put(self, path: str, data: bytes):
+        storage.write_file(path, data)
+        with self._lock:
+            if self._files is None:
+                self._load()
+            self._total += len(data) - self._files.pop(path, 0)
+            self._files[path] = len(data)
+            while self._total > self.max_bytes and len(self._files) > 1:
+                old_path, size = self._files.popitem(last=False)
+                self._total -= size
+                self.evicted += 1
+                try:
+                    os.remove(old_path)
+                except OSError:
+                    # Уже удалён другим процессом или (Windows) открыт для отдачи
+                    pass
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "files": len(self._files or ()),
+                "bytes": self._total,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evicted": self.evicted,
+            }
+
+
+cache = PageCache(PAGE_CACHE_DIR, PAGE_CACHE_MAX_BYTES)
+
+
+def page_window(pdf_path: str, pdf_sha256: str, first: int, last: int) -> Optional[str]:
+    """Путь к файлу со страницами first..last (из кеша или только что вырезанному); None - нет таких страниц"""
+    path = cache.path(pdf_sha256, first, last)
+    if cache.get(path):
+        return path
+    data = extract_pages(pdf_path, first, last)
+    if data is None:
+        return None
+    cache.put(path, data)
+    return path
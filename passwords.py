@@ -0,0 +1,127 @@
+"""
+Хеширование и проверка паролей в отдельном пуле процессов.
+sha256_crypt с сотнями тысяч раундов занимает CPU на сотни миллисекунд,
+поэтому вычисления вынесены из общего threadpool в ограниченный пул процессов.
+Если пул занят (слишком много запросов ждут очереди), сразу отвечаем 503.
+
+При успешной проверке пароля хеш пересчитывается по текущей схеме, если
+сохранённый устарел (другая схема или число раундов ниже PASSWORD_MIN_ROUNDS) -
+так хеши мигрируют без сброса паролей.
+"""
+import asyncio
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Optional, Tuple
+
+from fastapi import HTTPException
+from passlib.context import CryptContext
+
+import metrics
+
+# Схема для новых хешей; остальные поддерживаемые схемы считаются устаревшими
+PASSWORD_SCHEME = os.getenv("PASSWORD_SCHEME", "sha256_crypt")
+# sha256_crypt: совпадает с существующими хешами ($5$rounds=535000$...); bcrypt: log2 раундов
+DEFAULT_ROUNDS = {"sha256_crypt": 535000, "bcrypt": 12}
+PASSWORD_ROUNDS = int(os.getenv("PASSWORD_ROUNDS", str(DEFAULT_ROUNDS.get(PASSWORD_SCHEME, 0))))
+PASSWORD_MIN_ROUNDS = int(os.getenv("PASSWORD_MIN_ROUNDS", "0"))
+# 0 - считать в общем threadpool (без отдельных процессов)
+PASSWORD_WORKERS = int(os.getenv("PASSWORD_WORKERS", str(max(1, min(4, (os.cpu_count() or 2) // 2)))))
+PASSWORD_MAX_PENDING = int(os.getenv("PASSWORD_MAX_PENDING", str(max(1, PASSWORD_WORKERS) * 8)))
+
+SUPPORTED_SCHEMES = ["sha256_crypt", "bcrypt"]
+
+
+def build_context() -> CryptContext:
+    schemes = [PASSWORD_SCHEME] + [scheme for scheme in SUPPORTED_SCHEMES if scheme != PASSWORD_SCHEME]
+    settings = {}
+    if PASSWORD_ROUNDS:
+        settings[f"{PASSWORD_SCHEME}__default_rounds"] = PASSWORD_ROUNDS
+    if PASSWORD_MIN_ROUNDS:
+        settings[f"{PASSWORD_SCHEME}__min_rounds"] = PASSWORD_MIN_ROUNDS
+    return CryptContext(schemes=schemes, deprecated="auto", **settings)
+
+
+pwd_context = build_context()
+
+
+# Функции верхнего уровня - выполняются в процессах пула
+def _hash(password: str) -> str:
+    return pwd_context.hash(password)
+
+
+def _verify_and_update(password: str, hashed_password: str) -> Tuple[bool, Optional[str]]:
+    try:
+        return pwd_context.verify_and_update(password, hashed_password)
+    except (ValueError, TypeError):
+        # Неизвестный или повреждённый формат хеша
+        return False, None
+
+
+class PasswordPool:
+    def __init__(self, workers: int, max_pending: int):
+        self.workers = workers
+        self.max_pending = max_pending
+        self.pending = 0
+        self.rejected = 0
+        self._executor = None
+
+    def _get_executor(self):
+        if self.workers <= 0:
+            return None  # run_in_executor(None) - стандартный threadpool
+        if self._executor is None:
+            # spawn: процессы не наследуют потоки и соединения с БД родителя
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.workers,
+                mp_context=multiprocessing.get_context("spawn"),
+            )
+        return self._executor
+
+    async def run(self, func, *args):
+        if self.pending >= self.max_pending:
+            self.rejected += 1
+            raise HTTPException(
+                status_code=503,
+                detail="Authentication service is busy, try again later",
+                headers={"Retry-After": "1"},
+            )
+        self.pending += 1
+        try:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self._get_executor(), func, *args)
+        finally:
+            self.pending -= 1
+
+    def stats(self) -> dict:
+        return {
+            "workers": self.workers,
+            "pending": self.pending,
+            "max_pending": self.max_pending,
+            "rejected": self.rejected,
+        }
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=True, cancel_futures=True)
+            self._executor = None
+
+
+pool = PasswordPool(PASSWORD_WORKERS, PASSWORD_MAX_PENDING)
+
+
+async def _timed(operation: str, func, *args):
+    started = time.perf_counter()
+    try:
+        return await pool.run(func, *args)
+    finally:
+        metrics.password_duration.observe(time.perf_counter() - started, operation)
+
+
+async def hash_password(password: str) -> str:
+    return await _timed("hash", _hash, password)
+
+
+async def verify_and_update(password: str, hashed_password: str) -> Tuple[bool, Optional[str]]:
+    """(пароль верен, новый хеш или None если пересчитывать не нужно)"""
+    return await _timed("verify", _verify_and_update, password, hashed_password)
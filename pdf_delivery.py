@@ -0,0 +1,214 @@
+"""
+Отдача PDF файлов с поддержкой HTTP кеширования и частичных запросов.
+- ETag (строгий, из SHA-256 содержимого) и Last-Modified;
+- If-None-Match / If-Modified-Since -> 304 Not Modified;
+- Range (в том числе несколько диапазонов -> multipart/byteranges) -> 206,
+  If-Range, 416 для недостижимых диапазонов.
+"""
+import os
+import secrets
+from email.utils import formatdate, parsedate_to_datetime
+from typing import BinaryIO, List, Optional, Tuple
+
+from fastapi import Request
+from fastapi.responses import Response, StreamingResponse
+
+import metrics
+
+PDF_CACHE_MAX_AGE = int(os.getenv("PDF_CACHE_MAX_AGE", "3600"))
+READ_CHUNK_SIZE = 64 * 1024
+MAX_RANGES = 32  # больше диапазонов в одном запросе - отдаём файл целиком
+
+ByteRange = Tuple[int, int]  # включительно: (first, last)
+
+
+def parse_range_header(header: str, size: int) -> Optional[List[ByteRange]]:
+    """
+    Разобрать заголовок Range: bytes=0-99,200-,-500.
+    None - заголовок некорректен и должен игнорироваться (отдаём 200),
+    [] - ни один диапазон не пересекается с файлом (416).
+    """
+    unit, _, specs = header.partition("=")
+    if unit.strip().lower() != "bytes" or not specs:
+        return None
+    ranges = []
+    for spec in specs.split(","):
+        first, dash, last = spec.strip().partition("-")
+        if not dash:
+            return None
+        try:
+            if first == "":
+                # Суффикс: последние N байт
+                length = int(last)
+                if length <= 0:
+                    continue
+                ranges.append((max(size - length, 0), size - 1))
+                continue
+            first = int(first)
+            last = int(last) if last else None
+        except ValueError:
+            return None
+        if last is not None and first > last:
+            return None
+        if first >= size:
+            continue
+        if last is None:
+            last = size - 1
+        ranges.append((first, min(last, size - 1)))
+    if len(ranges) > MAX_RANGES:
+        return None
+    return merge_ranges(ranges)
+
+
+def merge_ranges(ranges: List[ByteRange]) -> List[ByteRange]:
+    """Склеить пересекающиеся и соседние диапазоны"""
+    merged = []
+    for first, last in sorted(ranges):
+        if merged and first <= merged[-1][1] + 1:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], last))
+        else:
+            merged.append((first, last))
+    return merged
+
+
+def etag_matches(header: str, etag: str) -> bool:
+    """Слабое сравнение для If-None-Match"""
+    if header.strip() == "*":
+        return True
+    candidates = [tag.strip() for tag in header.split(",")]
+    return any(tag.removeprefix("W/") == etag for tag in candidates)
+
+
+def not_modified_since(header: str, mtime: float) -> bool:
+    try:
+        since = parsedate_to_datetime(header)
+    except (TypeError, ValueError):
+        return False
+    return since is not None and int(mtime) <= since.timestamp()
+
+
+def if_range_allows(header: Optional[str], etag: str, mtime: float) -> bool:
+    """If-Range: диапазон отдаётся только если файл не менялся"""
+    if not header:
+        return True
+    header = header.strip()
+    if header.startswith('"') or header.startswith("W/"):
+        # Для If-Range нужно строгое сравнение
+        return header == etag
+    return not_modified_since(header, mtime)
+
+
+def _read_ranges(f: BinaryIO, ranges: List[ByteRange], media_type: str, parts: Optional[List[bytes]] = None):
+    """Генератор блоков открытого файла (закрывает его); parts - заголовки частей multipart (по одному на диапазон)"""
+    with f:
+        for index, (first, last) in enumerate(ranges):
+            if parts is not None:
+                yield parts[index]
+            f.seek(first)
+            remaining = last - first + 1
+            while remaining > 0:
+                chunk = f.read(min(READ_CHUNK_SIZE, remaining))
+                if not chunk:
+                    break
+                remaining -= len(chunk)
+                metrics.files_served_bytes.inc(media_type, amount=len(chunk))
+                yield chunk
+            if parts is not None:
+                yield b"\r\n"
+        if parts is not None:
+            yield parts[-1]
+
+
+def file_response(
+    request: Request,
+    path: str,
+    etag_value: str,
+    filename: Optional[str] = None,
+    media_type: str = "application/pdf",
+) -> Response:
+    """Ответ на GET/HEAD для файла с учётом условных и Range заголовков"""
+    # Файл открывается сразу: если его удалят во время ответа (вытеснение
+    # из кеша страниц в другом процессе), открытый файл читается до конца
+    f = open(path, "rb")
+    try:
+        response = _file_response(request, f, etag_value, filename, media_type)
+    except BaseException:
+        f.close()
+        raise
+    if not isinstance(response, StreamingResponse):
+        f.close()
+    return response
+
+
+def _file_response(
+    request: Request,
+    f: BinaryIO,
+    etag_value: str,
+    filename: Optional[str],
+    media_type: str,
+) -> Response:
+    stat = os.fstat(f.fileno())
+    size = stat.st_size
+    etag = f'"{etag_value}"'
+    headers = {
+        "ETag": etag,
+        "Last-Modified": formatdate(stat.st_mtime, usegmt=True),
+        "Cache-Control": f"private, max-age={PDF_CACHE_MAX_AGE}",
+        "Accept-Ranges": "bytes",
+    }
+
+    # Условный GET: If-None-Match важнее If-Modified-Since
+    if_none_match = request.headers.get("if-none-match")
+    if_modified_since = request.headers.get("if-modified-since")
+    if if_none_match is not None:
+        if etag_matches(if_none_match, etag):
+            return Response(status_code=304, headers=headers)
+    elif if_modified_since and not_modified_since(if_modified_since, stat.st_mtime):
+        return Response(status_code=304, headers=headers)
+
+    if filename:
+        headers["Content-Disposition"] = f'attachment; filename="{filename}"'
+    is_head = request.method == "HEAD"
+
+    range_header = request.headers.get("range")
+    ranges = None
+    if range_header and if_range_allows(request.headers.get("if-range"), etag, stat.st_mtime):
+        ranges = parse_range_header(range_header, size)
+
+    if ranges is None:
+        headers["Content-Length"] = str(size)
+        body = None if is_head else _read_ranges(f, [(0, size - 1)] if size else [], media_type)
+        return _stream(body, 200, headers, media_type)
+
+    if not ranges:
+        headers["Content-Range"] = f"bytes */{size}"
+        return Response(status_code=416, headers=headers)
+
+    if len(ranges) == 1:
+        first, last = ranges[0]
+        headers["Content-Range"] = f"bytes {first}-{last}/{size}"
+        headers["Content-Length"] = str(last - first + 1)
+        body = None if is_head else _read_ranges(f, ranges, media_type)
+        return _stream(body, 206, headers, media_type)
+
+    # Несколько диапазонов - multipart/byteranges
+    boundary = secrets.token_hex(16)
+    parts = [
+        (
+            f"--{boundary}\r\n"
+            f"Content-Type: {media_type}\r\n"
+            f"Content-Range: bytes {first}-{last}/{size}\r\n\r\n"
+        ).encode()
+        for first, last in ranges
+    ]
+    parts.append(f"--{boundary}--\r\n".encode())
+    length = sum(len(part) for part in parts) + sum(last - first + 1 + 2 for first, last in ranges)
+    headers["Content-Length"] = str(length)
+    body = None if is_head else _read_ranges(f, ranges, media_type, parts)
+    return _stream(body, 206, headers, f"multipart/byteranges; boundary={boundary}")
+
+
+def _stream(body, status_code: int, headers: dict, media_type: str) -> Response:
+    if body is None:
+        return Response(status_code=status_code, headers=headers, media_type=media_type)
+    return StreamingResponse(body, status_code=status_code, headers=headers, media_type=media_type)
@@ -0,0 +1,315 @@
+"""
+Фоновая обработка загруженных PDF.
+
+create_book только сохраняет файл и ставит задачу в таблицу pdf_jobs (в той
+же транзакции, что и книгу), ответ не ждёт обработки. Обработчик:
+- считает настоящее число страниц (books.page_count; если total_pages при
+  загрузке не указали - заполняет и его),
+- извлекает текст для поиска (book_texts, попадает в books_fts),
+- рисует обложку - уменьшенную первую страницу (storage.save_thumbnail).
+
+Обработчик работает либо в процессе приложения (PDF_WORKER=inprocess,
+по умолчанию - фоновый поток), либо отдельным процессом:
+
+    PDF_WORKER=off uvicorn main:app ...
+    python pdf_jobs.py          # обрабатывать задачи, пока не остановят
+    python pdf_jobs.py --once   # обработать очередь и выйти
+    python pdf_jobs.py --backfill --once  # сначала поставить в очередь PDF, загруженные раньше
+
+Для PDF нужен PyMuPDF (pip install pymupdf); без него - pypdf (страницы и
+текст, без обложек). Задача, упавшая PDF_JOB_MAX_ATTEMPTS раз (в том числе
+вместе с обработчиком - не завершённая за PDF_JOB_TIMEOUT), остаётся со
+статусом failed и текстом ошибки - его видно в GET /books/{id}/processing.
+"""
+import argparse
+import logging
+import os
+import threading
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from typing import Optional
+
+from sqlalchemy.orm import Session
+from sqlalchemy.orm.exc import StaleDataError
+
+import models
+import response_cache
+import storage
+from database import SessionLocal
+
+try:
+    import pymupdf
+except ImportError:
+    try:
+        import fitz as pymupdf  # PyMuPDF до 1.24
+    except ImportError:
+        pymupdf = None
+
+try:
+    import pypdf
+except ImportError:
+    pypdf = None
+
+logger = logging.getLogger(__name__)
+
+PDF_WORKER = os.getenv("PDF_WORKER", "inprocess").lower()
+PDF_JOB_POLL_INTERVAL = float(os.getenv("PDF_JOB_POLL_INTERVAL", "5"))
+PDF_JOB_MAX_ATTEMPTS = int(os.getenv("PDF_JOB_MAX_ATTEMPTS", "3"))
+# Задача в статусе running дольше этого - обработчик упал, возвращаем в очередь
+PDF_JOB_TIMEOUT = int(os.getenv("PDF_JOB_TIMEOUT", "600"))
+PDF_TEXT_MAX_CHARS = int(os.getenv("PDF_TEXT_MAX_CHARS", "200000"))
+THUMBNAIL_WIDTH = int(os.getenv("THUMBNAIL_WIDTH", "240"))
+
+
+@dataclass
+class ExtractedPdf:
+    page_count: int
+    text: str
+    thumbnail: Optional[bytes] = None  # PNG
+
+
+def _extract_pymupdf(path: str) -> ExtractedPdf:
+    with pymupdf.open(path) as document:
+        parts = []
+        length = 0
+        for page in document:
+            if length >= PDF_TEXT_MAX_CHARS:
+                break
+            part = page.get_text()
+            parts.append(part)
+            length += len(part)
+        thumbnail = None
+        if document.page_count:
+            first_page = document[0]
+            zoom = THUMBNAIL_WIDTH / max(first_page.rect.width, 1)
+            thumbnail = first_page.get_pixmap(matrix=pymupdf.Matrix(zoom, zoom)).tobytes("png")
+        return ExtractedPdf(document.page_count, "".join(parts)[:PDF_TEXT_MAX_CHARS], thumbnail)
+
+
+def _extract_pypdf(path: str) -> ExtractedPdf:
+    reader = pypdf.PdfReader(path)
+    parts = []
+    length = 0
+    for page in reader.pages:
+        if length >= PDF_TEXT_MAX_CHARS:
+            break
+        part = page.extract_text() or ""
+        parts.append(part)
+        length += len(part)
+    return ExtractedPdf(len(reader.pages), "\n".join(parts)[:PDF_TEXT_MAX_CHARS])
+
+
+def extract(path: str) -> ExtractedPdf:
+    if pymupdf is not None:
+        return _extract_pymupdf(path)
+    if pypdf is not None:
+        return _extract_pypdf(path)
+    raise RuntimeError("No PDF library installed (pip install pymupdf or pypdf)")
+
+
+def enqueue(db: Session, book: models.Book):
+    """Поставить PDF книги в очередь. Коммит - на вызывающем"""
+    book.pdf_job = models.PdfJob(status="pending", created_at=datetime.now())
+
+
+def enqueue_unprocessed(db: Session) -> int:
+    """Поставить в очередь книги с PDF, для которых задачи ещё не было"""
+    books = db.query(models.Book).outerjoin(models.PdfJob, models.PdfJob.book_id == models.Book.id).filter(
+        models.Book.pdf_path.isnot(None),
+        models.PdfJob.id.is_(None)
+    ).all()
+    for book in books:
+        enqueue(db, book)
+    db.commit()
+    return len(books)
+
+
+def claim_job(db: Session):
+    """Взять следующую задачу: (id задачи, id книги) или None"""
+    now = datetime.now()
+    # Задачи упавших обработчиков - снова в очередь. PDF, который роняет сам
+    # обработчик (segfault, нехватка памяти), до except не доходит - попытки
+    # ограничиваем здесь, иначе он будет ронять процесс бесконечно
+    stuck = (
+        models.PdfJob.status == "running",
+        models.PdfJob.started_at < now - timedelta(seconds=PDF_JOB_TIMEOUT),
+    )
+    db.query(models.PdfJob).filter(*stuck, models.PdfJob.attempts >= PDF_JOB_MAX_ATTEMPTS).update({
+        "status": "failed",
+        "error": f"Worker stopped responding or crashed ({PDF_JOB_MAX_ATTEMPTS} attempts)",
+        "finished_at": now,
+    }, synchronize_session=False)
+    db.query(models.PdfJob).filter(*stuck).update({"status": "pending"}, synchronize_session=False)
+    db.commit()
+    while True:
+        job = db.query(models.PdfJob.id, models.PdfJob.book_id).filter(
+            models.PdfJob.status == "pending"
+        ).order_by(models.PdfJob.id).first()
+        if job is None:
+            return None
+        # Задачу мог забрать другой обработчик - тогда берём следующую
+        claimed = db.query(models.PdfJob).filter(
+            models.PdfJob.id == job.id,
+            models.PdfJob.status == "pending"
+        ).update({
+            "status": "running",
+            "attempts": models.PdfJob.attempts + 1,
+            "started_at": now,
+        }, synchronize_session=False)
+        db.commit()
+        if claimed:
+            return job.id, job.book_id
+
+
+def _reuse_results(db: Session, book: models.Book) -> Optional[ExtractedPdf]:
+    """Тот же PDF уже обработан для другой книги - берём готовое"""
+    donor = db.query(models.Book).filter(
+        models.Book.pdf_sha256 == book.pdf_sha256,
+        models.Book.page_count.isnot(None),
+        models.Book.id != book.id
+    ).first()
+    if donor is None:
+        return None
+    # Обложку можно нарисовать, а её нет - обрабатываем заново
+    if pymupdf is not None and not os.path.exists(storage.thumbnail_path(book.pdf_sha256)):
+        return None
+    return ExtractedPdf(donor.page_count, donor.pdf_text.content if donor.pdf_text else "")
+
+
+def process_job(db: Session, job_id: int, book_id: int):
+    """Обработать PDF книги; ошибки записываются в задачу"""
+    book = db.get(models.Book, book_id)
+    job = db.get(models.PdfJob, job_id)
+    if book is None or job is None or not book.pdf_path:
+        if job is not None:
+            db.delete(job)
+            db.commit()
+        return
+    pdf_path, pdf_sha256 = book.pdf_path, book.pdf_sha256
+    result = _reuse_results(db, book) if pdf_sha256 else None
+    # Не держим транзакцию открытой, пока разбирается PDF
+    db.commit()
+    try:
+        if result is None:
+            result = extract(pdf_path)
+            if result.thumbnail and pdf_sha256:
+                storage.save_thumbnail(pdf_sha256, result.thumbnail)
+    except Exception as error:
+        logger.exception("PDF job %d for book %d failed", job_id, book_id)
+        job = db.get(models.PdfJob, job_id)
+        if job is None:
+            return
+        job.error = f"{type(error).__name__}: {error}"
+        job.status = "failed" if job.attempts >= PDF_JOB_MAX_ATTEMPTS else "pending"
+        job.finished_at = datetime.now()
+        db.commit()
+        return
+
+    book = db.get(models.Book, book_id)
+    job = db.get(models.PdfJob, job_id)
+    if book is None or job is None:
+        return  # книгу удалили, пока шла обработка
+    book.page_count = result.page_count
+    if book.total_pages <= 0:
+        book.total_pages = result.page_count
+    if pdf_sha256 and os.path.exists(storage.thumbnail_path(pdf_sha256)):
+        book.thumbnail_path = storage.thumbnail_path(pdf_sha256)
+    if result.text.strip():
+        if book.pdf_text is None:
+            book.pdf_text = models.BookText(content=result.text)
+        else:
+            book.pdf_text.content = result.text
+    job.status = "done"
+    job.error = None
+    job.finished_at = datetime.now()
+    # Число страниц и обложка видны в ответах о книге
+    db.execute(response_cache.library_version_bump(book.owner_id))
+    try:
+        db.commit()
+    except StaleDataError:
+        # Книгу удалили, пока шла обработка
+        db.rollback()
+
+
+class PdfWorker:
+    def __init__(self, session_factory, poll_interval: float):
+        self.session_factory = session_factory
+        self.poll_interval = poll_interval
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+        self.processed = 0
+
+    def run_once(self) -> bool:
+        """Обработать одну задачу; False - очередь пуста"""
+        with self.session_factory() as db:
+            job = claim_job(db)
+            if job is None:
+                return False
+            process_job(db, *job)
+        self.processed += 1
+        return True
+
+    def run(self):
+        while not self._stop.is_set():
+            try:
+                if self.run_once():
+                    continue
+            except Exception:
+                logger.exception("PDF worker error")
+            self._wake.wait(self.poll_interval)
+            self._wake.clear()
+
+    def notify(self):
+        """Появилась новая задача - не ждать следующего опроса"""
+        self._wake.set()
+
+    def start(self):
+        if self._thread is None:
+            self._stop.clear()
+            self._thread = threading.Thread(target=self.run, name="pdf-worker", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        """Остановить после текущей задачи; недоделанное останется в очереди"""
+        if self._thread is not None:
+            self._stop.set()
+            self._wake.set()
+            self._thread.join()
+            self._thread = None
+
+    def stats(self) -> dict:
+        return {"processed": self.processed, "running": self._thread is not None}
+
+
+# None - задачи обрабатывает отдельный процесс (python pdf_jobs.py)
+worker = PdfWorker(SessionLocal, PDF_JOB_POLL_INTERVAL) if PDF_WORKER == "inprocess" else None
+
+
+def notify():
+    if worker is not None:
+        worker.notify()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="Обработчик очереди PDF Book Tracker")
+    parser.add_argument("--once", action="store_true", help="обработать очередь и выйти")
+    parser.add_argument("--backfill", action="store_true", help="поставить в очередь ранее загруженные PDF")
+    args = parser.parse_args()
+
+    if args.backfill:
+        with SessionLocal() as db:
+            print(f"📦 Поставлено в очередь: {enqueue_unprocessed(db)}")
+
+    standalone = PdfWorker(SessionLocal, PDF_JOB_POLL_INTERVAL)
+    print("🔄 Обработка очереди PDF...")
+    if args.once:
+        while standalone.run_once():
+            pass
+    else:
+        try:
+            standalone.run()
+        except KeyboardInterrupt:
+            pass
+    print(f"✅ Обработано задач: {standalone.processed}")
@@ -0,0 +1,191 @@
+"""
+Запись прогресса чтения.
+upsert_progress - один атомарный INSERT ... SELECT ... ON CONFLICT DO UPDATE:
+проверка владельца книги, вставка или обновление и вычисление is_finished
+выполняются одним запросом. write_progress добавляет к нему запись в журнал
+событий и обновление статистики (reading_stats) в той же транзакции.
+
+ProgressBuffer - необязательная отложенная запись (PROGRESS_WRITE_BEHIND=1):
+частые обновления одной пары (пользователь, книга) схлопываются в памяти
+и записываются пачкой раз в PROGRESS_FLUSH_INTERVAL секунд и при остановке.
+"""
+import logging
+import os
+import sqlite3
+import threading
+from datetime import datetime
+from typing import Optional
+
+from sqlalchemy import DateTime, Integer, and_, literal, select
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.orm import Session
+
+import models
+import reading_stats
+import response_cache
+from database import SessionLocal
+
+logger = logging.getLogger(__name__)
+
+PROGRESS_WRITE_BEHIND = os.getenv("PROGRESS_WRITE_BEHIND", "0").lower() in ("1", "true", "yes")
+PROGRESS_FLUSH_INTERVAL = float(os.getenv("PROGRESS_FLUSH_INTERVAL", "2"))
+PROGRESS_BUFFER_MAX = int(os.getenv("PROGRESS_BUFFER_MAX", "10000"))
+
+# RETURNING появился в SQLite 3.35
+SQLITE_HAS_RETURNING = sqlite3.sqlite_version_info >= (3, 35, 0)
+
+books = models.Book.__table__
+progress_table = models.ReadingProgress.__table__
+
+
+def upsert_statement(dialect_name: str, user_id: int, book_id: int, current_page: int, updated_at: datetime):
+    insert = pg_insert if dialect_name == "postgresql" else sqlite_insert
+    page = literal(current_page, Integer)
+    # Строка появляется, только если книга принадлежит пользователю
+    source = select(
+        literal(user_id, Integer),
+        literal(book_id, Integer),
+        page,
+        # total_pages = 0 - число страниц ещё не известно (PDF в обработке)
+        and_(books.c.total_pages > 0, page >= books.c.total_pages),
+        literal(updated_at, DateTime),
+    ).where(books.c.id == book_id, books.c.owner_id == user_id)
+    stmt = insert(progress_table).from_select(
+        ["user_id", "book_id", "current_page", "is_finished", "updated_at"], source
+    )
+    return stmt.on_conflict_do_update(
+        index_elements=["user_id", "book_id"],
+        set_={
+            "current_page": stmt.excluded.current_page,
+            "is_finished": stmt.excluded.is_finished,
+            "updated_at": stmt.excluded.updated_at,
+        },
+    )
+
+
+def upsert_progress(db: Session, user_id: int, book_id: int, current_page: int, updated_at: Optional[datetime] = None):
+    """Записать прогресс; None - книга не найдена или чужая. Коммит - на вызывающем"""
+    updated_at = updated_at or datetime.now()
+    dialect_name = db.get_bind().dialect.name
+    stmt = upsert_statement(dialect_name, user_id, book_id, current_page, updated_at)
+    if dialect_name == "postgresql" or SQLITE_HAS_RETURNING:
+        return db.execute(stmt.returning(*progress_table.c)).first()
+    if db.execute(stmt).rowcount == 0:
+        return None
+    return db.execute(
+        select(progress_table).where(progress_table.c.user_id == user_id, progress_table.c.book_id == book_id)
+    ).first()
+
+
+def write_progress(db: Session, user_id: int, book_id: int, current_page: int, updated_at: Optional[datetime] = None):
+    """
+    Записать прогресс вместе с событием в журнале и обновлением статистики.
+    None - книга не найдена или чужая. Коммит - на вызывающем
+    """
+    updated_at = updated_at or datetime.now()
+    stats = reading_stats.lock_user_stats(db, user_id)
+    previous = reading_stats.current_progress(db, user_id, book_id)
+    row = upsert_progress(db, user_id, book_id, current_page, updated_at)
+    if row is None:
+        return None
+    reading_stats.record_progress(db, stats, book_id, previous, row.current_page, row.is_finished, updated_at)
+    return row
+
+
+class ProgressBuffer:
+    def __init__(self, session_factory, interval: float, max_pending: int):
+        self.session_factory = session_factory
+        self.interval = interval
+        self.max_pending = max_pending
+        self._pending = {}  # (user_id, book_id) -> (current_page, updated_at)
+        self._pending_users = set()  # пользователи из _pending: has_pending без перебора
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._wake = threading.Event()  # буфер заполнен - записать, не дожидаясь интервала
+        self._thread = None
+        self.coalesced = 0
+        self.flushed = 0
+
+    def add(self, user_id: int, book_id: int, current_page: int, updated_at: datetime):
+        """Вызывается из цикла событий: запись при переполнении - в фоновом потоке"""
+        with self._lock:
+            key = (user_id, book_id)
+            if key in self._pending:
+                self.coalesced += 1
+            self._pending_users.add(user_id)
+            self._pending[key] = (current_page, updated_at)
+            overflow = len(self._pending) >= self.max_pending
+        if overflow:
+            self._wake.set()
+
+    def get(self, user_id: int, book_id: int):
+        """Ещё не записанный прогресс: (current_page, updated_at) или None"""
+        with self._lock:
+            return self._pending.get((user_id, book_id))
+
+    def has_pending(self, user_id: int) -> bool:
+        with self._lock:
+            return user_id in self._pending_users
+
+    def flush(self):
+        """Записать накопленное одной транзакцией"""
+        with self._flush_lock:
+            with self._lock:
+                batch, self._pending = self._pending, {}
+                self._pending_users = set()
+            if not batch:
+                return 0
+            try:
+                with self.session_factory() as db:
+                    for (user_id, book_id), (current_page, updated_at) in batch.items():
+                        write_progress(db, user_id, book_id, current_page, updated_at)
+                    db.execute(response_cache.library_version_bump(*{user_id for user_id, _ in batch}))
+                    db.commit()
+            except Exception:
+                logger.exception("Progress flush failed, %d updates returned to the buffer", len(batch))
+                with self._lock:
+                    # Более свежие значения, пришедшие во время записи, не затираем
+                    for key, value in batch.items():
+                        self._pending.setdefault(key, value)
+                        self._pending_users.add(key[0])
+                return 0
+            self.flushed += len(batch)
+            return len(batch)
+
+    def _run(self):
+        while not self._stop.is_set():
+            self._wake.wait(self.interval)
+            self._wake.clear()
+            if not self._stop.is_set():
+                self.flush()
+
+    def start(self):
+        if self._thread is None:
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="progress-flusher", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        """Остановить фоновую запись и сбросить всё накопленное"""
+        if self._thread is not None:
+            self._stop.set()
+            self._wake.set()
+            self._thread.join()
+            self._thread = None
+        self.flush()
+
+    def stats(self) -> dict:
+        with self._lock:
+            pending = len(self._pending)
+        return {"pending": pending, "coalesced": self.coalesced, "flushed": self.flushed}
+
+
+# None - отложенная запись выключена, прогресс пишется сразу
+buffer = ProgressBuffer(SessionLocal, PROGRESS_FLUSH_INTERVAL, PROGRESS_BUFFER_MAX) if PROGRESS_WRITE_BEHIND else None
+
+
+def has_pending(user_id: int) -> bool:
+    """Есть ли у пользователя прогресс, ещё не записанный в базу"""
+    return buffer is not None and buffer.has_pending(user_id)
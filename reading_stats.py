@@ -0,0 +1,157 @@
+"""
+Статистика чтения.
+Каждая запись прогресса добавляет строку в журнал reading_events и тут же
+обновляет агрегаты: страницы за день (daily_reading_stats) и итоги
+пользователя (user_reading_stats) - всего страниц, прочитанные книги, серии
+дней подряд, время чтения. /users/me/stats читает готовые агрегаты и не
+сканирует историю.
+
+Время чтения: промежуток между соседними событиями пользователя, если он
+не длиннее READING_SESSION_GAP секунд (иначе это новая сессия).
+"""
+import os
+from datetime import date, datetime, timedelta
+from typing import Optional
+
+from sqlalchemy import func, literal, select, Integer
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.orm import Session
+
+import models
+
+READING_SESSION_GAP = int(os.getenv("READING_SESSION_GAP", "1800"))
+
+progress_table = models.ReadingProgress.__table__
+daily_table = models.DailyReadingStats.__table__
+user_stats_table = models.UserReadingStats.__table__
+
+
+def _insert(db: Session):
+    return pg_insert if db.get_bind().dialect.name == "postgresql" else sqlite_insert
+
+
+def lock_user_stats(db: Session, user_id: int) -> models.UserReadingStats:
+    """
+    Строка итогов пользователя, заблокированная до конца транзакции:
+    одновременные записи прогресса одного пользователя обновляют агрегаты
+    по очереди. Новая строка заполняется по уже существующему прогрессу.
+    """
+    user_progress = progress_table.c.user_id == user_id
+    source = select(
+        literal(user_id, Integer),
+        select(func.coalesce(func.sum(progress_table.c.current_page), 0)).where(user_progress).scalar_subquery(),
+        select(func.count()).where(user_progress, progress_table.c.is_finished.is_(True)).scalar_subquery(),
+    )
+    stmt = _insert(db)(user_stats_table).from_select(["user_id", "total_pages_read", "finished_books"], source)
+    # SQLite: эта запись берёт блокировку записи; PostgreSQL: FOR UPDATE ниже
+    db.execute(stmt.on_conflict_do_nothing(index_elements=["user_id"]))
+    return db.query(models.UserReadingStats).filter(
+        models.UserReadingStats.user_id == user_id
+    ).with_for_update().populate_existing().one()
+
+
+def current_progress(db: Session, user_id: int, book_id: int):
+    """(current_page, is_finished) до изменения или None"""
+    return db.execute(
+        select(progress_table.c.current_page, progress_table.c.is_finished).where(
+            progress_table.c.user_id == user_id, progress_table.c.book_id == book_id
+        )
+    ).first()
+
+
+def record_progress(
+    db: Session,
+    stats: models.UserReadingStats,
+    book_id: int,
+    previous,
+    current_page: int,
+    is_finished: bool,
+    at: datetime,
+):
+    """Добавить событие в журнал и обновить агрегаты. Коммит - на вызывающем"""
+    from_page = previous.current_page if previous else 0
+    was_finished = bool(previous.is_finished) if previous else False
+    pages = max(0, current_page - from_page)
+
+    db.add(models.ReadingEvent(
+        user_id=stats.user_id,
+        book_id=book_id,
+        from_page=from_page,
+        to_page=current_page,
+        pages_read=pages,
+        created_at=at,
+    ))
+
+    seconds = 0
+    if stats.last_event_at is not None:
+        gap = (at - stats.last_event_at).total_seconds()
+        if 0 < gap <= READING_SESSION_GAP:
+            seconds = int(gap)
+
+    day = at.date()
+    if pages or seconds:
+        stmt = _insert(db)(daily_table).values(user_id=stats.user_id, day=day, pages_read=pages, reading_seconds=seconds)
+        db.execute(stmt.on_conflict_do_update(
+            index_elements=["user_id", "day"],
+            set_={
+                "pages_read": daily_table.c.pages_read + stmt.excluded.pages_read,
+                "reading_seconds": daily_table.c.reading_seconds + stmt.excluded.reading_seconds,
+            },
+        ))
+
+    stats.total_pages_read += pages
+    stats.reading_seconds += seconds
+    if seconds:
+        stats.timed_pages_read += pages
+    if is_finished and not was_finished:
+        stats.finished_books += 1
+    elif was_finished and not is_finished:
+        stats.finished_books = max(0, stats.finished_books - 1)
+
+    # Серия: дни подряд, в которые прочитана хотя бы одна страница
+    if pages and (stats.last_read_day is None or day > stats.last_read_day):
+        if stats.last_read_day == day - timedelta(days=1):
+            stats.current_streak += 1
+        else:
+            stats.current_streak = 1
+        stats.longest_streak = max(stats.longest_streak, stats.current_streak)
+        stats.last_read_day = day
+    stats.last_event_at = max(at, stats.last_event_at) if stats.last_event_at else at
+    db.flush()
+
+
+def get_stats(db: Session, user_id: int, days: int, today: Optional[date] = None) -> dict:
+    today = today or date.today()
+    stats = db.get(models.UserReadingStats, user_id)
+    since = today - timedelta(days=days - 1)
+    daily = db.query(models.DailyReadingStats).filter(
+        models.DailyReadingStats.user_id == user_id,
+        models.DailyReadingStats.day >= since
+    ).order_by(models.DailyReadingStats.day).all()
+
+    if stats is None:
+        return {
+            "total_pages_read": 0,
+            "finished_books": 0,
+            "current_streak": 0,
+            "longest_streak": 0,
+            "reading_hours": 0.0,
+            "average_pages_per_hour": None,
+            "daily": [],
+        }
+    # Серия прервана, если вчера и сегодня ничего не читали
+    streak_alive = stats.last_read_day is not None and stats.last_read_day >= today - timedelta(days=1)
+    hours = stats.reading_seconds / 3600
+    return {
+        "total_pages_read": stats.total_pages_read,
+        "finished_books": stats.finished_books,
+        "current_streak": stats.current_streak if streak_alive else 0,
+        "longest_streak": stats.longest_streak,
+        "reading_hours": round(hours, 2),
+        "average_pages_per_hour": round(stats.timed_pages_read / hours, 1) if hours else None,
+        "daily": [
+            {"day": row.day, "pages_read": row.pages_read, "reading_minutes": row.reading_seconds // 60}
+            for row in daily
+        ],
+    }
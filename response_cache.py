@@ -0,0 +1,209 @@
+"""
+Кеш JSON-ответов библиотеки: GET /books, /books/{id} и /books/{id}/progress.
+
+У каждого пользователя есть версия библиотеки (users.library_version). Её
+увеличивает в той же транзакции каждая запись, которая меняет эти ответы:
+книги, прогресс, рецензии, импорт, фоновая обработка PDF. Ответ хранится
+под ключом (пользователь, версия, URL), поэтому сбрасывать ничего не нужно:
+после записи версия другая, а старые ответы вытесняются сами. Проверка кеша -
+один запрос версии по первичному ключу вместо запросов книг и сериализации.
+
+Версия - это и ETag: клиент с If-None-Match получает 304 без тела.
+
+Хранилище - LRU в памяти процесса (RESPONSE_CACHE_MAX_BYTES) или общий Redis
+для нескольких процессов (RESPONSE_CACHE_URL=redis://..., нужен пакет
+redis). Ошибки Redis не ломают запросы - ответ просто строится заново.
+"""
+import json
+import logging
+import os
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Dict, Optional
+
+from fastapi import Response
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+from sqlalchemy import select, update
+
+import models
+from pdf_delivery import etag_matches
+
+logger = logging.getLogger(__name__)
+
+RESPONSE_CACHE_URL = os.getenv("RESPONSE_CACHE_URL")  # redis://host:6379/0; без него - память процесса
+
+redis = None
+if RESPONSE_CACHE_URL:
+    # Импорт redis заметно удлиняет старт - только если он нужен
+    try:
+        import redis.asyncio as redis
+    except ImportError:
+        pass
+RESPONSE_CACHE_MAX_BYTES = int(os.getenv("RESPONSE_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))  # 64 МБ
+RESPONSE_CACHE_TTL = int(os.getenv("RESPONSE_CACHE_TTL", "3600"))  # только Redis: память освобождает LRU
+
+# Заголовки ответа, которые сохраняются вместе с телом (пагинация)
+CACHED_HEADERS = ("x-next-cursor", "link")
+# Браузер хранит ответ, но перед использованием спрашивает сервер (If-None-Match)
+CACHE_CONTROL = "private, no-cache"
+
+
+@dataclass(frozen=True)
+class CachedResponse:
+    body: bytes
+    headers: Dict[str, str]
+
+
+class MemoryBackend:
+    """LRU в памяти процесса, ограниченный суммарным размером тел"""
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()  # ключ -> CachedResponse
+        self._bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    async def get(self, key: str) -> Optional[CachedResponse]:
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return entry
+
+    async def set(self, key: str, response: CachedResponse):
+        if len(response.body) > self.max_bytes:
+            return
+        previous = self._entries.pop(key, None)
+        if previous is not None:
+            self._bytes -= len(previous.body)
+        self._entries[key] = response
+        self._bytes += len(response.body)
+        while self._bytes > self.max_bytes:
+            _, oldest = self._entries.popitem(last=False)
+            self._bytes -= len(oldest.body)
+            self.evictions += 1
+
+    def stats(self) -> dict:
+        return {
+            "backend": "memory",
+            "entries": len(self._entries),
+            "bytes": self._bytes,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
+
+
+class RedisBackend:
+    """Общий кеш для всех процессов; старые версии истекают по TTL"""
+    prefix = "booktracker:response:"
+
+    def __init__(self, url: str, ttl: int):
+        self.ttl = ttl
+        self._client = redis.from_url(url)
+        self.hits = 0
+        self.misses = 0
+        self.errors = 0
+
+    async def get(self, key: str) -> Optional[CachedResponse]:
+        try:
+            data = await self._client.get(self.prefix + key)
+        except redis.RedisError:
+            self.errors += 1
+            logger.warning("Response cache read failed", exc_info=True)
+            return None
+        if data is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        headers, _, body = data.partition(b"\n")
+        return CachedResponse(body, json.loads(headers))
+
+    async def set(self, key: str, response: CachedResponse):
+        data = json.dumps(response.headers).encode() + b"\n" + response.body
+        try:
+            await self._client.set(self.prefix + key, data, ex=self.ttl)
+        except redis.RedisError:
+            self.errors += 1
+            logger.warning("Response cache write failed", exc_info=True)
+
+    def stats(self) -> dict:
+        return {"backend": "redis", "hits": self.hits, "misses": self.misses, "errors": self.errors}
+
+
+def make_backend():
+    if not RESPONSE_CACHE_URL:
+        return MemoryBackend(RESPONSE_CACHE_MAX_BYTES)
+    if redis is None:
+        raise RuntimeError("RESPONSE_CACHE_URL needs the redis package (pip install redis)")
+    return RedisBackend(RESPONSE_CACHE_URL, RESPONSE_CACHE_TTL)
+
+
+backend = make_backend()
+
+
+def library_version_bump(*user_ids: int):
+    """UPDATE версии библиотеки - выполнять в транзакции самой записи, перед коммитом"""
+    users = models.User.__table__
+    return update(users).where(users.c.id.in_(user_ids)).values(library_version=users.c.library_version + 1)
+
+
+class CacheLookup:
+    """
+    Результат проверки кеша: response - готовый ответ (из кеша или 304),
+    иначе эндпоинт строит содержимое и отдаёт его через respond().
+    """
+
+    def __init__(self, key: Optional[str] = None, etag: Optional[str] = None, response: Optional[Response] = None):
+        self.key = key
+        self.etag = etag
+        self.response = response
+
+    def _headers(self, headers: Optional[Dict[str, str]] = None) -> Dict[str, str]:
+        headers = dict(headers or {})
+        if self.etag is not None:
+            headers["ETag"] = self.etag
+            headers["Cache-Control"] = CACHE_CONTROL
+        return headers
+
+    async def respond(self, content, headers: Optional[Dict[str, str]] = None) -> Response:
+        """Ответ из содержимого, как у JSONResponse"""
+        return await self.respond_body(JSONResponse(jsonable_encoder(content)).body, headers)
+
+    async def respond_body(self, body: bytes, headers: Optional[Dict[str, str]] = None) -> Response:
+        """Ответ из уже закодированного JSON"""
+        if self.key is not None:
+            saved = {name: value for name, value in (headers or {}).items() if name.lower() in CACHED_HEADERS}
+            await backend.set(self.key, CachedResponse(body, saved))
+        return Response(body, media_type="application/json", headers=self._headers(headers))
+
+
+async def lookup(request, db, user_id: int, bypass: bool = False) -> CacheLookup:
+    """
+    bypass - не кешировать и не выдавать ETag (ответ зависит не только от
+    базы, например от прогресса в буфере отложенной записи)
+    """
+    if bypass:
+        return CacheLookup()
+    version = await db.scalar(select(models.User.library_version).where(models.User.id == user_id))
+    if version is None:
+        return CacheLookup()
+    opaque_tag = f'"{user_id}-{version}"'
+    # Слабый ETag: тело может быть сжато по пути к клиенту
+    lookup_result = CacheLookup(f"{user_id}:{version}:{request.url}", "W/" + opaque_tag)
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None and etag_matches(if_none_match, opaque_tag):
+        lookup_result.response = Response(status_code=304, headers=lookup_result._headers())
+        return lookup_result
+    cached = await backend.get(lookup_result.key)
+    if cached is not None:
+        lookup_result.response = Response(
+            cached.body, media_type="application/json", headers=lookup_result._headers(cached.headers)
+        )
+    return lookup_result
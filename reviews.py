@@ -0,0 +1,91 @@
+"""
+Рецензии и их агрегаты.
+У каждой книги хранятся счётчики review_count и rating_sum - они меняются
+в той же транзакции, что и сами рецензии (добавление, изменение оценки,
+удаление), одним UPDATE books SET ... = ... + :delta. Средняя оценка к
+списку книг (include=review_stats) берётся из уже загруженных строк книг,
+без AVG по рецензиям.
+
+Изменение счётчиков блокирует строку книги до конца транзакции, поэтому
+одновременные изменения рецензий одной книги не теряют обновлений.
+"""
+from typing import Optional
+
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+
+import models
+import schemas
+
+books = models.Book.__table__
+
+
+def _change_counters(db: Session, book_filter, count_delta: int, rating_delta: int) -> bool:
+    """Сдвинуть счётчики книги; False - книга не найдена"""
+    result = db.execute(
+        books.update().where(*book_filter).values(
+            review_count=books.c.review_count + count_delta,
+            rating_sum=books.c.rating_sum + rating_delta,
+        )
+    )
+    return result.rowcount > 0
+
+
+def _lock_review(db: Session, user_id: int, book_id: int, review_id: int) -> Optional[models.Review]:
+    return db.query(models.Review).filter(
+        models.Review.id == review_id,
+        models.Review.book_id == book_id,
+        models.Review.user_id == user_id
+    ).with_for_update().populate_existing().first()
+
+
+def add_review(db: Session, user_id: int, book_id: int, review: schemas.ReviewCreate) -> Optional[models.Review]:
+    """Добавить рецензию к своей книге; None - книга не найдена или чужая. Коммит - на вызывающем"""
+    # Проверка владельца и обновление счётчиков - одним запросом
+    if not _change_counters(db, (books.c.id == book_id, books.c.owner_id == user_id), 1, review.rating):
+        return None
+    db_review = models.Review(user_id=user_id, book_id=book_id, rating=review.rating, text=review.text)
+    db.add(db_review)
+    db.flush()
+    return db_review
+
+
+def update_review(db: Session, user_id: int, book_id: int, review_id: int, review: schemas.ReviewCreate) -> Optional[models.Review]:
+    """Изменить свою рецензию; None - не найдена. Коммит - на вызывающем"""
+    db_review = _lock_review(db, user_id, book_id, review_id)
+    if db_review is None:
+        return None
+    if review.rating != db_review.rating:
+        _change_counters(db, (books.c.id == book_id,), 0, review.rating - db_review.rating)
+    db_review.rating = review.rating
+    db_review.text = review.text
+    db.flush()
+    return db_review
+
+
+def delete_review(db: Session, user_id: int, book_id: int, review_id: int) -> bool:
+    """Удалить свою рецензию; False - не найдена. Коммит - на вызывающем"""
+    db_review = _lock_review(db, user_id, book_id, review_id)
+    if db_review is None:
+        return False
+    _change_counters(db, (books.c.id == book_id,), -1, -db_review.rating)
+    db.delete(db_review)
+    db.flush()
+    return True
+
+
+def review_stats(book: models.Book) -> schemas.ReviewStats:
+    """Агрегаты рецензий из счётчиков книги"""
+    average = book.rating_sum / book.review_count if book.review_count else None
+    return schemas.ReviewStats(review_count=book.review_count, average_rating=average)
+
+
+def recount(conn):
+    """Пересчитать счётчики всех книг по таблице reviews (для баз, где их ещё не было)"""
+    result = conn.execute(text(
+        "UPDATE books SET "
+        "review_count = (SELECT COUNT(*) FROM reviews WHERE reviews.book_id = books.id), "
+        "rating_sum = (SELECT COALESCE(SUM(rating), 0) FROM reviews WHERE reviews.book_id = books.id)"
+    ))
+    conn.commit()
+    return result.rowcount
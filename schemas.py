@@ -1,5 +1,5 @@
 from pydantic import BaseModel
-from datetime import datetime
+from datetime import date, datetime
 from typing import Optional, List
 
 class UserBase(BaseModel):
@@ -43,6 +43,8 @@ class BookResponse(BookBase):
     id: int
     owner_id: int
     created_at: datetime
+    page_count: Optional[int] = None
+    thumbnail_path: Optional[str] = None
     
     class Config:
         from_attributes = True
@@ -69,3 +71,47 @@ class ReviewResponse(ReviewBase):
     
     class Config:
         from_attributes = True
+
+class ReviewStats(BaseModel):
+    review_count: int
+    average_rating: Optional[float] = None
+
+class LibraryBookResponse(BookResponse):
+    # Заполняются только если запрошены через ?include=...
+    progress: Optional[ReadingProgressResponse] = None
+    review_stats: Optional[ReviewStats] = None
+
+class DailyReadingResponse(BaseModel):
+    day: date
+    pages_read: int
+    reading_minutes: int
+
+class ReadingStatsResponse(BaseModel):
+    total_pages_read: int
+    finished_books: int
+    current_streak: int
+    longest_streak: int
+    reading_hours: float
+    average_pages_per_hour: Optional[float] = None
+    daily: List[DailyReadingResponse]
+
+class PdfJobResponse(BaseModel):
+    book_id: int
+    status: str
+    attempts: int
+    error: Optional[str] = None
+    created_at: datetime
+    started_at: Optional[datetime] = None
+    finished_at: Optional[datetime] = None
+    
+    class Config:
+        from_attributes = True
+
+class ImportRowError(BaseModel):
+    row: int
+    error: str
+
+class ImportResult(BaseModel):
+    imported: int
+    failed: int
+    errors: List[ImportRowError]
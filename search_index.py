@@ -0,0 +1,239 @@
+"""
+Полнотекстовый поиск по книгам (название, автор, описание и текст из PDF).
+
+SQLite: FTS5-таблица books_fts без собственной копии текста (content=''),
+синхронизируется триггерами на books и book_texts - create_book,
+update_book, delete_book и обработка PDF (pdf_jobs) обновляют индекс в той
+же транзакции. Владелец книги хранится
+в индексе отдельным токеном (u<owner_id>), поэтому поиск пересекает списки
+документов пользователя и слов запроса, а не фильтрует чужие совпадения.
+Ранжируются только SEARCH_RANK_WINDOW самых новых совпадений - частое слово
+не заставляет ранжировать всю библиотеку. Окно одно для всех страниц, поэтому
+страницы не пересекаются; дальше окна результатов нет (truncated - совпадений
+было больше). Релевантность: совпадения в
+названии важнее совпадений в авторе, книги, где слово нашлось только в
+описании или тексте PDF, - ниже всех; при равенстве новые книги выше. bm25 из FTS5 не
+используется: он пересчитывает частоту каждого слова по всему индексу и на
+частых словах стоит десятки миллисекунд. Позиции слов не хранятся
+(detail=column) - префиксные запросы по частым словам читают меньше данных;
+для коротких префиксов (2-3 символа) есть префиксный индекс.
+
+PostgreSQL: GIN-индексы по tsvector полей книги (с теми же весами) и текста
+из PDF, ранжирование ts_rank в том же окне.
+
+Если SQLite собран без FTS5 - поиск через LIKE (медленно, но работает).
+"""
+import logging
+import os
+import re
+from typing import List, NamedTuple
+
+from sqlalchemy import text
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import Session
+
+logger = logging.getLogger(__name__)
+
+# Не больше стольких слов из запроса
+MAX_QUERY_TERMS = 10
+
+# Сколько совпадений (самых новых) ранжировать
+SEARCH_RANK_WINDOW = int(os.getenv("SEARCH_RANK_WINDOW", "1000"))
+
+# Вес совпадения слова в поле книги; совпадения только в описании ранжируются ниже всех
+FIELD_WEIGHTS = {"title": 2, "author": 1}
+
+FTS_COLUMNS = "owner, title, author, description, pdf_text"
+
+
+class SearchResult(NamedTuple):
+    ids: List[int]
+    truncated: bool  # совпадений больше SEARCH_RANK_WINDOW - старые не ранжировались
+
+# Строка индекса книги: поля books + текст из PDF (book_texts), если он уже извлечён
+FTS_BOOK_ROW = (
+    "'u' || {row}.owner_id, {row}.title, {row}.author, {row}.description, "
+    "(SELECT content FROM book_texts WHERE book_texts.book_id = {row}.id)"
+)
+FTS_TEXT_ROW = "'u' || books.owner_id, books.title, books.author, books.description, {content}"
+
+
+def _fts_insert(values: str) -> str:
+    return f"INSERT INTO books_fts(rowid, {FTS_COLUMNS}) {values};"
+
+
+def _fts_delete(values: str) -> str:
+    # Для таблицы без копии текста удаление - это команда 'delete' с прежними значениями
+    return f"INSERT INTO books_fts(books_fts, rowid, {FTS_COLUMNS}) {values};"
+
+
+# Триггеры поддерживают инвариант: строка books_fts = поля книги + её текущий текст
+SQLITE_DDL = [
+    f"CREATE VIRTUAL TABLE IF NOT EXISTS books_fts USING fts5({FTS_COLUMNS}, "
+    "content='', detail=column, prefix='2 3', tokenize='unicode61 remove_diacritics 2')",
+    "CREATE TRIGGER IF NOT EXISTS books_fts_insert AFTER INSERT ON books BEGIN "
+    + _fts_insert(f"VALUES (new.id, {FTS_BOOK_ROW.format(row='new')})") + " END",
+    "CREATE TRIGGER IF NOT EXISTS books_fts_delete AFTER DELETE ON books BEGIN "
+    + _fts_delete(f"VALUES ('delete', old.id, {FTS_BOOK_ROW.format(row='old')})") + " END",
+    "CREATE TRIGGER IF NOT EXISTS books_fts_update AFTER UPDATE OF title, author, description, owner_id ON books BEGIN "
+    + _fts_delete(f"VALUES ('delete', old.id, {FTS_BOOK_ROW.format(row='old')})")
+    + _fts_insert(f"VALUES (new.id, {FTS_BOOK_ROW.format(row='new')})") + " END",
+    # Текст появляется после обработки PDF (pdf_jobs); без книги (уже удалена) SELECT пуст
+    "CREATE TRIGGER IF NOT EXISTS book_texts_fts_insert AFTER INSERT ON book_texts BEGIN "
+    + _fts_delete(f"SELECT 'delete', books.id, {FTS_TEXT_ROW.format(content='NULL')} FROM books WHERE books.id = new.book_id")
+    + _fts_insert(f"SELECT books.id, {FTS_TEXT_ROW.format(content='new.content')} FROM books WHERE books.id = new.book_id")
+    + " END",
+    "CREATE TRIGGER IF NOT EXISTS book_texts_fts_update AFTER UPDATE OF content ON book_texts BEGIN "
+    + _fts_delete(f"SELECT 'delete', books.id, {FTS_TEXT_ROW.format(content='old.content')} FROM books WHERE books.id = old.book_id")
+    + _fts_insert(f"SELECT books.id, {FTS_TEXT_ROW.format(content='new.content')} FROM books WHERE books.id = new.book_id")
+    + " END",
+    "CREATE TRIGGER IF NOT EXISTS book_texts_fts_delete AFTER DELETE ON book_texts BEGIN "
+    + _fts_delete(f"SELECT 'delete', books.id, {FTS_TEXT_ROW.format(content='old.content')} FROM books WHERE books.id = old.book_id")
+    + _fts_insert(f"SELECT books.id, {FTS_TEXT_ROW.format(content='NULL')} FROM books WHERE books.id = old.book_id")
+    + " END",
+]
+
+# Индекс старой версии (без текста из PDF) пересоздаётся
+SQLITE_OLD_OBJECTS = ["books_fts_insert", "books_fts_delete", "books_fts_update"]
+
+# Выражение индекса и запроса должно совпадать символ в символ
+PG_DOCUMENT = (
+    "setweight(to_tsvector('simple', coalesce(books.title, '')), 'A') || "
+    "setweight(to_tsvector('simple', coalesce(books.author, '')), 'B') || "
+    "setweight(to_tsvector('simple', coalesce(books.description, '')), 'C')"
+)
+PG_TEXT_DOCUMENT = "to_tsvector('simple', book_texts.content)"
+
+# None - ещё не проверяли; False - SQLite без FTS5
+fts_available = None
+
+
+def ensure_search_index(conn) -> bool:
+    """Создать индекс и триггеры, если их нет; новый индекс заполняется по books"""
+    global fts_available
+    if conn.dialect.name == "postgresql":
+        conn.execute(text(f"CREATE INDEX IF NOT EXISTS ix_books_search ON books USING gin (({PG_DOCUMENT}))"))
+        conn.execute(text(f"CREATE INDEX IF NOT EXISTS ix_book_texts_search ON book_texts USING gin (({PG_TEXT_DOCUMENT}))"))
+        conn.commit()
+        return True
+
+    exists = conn.execute(text("SELECT 1 FROM sqlite_master WHERE name = 'books_fts'")).first() is not None
+    try:
+        if exists and "pdf_text" not in {row[1] for row in conn.execute(text("PRAGMA table_info(books_fts)"))}:
+            print("❌ Поисковый индекс books_fts без текста из PDF. Пересоздаём...")
+            for trigger in SQLITE_OLD_OBJECTS:
+                conn.execute(text(f"DROP TRIGGER IF EXISTS {trigger}"))
+            conn.execute(text("DROP TABLE books_fts"))
+            exists = False
+        for statement in SQLITE_DDL:
+            conn.execute(text(statement))
+        if not exists:
+            conn.execute(text(
+                f"INSERT INTO books_fts(rowid, {FTS_COLUMNS}) "
+                f"SELECT books.id, {FTS_TEXT_ROW.format(content='book_texts.content')} "
+                "FROM books LEFT JOIN book_texts ON book_texts.book_id = books.id"
+            ))
+            print("✅ Поисковый индекс books_fts создан")
+        conn.commit()
+    except OperationalError as fts_error:
+        conn.rollback()
+        fts_available = False
+        logger.warning("FTS5 is not available, search falls back to LIKE: %s", fts_error)
+        return False
+    fts_available = True
+    return True
+
+
+def detect_search_index(conn) -> bool:
+    """Есть ли индекс (без создания) - при старте процесса, индекс создают миграции"""
+    global fts_available
+    if conn.dialect.name == "postgresql":
+        return True
+    fts_available = conn.execute(text("SELECT 1 FROM sqlite_master WHERE name = 'books_fts'")).first() is not None
+    conn.commit()
+    return fts_available
+
+
+def query_terms(query: str) -> List[str]:
+    """Слова запроса: буквы и цифры, без операторов FTS"""
+    return re.findall(r"[^\W_]+", query.lower())[:MAX_QUERY_TERMS]
+
+
+def relevance(patterns: List[re.Pattern], book) -> int:
+    """Взвешенное число слов в полях книги, начинающихся со слов запроса"""
+    score = 0
+    for field, weight in FIELD_WEIGHTS.items():
+        value = (getattr(book, field) or "").lower()
+        for pattern in patterns:
+            score += weight * len(pattern.findall(value))
+    return score
+
+
+def _fts_ids(db: Session, owner_id: int, terms: List[str], limit: int, offset: int):
+    # Каждое слово - префикс; все слова должны встретиться в названии, авторе или описании
+    query = " AND ".join(f'"{term}"*' for term in terms)
+    match = f'owner : "u{owner_id}" AND {{title author description pdf_text}} : ({query})'
+    # Совпадения перебираются от новых к старым и обрываются на окне (+1 - узнать, есть ли ещё)
+    rows = db.execute(text(
+        "SELECT id, title, author FROM books WHERE id IN ("
+        "SELECT rowid FROM books_fts WHERE books_fts MATCH :match ORDER BY rowid DESC LIMIT :window + 1)"
+    ), {"match": match, "window": SEARCH_RANK_WINDOW}).all()
+    truncated = len(rows) > SEARCH_RANK_WINDOW
+    if truncated:
+        rows = sorted(rows, key=lambda row: -row.id)[:SEARCH_RANK_WINDOW]
+    # Начало слова: перед ним не буква и не цифра
+    patterns = [re.compile(r"(?<![^\W_])" + re.escape(term)) for term in terms]
+    rows.sort(key=lambda row: (-relevance(patterns, row), -row.id))
+    return SearchResult([row.id for row in rows[offset:offset + limit]], truncated)
+
+
+def _pg_ids(db: Session, owner_id: int, terms: List[str], limit: int, offset: int):
+    tsquery = " & ".join(f"{term}:*" for term in terms)
+    rows = db.execute(text(
+        f"SELECT id, truncated FROM ("
+        f"SELECT id, score, COUNT(*) OVER () > :window AS truncated, "
+        f"ROW_NUMBER() OVER (ORDER BY id DESC) AS position FROM ("
+        f"SELECT books.id, ts_rank({PG_DOCUMENT}, to_tsquery('simple', :tsquery)) AS score FROM books "
+        f"WHERE books.owner_id = :owner_id AND (({PG_DOCUMENT}) @@ to_tsquery('simple', :tsquery) "
+        f"OR books.id IN (SELECT book_id FROM book_texts WHERE {PG_TEXT_DOCUMENT} @@ to_tsquery('simple', :tsquery))) "
+        f"ORDER BY books.id DESC LIMIT :window + 1"
+        f") AS probe) AS matches "
+        f"WHERE position <= :window ORDER BY score DESC, id DESC LIMIT :limit OFFSET :offset"
+    ), {
+        "owner_id": owner_id,
+        "tsquery": tsquery,
+        "window": SEARCH_RANK_WINDOW,
+        "limit": limit,
+        "offset": offset,
+    }).all()
+    # Пустая страница за окном - признак неизвестен, но и следующей страницы нет
+    return SearchResult([row.id for row in rows], bool(rows) and rows[0].truncated)
+
+
+def _like_ids(db: Session, owner_id: int, terms: List[str], limit: int, offset: int):
+    conditions = []
+    params = {"owner_id": owner_id, "limit": limit, "offset": offset}
+    for i, term in enumerate(terms):
+        params[f"term{i}"] = f"%{term}%"
+        conditions.append(
+            f"(title LIKE :term{i} OR author LIKE :term{i} OR COALESCE(description, '') LIKE :term{i} "
+            f"OR COALESCE(book_texts.content, '') LIKE :term{i})"
+        )
+    ids = db.execute(text(
+        f"SELECT id FROM books LEFT JOIN book_texts ON book_texts.book_id = books.id "
+        f"WHERE owner_id = :owner_id AND {' AND '.join(conditions)} "
+        f"ORDER BY title, id LIMIT :limit OFFSET :offset"
+    ), params).scalars().all()
+    return SearchResult(ids, False)
+
+
+def search_book_ids(db: Session, owner_id: int, query: str, limit: int, offset: int = 0) -> SearchResult:
+    """id книг владельца, подходящих под запрос, от самых релевантных"""
+    terms = query_terms(query)
+    if not terms:
+        return SearchResult([], False)
+    if db.get_bind().dialect.name == "postgresql":
+        return _pg_ids(db, owner_id, terms, limit, offset)
+    if fts_available is False:
+        return _like_ids(db, owner_id, terms, limit, offset)
+    return _fts_ids(db, owner_id, terms, limit, offset)
@@ -0,0 +1,194 @@
+"""
+Запуск в продакшене: несколько процессов uvicorn на одном порту.
+
+    python serve.py                      # WEB_CONCURRENCY воркеров на порту 8005
+    python serve.py --workers 4 --port 8000
+
+Родительский процесс один раз импортирует приложение, применяет миграции,
+собирает статику и открывает сокет, затем запускает воркеры через fork:
+код уже загружен, поэтому воркер готов принимать запросы за миллисекунды.
+Время импорта, подготовки и запуска каждого воркера печатается и
+отдаётся в /metrics (process_startup_seconds).
+
+SIGTERM или SIGINT: воркеры перестают принимать соединения, дожидаются
+текущих запросов (не дольше GRACEFUL_TIMEOUT секунд), записывают отложенный
+прогресс и останавливают фоновые задачи. Упавший воркер перезапускается.
+
+Состояние в памяти у каждого воркера своё, поэтому с несколькими воркерами
+запуск отклоняется при PROGRESS_WRITE_BEHIND=1 (прогресс из буфера одного
+воркера не видят другие) и при кеше ответов в памяти без RESPONSE_CACHE_URL.
+"""
+import argparse
+import os
+import signal
+import sys
+import time
+
+STARTED = time.perf_counter()
+
+# Больше 1 - с общим кешем ответов (multiprocess_problems), обычно по числу CPU
+WEB_CONCURRENCY = int(os.getenv("WEB_CONCURRENCY", "1"))
+GRACEFUL_TIMEOUT = int(os.getenv("GRACEFUL_TIMEOUT", "30"))
+# Воркер, проживший меньше, перезапускается с паузой - не крутить падения в цикле
+MIN_WORKER_UPTIME = 5
+
+_forked_at = None
+
+
+def _ms(seconds: float) -> str:
+    return f"{seconds * 1000:.0f} мс"
+
+
+def worker_ready():
+    """Последний обработчик startup: воркер готов принимать запросы"""
+    import metrics
+
+    if _forked_at is None:
+        return
+    seconds = time.perf_counter() - _forked_at
+    metrics.startup_seconds["worker"] = seconds
+    print(f"✅ Воркер {os.getpid()} готов за {_ms(seconds)} ({_ms(time.perf_counter() - STARTED)} с запуска)", flush=True)
+
+
+def run_worker(config, sock) -> int:
+    global _forked_at
+    import uvicorn
+
+    _forked_at = time.perf_counter()
+    # Сигналы обрабатывает сам uvicorn: останавливает приём и ждёт текущие запросы
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    signal.signal(signal.SIGINT, signal.SIG_DFL)
+    server = uvicorn.Server(config)
+    server.run(sockets=[sock])
+    return 0 if server.started else 3  # 3 - ошибка запуска, как у uvicorn
+
+
+def spawn_worker(config, sock) -> int:
+    sys.stdout.flush()
+    sys.stderr.flush()
+    pid = os.fork()
+    if pid == 0:
+        code = 1
+        try:
+            code = run_worker(config, sock)
+        finally:
+            # Не возвращаться в цикл родителя
+            os._exit(code)
+    return pid
+
+
+def supervise(config, sock, workers: int):
+    children = {}  # pid -> время запуска
+    stopping = False
+    deadline = None
+
+    def stop(signum, frame):
+        nonlocal stopping, deadline
+        if stopping:
+            return
+        stopping = True
+        deadline = time.monotonic() + GRACEFUL_TIMEOUT + 5
+        print(f"🛑 {signal.Signals(signum).name}: завершаем {len(children)} воркеров...", flush=True)
+        for pid in children:
+            os.kill(pid, signal.SIGTERM)
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    for _ in range(workers):
+        children[spawn_worker(config, sock)] = time.monotonic()
+
+    while children:
+        pid, status = os.waitpid(-1, os.WNOHANG)
+        if pid == 0:
+            if deadline is not None and time.monotonic() > deadline:
+                print(f"⚠️ Воркеры не завершились за {GRACEFUL_TIMEOUT} с, останавливаем принудительно", flush=True)
+                for child in children:
+                    os.kill(child, signal.SIGKILL)
+                deadline = None
+            time.sleep(0.1)
+            continue
+        started = children.pop(pid, None)
+        if started is None or stopping:
+            continue
+        code = os.waitstatus_to_exitcode(status)
+        print(f"⚠️ Воркер {pid} завершился с кодом {code}, перезапуск", flush=True)
+        if time.monotonic() - started < MIN_WORKER_UPTIME:
+            time.sleep(1)
+        if not stopping:
+            children[spawn_worker(config, sock)] = time.monotonic()
+    print("✅ Все воркеры завершены", flush=True)
+
+
+def multiprocess_problems(workers: int):
+    """Настройки, которые работают только в одном процессе"""
+    import progress_writer
+    import response_cache
+
+    if workers <= 1:
+        return []
+    problems = []
+    if progress_writer.PROGRESS_WRITE_BEHIND:
+        problems.append(
+            "PROGRESS_WRITE_BEHIND=1: отложенный прогресс хранится в памяти воркера, "
+            "другие воркеры отдают устаревший прогресс до записи - выключите его или запустите --workers 1"
+        )
+    if not response_cache.RESPONSE_CACHE_URL and response_cache.RESPONSE_CACHE_MAX_BYTES > 0:
+        problems.append(
+            "кеш ответов в памяти у каждого воркера свой - задайте общий RESPONSE_CACHE_URL "
+            "или выключите кеш (RESPONSE_CACHE_MAX_BYTES=0)"
+        )
+    return problems
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Запуск Book Tracker в несколько процессов")
+    parser.add_argument("--workers", type=int, default=WEB_CONCURRENCY)
+    parser.add_argument("--host", default=os.getenv("HOST", "0.0.0.0"))
+    parser.add_argument("--port", type=int, default=int(os.getenv("PORT", "8005")))
+    args = parser.parse_args()
+
+    import uvicorn
+    import main as app_main
+    import metrics
+    import migrations
+    import static_assets
+    from database import engine, read_engine
+
+    imported = time.perf_counter()
+    metrics.startup_seconds["import"] = imported - STARTED
+    print(f"📦 Приложение импортировано за {_ms(imported - STARTED)}", flush=True)
+
+    problems = multiprocess_problems(args.workers if hasattr(os, "fork") else 1)
+    if problems:
+        for problem in problems:
+            print(f"❌ {args.workers} воркеров: {problem}", flush=True)
+        sys.exit(1)
+
+    # Однократная подготовка до запуска воркеров
+    applied = migrations.upgrade(engine)
+    static_assets.build()
+    # Соединения не должны достаться воркерам через fork
+    engine.dispose()
+    if read_engine is not engine:
+        read_engine.dispose()
+    initialized = time.perf_counter()
+    metrics.startup_seconds["init"] = initialized - imported
+    print(f"🔄 Схема версии {migrations.LATEST_VERSION} (применено миграций: {applied}), "
+          f"статика собрана за {_ms(initialized - imported)}", flush=True)
+
+    app_main.app.add_event_handler("startup", worker_ready)
+    config = uvicorn.Config(app_main.app, host=args.host, port=args.port, timeout_graceful_shutdown=GRACEFUL_TIMEOUT)
+    if not hasattr(os, "fork"):
+        # Windows: один процесс
+        uvicorn.Server(config).run()
+        return
+    # Протокол, цикл событий и логирование загружаются тоже до fork
+    config.load()
+    sock = config.bind_socket()
+    print(f"🚀 {args.workers} воркеров на http://{args.host}:{args.port}", flush=True)
+    supervise(config, sock, max(1, args.workers))
+    sock.close()
+
+
+if __name__ == "__main__":
+    main()
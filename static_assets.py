@@ -0,0 +1,170 @@
+"""
+Веб-интерфейс и статика, подготовленные при старте.
+
+Для templates/index.html и каждого файла из static/ в ASSET_BUILD_DIR
+записывается копия с хешем содержимого в имени (app.3f9a1c2b7d4e.js) и
+заранее сжатые варианты (.gz, .br - если установлен brotli) с максимальным
+сжатием. Ссылки /static/... в index.html заменяются адресами с хешем.
+
+- /static/<имя с хешем> - Cache-Control: immutable на год: новое содержимое
+  получит новый адрес, поэтому браузер не спрашивает сервер вовсе;
+- /static/<исходное имя> и / - ETag по хешу и no-cache: повторный визит -
+  304 без тела.
+
+Имена содержат хеш, поэтому несколько процессов пишут одинаковые файлы и
+друг другу не мешают. Файлы, добавленные в static/ после старта, видны после
+перезапуска.
+"""
+import hashlib
+import mimetypes
+import os
+import re
+from dataclasses import dataclass, field
+from typing import Dict, Optional
+
+from fastapi import Request, Response
+from fastapi.responses import FileResponse
+from starlette.concurrency import run_in_threadpool
+
+import compression
+from pdf_delivery import etag_matches
+
+STATIC_DIR = "static"
+INDEX_PAGE = "templates/index.html"
+ASSET_BUILD_DIR = os.getenv("ASSET_BUILD_DIR", "build/assets")
+
+IMMUTABLE = "public, max-age=31536000, immutable"
+REVALIDATE = "no-cache"
+HASH_LENGTH = 12
+
+# Что имеет смысл сжимать; картинки и шрифты уже сжаты
+PRECOMPRESS_TYPES = ("text/", "application/javascript", "application/json", "application/xml", "image/svg+xml")
+STATIC_REFERENCE = re.compile(r"""(?<=["'(])/static/([^"'()?#\s]+)""")
+
+
+@dataclass(frozen=True)
+class Asset:
+    path: str  # файл без сжатия в каталоге сборки
+    url_name: str  # имя с хешем относительно /static
+    media_type: str
+    digest: str
+    variants: Dict[str, str] = field(default_factory=dict)  # кодировка -> файл, в порядке предпочтения
+
+    def etag(self, encoding: Optional[str] = None) -> str:
+        return f'"{self.digest}-{encoding}"' if encoding else f'"{self.digest}"'
+
+    def not_modified(self, if_none_match: str) -> bool:
+        # У клиента может быть любой из вариантов - содержимое одно
+        return any(etag_matches(if_none_match, self.etag(encoding)) for encoding in (None, *self.variants))
+
+
+@dataclass
+class Manifest:
+    index: Asset
+    by_name: Dict[str, Asset]  # исходное имя в static/ -> файл
+    by_url: Dict[str, Asset]  # имя с хешем -> файл
+
+    def url(self, name: str) -> str:
+        return "/static/" + self.by_name[name].url_name
+
+
+_manifest: Optional[Manifest] = None
+
+
+def _write(path: str, data: bytes):
+    if os.path.exists(path):
+        return
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+
+
+def _build_asset(name: str, data: bytes) -> Asset:
+    digest = hashlib.sha256(data).hexdigest()[:HASH_LENGTH]
+    stem, ext = os.path.splitext(name)
+    url_name = f"{stem}.{digest}{ext}"
+    media_type = mimetypes.guess_type(name)[0] or "application/octet-stream"
+    path = os.path.join(ASSET_BUILD_DIR, url_name)
+    _write(path, data)
+    variants = {}
+    if media_type.startswith(PRECOMPRESS_TYPES):
+        for encoding in compression.ENCODINGS:
+            variant_path = f"{path}.{'br' if encoding == 'br' else 'gz'}"
+            if not os.path.exists(variant_path):
+                compressed = compression.compress(data, encoding, best=True)
+                if len(compressed) >= len(data):
+                    continue
+                _write(variant_path, compressed)
+            variants[encoding] = variant_path
+    return Asset(path, url_name, media_type, digest, variants)
+
+
+def build() -> Manifest:
+    """Собирает копии с хешами и сжатые варианты; повторный вызов дописывает только новое"""
+    global _manifest
+    by_name = {}
+    for root, dirs, files in os.walk(STATIC_DIR):
+        dirs[:] = sorted(d for d in dirs if not d.startswith("."))
+        for filename in sorted(files):
+            if filename.startswith("."):
+                continue
+            file_path = os.path.join(root, filename)
+            name = os.path.relpath(file_path, STATIC_DIR).replace(os.sep, "/")
+            with open(file_path, "rb") as f:
+                by_name[name] = _build_asset(name, f.read())
+
+    with open(INDEX_PAGE, encoding="utf-8") as f:
+        page = f.read()
+
+    def hashed_url(match):
+        asset = by_name.get(match.group(1))
+        return "/static/" + asset.url_name if asset is not None else match.group(0)
+
+    page = STATIC_REFERENCE.sub(hashed_url, page)
+    index = _build_asset(os.path.basename(INDEX_PAGE), page.encode("utf-8"))
+    _manifest = Manifest(index, by_name, {asset.url_name: asset for asset in by_name.values()})
+    return _manifest
+
+
+def ensure_built() -> Manifest:
+    """Собранное при старте; serve.py собирает один раз в родительском процессе"""
+    return _manifest if _manifest is not None else build()
+
+
+async def get_manifest() -> Manifest:
+    # Без события startup (например, TestClient без with) - при первом запросе
+    if _manifest is None:
+        return await run_in_threadpool(build)
+    return _manifest
+
+
+def asset_response(request: Request, asset: Asset, cache_control: str) -> Response:
+    encoding = compression.negotiate(request.headers.get("accept-encoding"), asset.variants)
+    headers = {"ETag": asset.etag(encoding), "Cache-Control": cache_control}
+    if asset.variants:
+        headers["Vary"] = "Accept-Encoding"
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None and asset.not_modified(if_none_match):
+        return Response(status_code=304, headers=headers)
+    if encoding is not None:
+        headers["Content-Encoding"] = encoding
+    return FileResponse(asset.variants.get(encoding, asset.path), media_type=asset.media_type, headers=headers)
+
+
+async def index_response(request: Request) -> Response:
+    manifest = await get_manifest()
+    return asset_response(request, manifest.index, REVALIDATE)
+
+
+async def static_response(request: Request, path: str) -> Optional[Response]:
+    """None - такого файла нет"""
+    manifest = await get_manifest()
+    asset = manifest.by_url.get(path)
+    if asset is not None:
+        return asset_response(request, asset, IMMUTABLE)
+    asset = manifest.by_name.get(path)
+    if asset is not None:
+        return asset_response(request, asset, REVALIDATE)
+    return None
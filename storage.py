@@ -0,0 +1,282 @@
+"""
+Хранилище загруженных PDF файлов.
+Файлы адресуются по содержимому: имя файла - SHA-256 его байтов, поэтому
+одинаковые PDF разных пользователей хранятся на диске один раз. Ссылками
+на файл служат строки books.pdf_path; файл удаляется, когда ссылок не осталось.
+
+Загрузка читается частями фиксированного размера в отдельном потоке
+(не блокируя event loop): первый проход считает контрольную сумму и проверяет
+файл, второй - только если такого файла ещё нет - пишет его во временный файл
+и атомарно переименовывает в uploads/pdf.
+
+Обложки, отрисованные из PDF (pdf_jobs), адресуются так же - по SHA-256
+PDF (uploads/thumbnails/<sha256>.png) - и удаляются вместе с PDF.
+
+Проверка ссылок и удаление файла, а также проверка наличия файла после
+коммита новой книги (ensure_blob) идут под одной блокировкой файла
+(BlobLock), общей для всех процессов приложения на этом диске.
+"""
+import hashlib
+import os
+import tempfile
+import threading
+from dataclasses import dataclass
+from typing import Optional
+
+try:
+    import fcntl
+except ImportError:  # Windows: serve.py запускает один процесс - хватает блокировки потоков
+    fcntl = None
+
+from fastapi import HTTPException, UploadFile
+from sqlalchemy.orm import Session
+from starlette.concurrency import run_in_threadpool
+
+import metrics
+
+PDF_UPLOAD_DIR = os.getenv("PDF_UPLOAD_DIR", "uploads/pdf")
+MAX_PDF_SIZE = int(os.getenv("MAX_PDF_SIZE", str(100 * 1024 * 1024)))  # 100 МБ
+UPLOAD_CHUNK_SIZE = int(os.getenv("UPLOAD_CHUNK_SIZE", str(1024 * 1024)))  # 1 МБ
+THUMBNAIL_DIR = os.getenv("THUMBNAIL_DIR", "uploads/thumbnails")
+PDF_MAGIC = b"%PDF-"
+BLOB_LOCK_DIR = os.path.join(PDF_UPLOAD_DIR, ".locks")
+BLOB_LOCK_STRIPES = 256  # файлов блокировок; разные PDF изредка делят одну - это только ожидание
+
+
+@dataclass
+class StoredFile:
+    path: str
+    size: int
+    sha256: str
+
+
+def _open_temp_file(directory: str = PDF_UPLOAD_DIR):
+    os.makedirs(directory, exist_ok=True)
+    return tempfile.NamedTemporaryFile(dir=directory, prefix=".upload-", suffix=".part", delete=False)
+
+
+def _finish(buffer, target_path: str):
+    buffer.flush()
+    os.fsync(buffer.fileno())
+    buffer.close()
+    os.replace(buffer.name, target_path)
+
+
+def _discard(buffer):
+    buffer.close()
+    try:
+        os.remove(buffer.name)
+    except FileNotFoundError:
+        pass
+
+
+def blob_path(sha256: str) -> str:
+    return os.path.join(PDF_UPLOAD_DIR, f"{sha256}.pdf")
+
+
+def thumbnail_path(sha256: str) -> str:
+    return os.path.join(THUMBNAIL_DIR, f"{sha256}.png")
+
+
+_thread_locks = [threading.Lock() for _ in range(BLOB_LOCK_STRIPES)]
+
+
+class BlobLock:
+    """
+    Блокировка файла PDF между процессами (flock) и потоками. Не повторная:
+    в одном потоке брать один раз. Ждёт, блокируя поток - только в пуле потоков.
+    """
+
+    def __init__(self, pdf_path: str):
+        digest = hashlib.sha256(os.path.normpath(pdf_path).encode()).digest()
+        self.stripe = int.from_bytes(digest[:4], "big") % BLOB_LOCK_STRIPES
+        self._file = None
+
+    def acquire(self):
+        if fcntl is None:
+            _thread_locks[self.stripe].acquire()
+            return
+        os.makedirs(BLOB_LOCK_DIR, exist_ok=True)
+        # flock действует на открытый файл, поэтому потоки одного процесса тоже ждут друг друга
+        lock_file = open(os.path.join(BLOB_LOCK_DIR, f"{self.stripe:02x}.lock"), "a")
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+        except BaseException:
+            lock_file.close()
+            raise
+        self._file = lock_file
+
+    def release(self):
+        if fcntl is None:
+            _thread_locks[self.stripe].release()
+            return
+        lock_file, self._file = self._file, None
+        lock_file.close()  # снимает flock
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.release()
+
+
+def write_file(path: str, data: bytes) -> str:
+    """Записать файл атомарно (временный файл в том же каталоге + переименование)"""
+    buffer = _open_temp_file(os.path.dirname(path))
+    try:
+        buffer.write(data)
+        _finish(buffer, path)
+    except BaseException:
+        _discard(buffer)
+        raise
+    return path
+
+
+def save_thumbnail(sha256: str, data: bytes) -> str:
+    return write_file(thumbnail_path(sha256), data)
+
+
+async def _hash_upload(upload: UploadFile):
+    """Первый проход: проверить сигнатуру и размер, посчитать SHA-256"""
+    hasher = hashlib.sha256()
+    size = 0
+    while True:
+        chunk = await upload.read(UPLOAD_CHUNK_SIZE)
+        if not chunk:
+            break
+        if size == 0 and not chunk.startswith(PDF_MAGIC):
+            raise HTTPException(status_code=400, detail="Uploaded file is not a PDF")
+        size += len(chunk)
+        if size > MAX_PDF_SIZE:
+            raise HTTPException(status_code=413, detail=f"PDF is larger than {MAX_PDF_SIZE} bytes")
+        await run_in_threadpool(hasher.update, chunk)
+    if size == 0:
+        raise HTTPException(status_code=400, detail="Uploaded file is empty")
+    return hasher.hexdigest(), size
+
+
+async def _write_blob(upload: UploadFile, target_path: str):
+    """Второй проход: скопировать загрузку во временный файл и переименовать"""
+    await upload.seek(0)
+    buffer = await run_in_threadpool(_open_temp_file)
+    try:
+        while True:
+            chunk = await upload.read(UPLOAD_CHUNK_SIZE)
+            if not chunk:
+                break
+            await run_in_threadpool(buffer.write, chunk)
+        await run_in_threadpool(_finish, buffer, target_path)
+    except BaseException:
+        await run_in_threadpool(_discard, buffer)
+        raise
+
+
+async def save_pdf_upload(upload: UploadFile) -> StoredFile:
+    """Сохранить загруженный PDF. Ошибки: 400 (не PDF), 413 (слишком большой)"""
+    sha256, size = await _hash_upload(upload)
+    metrics.pdf_uploaded_bytes.inc(amount=size)
+    path = blob_path(sha256)
+    if not await run_in_threadpool(os.path.exists, path):
+        await _write_blob(upload, path)
+    return StoredFile(path=path, size=size, sha256=sha256)
+
+
+async def ensure_blob(upload: UploadFile, stored: StoredFile):
+    """
+    Вызывается после коммита книги: если файл успели удалить как
+    неиспользуемый (параллельное удаление последней книги с тем же PDF),
+    записываем его заново - теперь на него уже есть ссылка в базе.
+    Проверка - под BlobLock: удаление, посчитавшее ссылки до коммита, к этому
+    моменту уже удалило файл, а начатое позже увидит новую книгу.
+    """
+    if not await run_in_threadpool(_blob_exists, stored.path):
+        await _write_blob(upload, stored.path)
+
+
+def _blob_exists(path: str) -> bool:
+    with BlobLock(path):
+        return os.path.exists(path)
+
+
+def file_sha256(path: str) -> str:
+    """Контрольная сумма файла на диске (для PDF, загруженных до её появления)"""
+    hasher = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(UPLOAD_CHUNK_SIZE), b""):
+            hasher.update(chunk)
+    return hasher.hexdigest()
+
+
+def count_references(db: Session, pdf_path: str) -> int:
+    from models import Book
+    return db.query(Book).filter(Book.pdf_path == pdf_path).count()
+
+
+def _remove(path: str):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+def release_pdf(db: Session, pdf_path: str, pdf_sha256: Optional[str] = None) -> bool:
+    """
+    Удалить файл (и его обложку), если на него больше не ссылается ни одна книга.
+    Блокирует поток - из async-кода через run_in_threadpool (release_pdf_in_thread).
+    """
+    from models import Book
+    if not pdf_path:
+        return False
+    with BlobLock(pdf_path):
+        if pdf_sha256 and db.query(Book.id).filter(Book.pdf_sha256 == pdf_sha256).first() is None:
+            _remove(thumbnail_path(pdf_sha256))
+        if count_references(db, pdf_path) > 0:
+            return False
+        _remove(pdf_path)
+        return True
+
+
+def release_pdf_in_thread(session_factory, pdf_path: str, pdf_sha256: Optional[str] = None) -> bool:
+    """release_pdf в потоке пула со своей синхронной сессией, как импорт в library_io"""
+    with session_factory() as db:
+        return release_pdf(db, pdf_path, pdf_sha256)
+
+
+def remove_orphaned_files(db: Session) -> list:
+    """Удалить файлы в uploads/pdf, на которые нет ссылок (остались от старых версий), и их обложки"""
+    from models import Book
+    referenced = {os.path.normpath(path) for (path,) in db.query(Book.pdf_path).filter(Book.pdf_path.isnot(None))}
+    removed = []
+    for name in os.listdir(PDF_UPLOAD_DIR):
+        path = os.path.join(PDF_UPLOAD_DIR, name)
+        if name.startswith(".") or not os.path.isfile(path):
+            continue
+        if os.path.normpath(path) in referenced:
+            continue
+        # Книгу с этим PDF могли добавить после выборки ссылок - пересчитываем под блокировкой
+        with BlobLock(path):
+            if count_references(db, path) == 0:
+                _remove(path)
+                removed.append(path)
+    # Обложки PDF, на которые не ссылается ни одна книга
+    referenced_sha256 = {sha256 for (sha256,) in db.query(Book.pdf_sha256).filter(Book.pdf_sha256.isnot(None))}
+    if os.path.isdir(THUMBNAIL_DIR):
+        for name in os.listdir(THUMBNAIL_DIR):
+            path = os.path.join(THUMBNAIL_DIR, name)
+            if name.startswith(".") or not os.path.isfile(path):
+                continue
+            if os.path.splitext(name)[0] not in referenced_sha256:
+                os.remove(path)
+                removed.append(path)
+    return removed
+
+
+if __name__ == "__main__":
+    from database import SessionLocal
+    db = SessionLocal()
+    try:
+        for path in remove_orphaned_files(db):
+            print(f"🗑️  Удалён неиспользуемый файл {path}")
+    finally:
+        db.close()
@@ -0,0 +1,110 @@
+"""
+Кеш аутентифицированных пользователей: JWT токен -> (id, username).
+Ограничен по размеру (LRU) и по времени жизни записи (TTL, но не дольше
+срока действия самого токена). Записи пользователя сбрасываются при любом
+изменении или удалении строки users через ORM.
+"""
+import os
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Optional
+
+from sqlalchemy import event
+
+AUTH_CACHE_SIZE = int(os.getenv("AUTH_CACHE_SIZE", "10000"))
+AUTH_CACHE_TTL = float(os.getenv("AUTH_CACHE_TTL", "300"))
+
+
+@dataclass(frozen=True)
+class AuthenticatedUser:
+    id: int
+    username: str
+
+
+class UserCache:
+    def __init__(self, maxsize: int, ttl: float):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries = OrderedDict()  # token -> (user, expires_at)
+        self._tokens_by_user = {}  # user_id -> set(token)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, token: str) -> Optional[AuthenticatedUser]:
+        with self._lock:
+            entry = self._entries.get(token)
+            if entry is not None and entry[1] > time.monotonic():
+                self._entries.move_to_end(token)
+                self.hits += 1
+                return entry[0]
+            if entry is not None:
+                self._remove(token)
+            self.misses += 1
+            return None
+
+    def set(self, token: str, user: AuthenticatedUser, token_expires_at: Optional[float] = None):
+        """token_expires_at - unix-время истечения токена (claim exp)"""
+        ttl = self.ttl
+        if token_expires_at is not None:
+            ttl = min(ttl, token_expires_at - time.time())
+        if ttl <= 0 or self.maxsize <= 0:
+            return
+        with self._lock:
+            if token in self._entries:
+                self._remove(token)
+            self._entries[token] = (user, time.monotonic() + ttl)
+            self._tokens_by_user.setdefault(user.id, set()).add(token)
+            while len(self._entries) > self.maxsize:
+                oldest = next(iter(self._entries))
+                self._remove(oldest)
+                self.evictions += 1
+
+    def invalidate_token(self, token: str):
+        with self._lock:
+            self._remove(token)
+
+    def invalidate_user(self, user_id: int):
+        with self._lock:
+            for token in list(self._tokens_by_user.get(user_id, ())):
+                self._remove(token)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._tokens_by_user.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "size": len(self._entries),
+                "maxsize": self.maxsize,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
+
+    def _remove(self, token: str):
+        entry = self._entries.pop(token, None)
+        if entry is None:
+            return
+        tokens = self._tokens_by_user.get(entry[0].id)
+        if tokens is not None:
+            tokens.discard(token)
+            if not tokens:
+                del self._tokens_by_user[entry[0].id]
+
+
+user_cache = UserCache(AUTH_CACHE_SIZE, AUTH_CACHE_TTL)
+
+
+def register_invalidation(user_model):
+    """Сбрасывать кеш при изменении и удалении пользователя"""
+    def invalidate(mapper, connection, target):
+        user_cache.invalidate_user(target.id)
+
+    event.listen(user_model, "after_update", invalidate)
+    event.listen(user_model, "after_delete", invalidate)